@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.run
+    ~~~~~~~~~~~~~~
+
+    Benchmarks of the permission check hot path
+
+    Measures the latency per check and the throughput of the permission
+    managers and cache backends::
+
+        python -m benchmarks.run
+        python -m benchmarks.run --redis-url redis://localhost cached
+
+    Without ``--redis-url``, redis is stood in by fakeredis (if installed),
+    its numbers show the client overhead only. Positional arguments select
+    benchmarks by name.
+
+    :copyright: (c) 2018 by Matthias Riegler.
+    :license: APACHEv2, see LICENSE.md for more details.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+from itertools import count
+from time import perf_counter
+
+from flask import Flask, g
+from flask_chown import (CachedPermissionManager, PermissionManager,
+                         SnapshotPermissionManager)
+from flask_chown.backends import (MemoryBackend, RedisBackend,
+                                  SharedMemoryBackend)
+from flask_chown.permission_manager_snapshot import write_snapshot
+from flask_chown.rule import Rule
+
+#: Registered benchmarks, name -> function returning the timed callable
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """ Registers a benchmark, the decorated function gets the options and
+    returns the callable to time
+    """
+    def decorator(f):
+        BENCHMARKS[name] = f
+        return f
+    return decorator
+
+
+def groups(size):
+    """ :returns: group set of the given size, containing "group0" """
+    return frozenset("group{}".format(i) for i in range(size))
+
+
+def redis_backend(options):
+    """ :returns: `RedisBackend` or `None` if neither redis nor fakeredis is
+                  available
+    """
+    if options.redis_url:
+        return RedisBackend(options.redis_url)
+
+    try:
+        import fakeredis
+    except ImportError:
+        return None
+    return RedisBackend(client=fakeredis.FakeRedis())
+
+
+def backends(options):
+    """ :returns: list of ``(name, backend)`` tuples """
+    result = [("memory", MemoryBackend()),
+              ("shm", SharedMemoryBackend(
+                  os.path.join(options.tmpdir, "cache")))]
+
+    redis = redis_backend(options)
+    if redis is not None:
+        result.append(("redis" if options.redis_url else "fakeredis", redis))
+
+    return result
+
+
+def cached_manager(backend, size=10, **kwargs):
+    """ :returns: `CachedPermissionManager` with an empty namespace """
+    pm = CachedPermissionManager(backend=backend, timeout=3600,
+                                 key_prefix="fcbench", **kwargs)
+    pm.groups_for_user(lambda user: groups(size))
+    pm.invalidate_all()
+    return pm
+
+
+@benchmark("check_granted")
+def bench_check_granted(options):
+    """ Checks in a new application context each (as in a request), by size
+    of the group set. The context alone is measured as a baseline
+    """
+    app = Flask(__name__)
+
+    def in_context(pm):
+        with app.app_context():
+            g.current_user = "user"
+            if pm is not None:
+                pm.check_granted(None, "group0")
+
+    yield "app context only", lambda: in_context(None)
+
+    for size in options.group_sizes:
+        pm = PermissionManager()
+        pm.groups_for_user(lambda user, size=size: groups(size))
+        yield "groups={}".format(size), lambda pm=pm: in_context(pm)
+
+
+@benchmark("check_rule")
+def bench_check_rule(options):
+    """ Rules with multiple groups, by size of the group set """
+    for size in options.group_sizes:
+        pm = PermissionManager()
+        # Prebuilt, so the check is measured rather than the callback
+        user_groups = groups(size)
+        pm.groups_for_user(lambda user, groups=user_groups: groups)
+        rule = Rule(group=["missing", "group0"])
+        yield "groups={}".format(size), lambda pm=pm, rule=rule: \
+            pm._check_groups("user", rule)
+
+
+@benchmark("cached_hit")
+def bench_cached_hit(options):
+    """ Cache hits, per backend and caching mode """
+    for name, backend in backends(options):
+        for cache_groups in (False, True):
+            pm = cached_manager(backend, cache_groups=cache_groups)
+            pm.user_in_group("user", "group0")
+            mode = "sets" if cache_groups else "pairs"
+            yield "{} {}".format(name, mode), lambda pm=pm: \
+                pm.user_in_group("user", "group0")
+
+    pm = cached_manager(MemoryBackend(), local_cache_size=1024)
+    pm.user_in_group("user", "group0")
+    yield "local cache", lambda: pm.user_in_group("user", "group0")
+
+
+@benchmark("cached_miss")
+def bench_cached_miss(options):
+    """ Cache misses (a new user per check), the callback returns right
+    away
+    """
+    for name, backend in backends(options):
+        for cache_groups in (False, True):
+            pm = cached_manager(backend, cache_groups=cache_groups)
+            users = ("user{}".format(i) for i in count())
+            mode = "sets" if cache_groups else "pairs"
+            yield "{} {}".format(name, mode), lambda pm=pm, users=users: \
+                pm.user_in_group(next(users), "group0")
+
+
+@benchmark("check_granted_many")
+def bench_check_granted_many(options):
+    """ Batches of 100 cached pairs """
+    pairs = [("user{}".format(i), "group0") for i in range(100)]
+    for name, backend in backends(options):
+        pm = cached_manager(backend)
+        pm.check_granted_many(pairs)
+        yield "{} batch=100".format(name), lambda pm=pm: \
+            pm.check_granted_many(pairs)
+
+
+@benchmark("snapshot")
+def bench_snapshot(options):
+    """ Snapshot lookups, with and without the in-process cache """
+    path = os.path.join(options.tmpdir, "groups.snapshot")
+    write_snapshot(path, (("user{}".format(i), groups(10))
+                          for i in range(100000)))
+
+    for cache_size in (0, 4096):
+        pm = SnapshotPermissionManager(path=path, cache_size=cache_size)
+        yield "users=100000 cache={}".format(cache_size), lambda pm=pm: \
+            pm.user_in_group("user4711", "group0")
+
+
+def measure(func, number, repeat):
+    """ :returns: best time per call (in seconds) """
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def measure_threads(func, threads, number):
+    """ :returns: calls per second of `threads` threads calling `func` """
+    barrier = threading.Barrier(threads + 1)
+
+    def run():
+        barrier.wait()
+        for _ in range(number):
+            func()
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+
+    barrier.wait()
+    start = perf_counter()
+    for worker in workers:
+        worker.join()
+
+    return threads * number / (perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the permission check hot path")
+    parser.add_argument("benchmarks", nargs="*",
+                        help="Run only benchmarks containing these names")
+    parser.add_argument("--redis-url", help="Benchmark a real redis server")
+    parser.add_argument("--number", type=int, default=2000,
+                        help="Calls per measurement")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Measurements, the best one is reported")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Also measure the throughput of this many "
+                             "threads")
+    parser.add_argument("--group-sizes", default="1,10,100,1000",
+                        type=lambda s: [int(size) for size in s.split(",")],
+                        help="Comma separated sizes of group sets")
+    options = parser.parse_args(argv)
+
+    options.tmpdir = tempfile.mkdtemp()
+    header = "{:<20} {:<28} {:>12} {:>14}".format(
+        "benchmark", "case", "us/check", "checks/s")
+    if options.threads:
+        header += " {:>20}".format("{} threads checks/s".format(
+            options.threads))
+    print(header)
+    print("-" * len(header))
+
+    try:
+        for name, bench in BENCHMARKS.items():
+            if options.benchmarks and not any(
+                    selected in name for selected in options.benchmarks):
+                continue
+
+            for case, func in bench(options):
+                latency = measure(func, options.number, options.repeat)
+                line = "{:<20} {:<28} {:>12.2f} {:>14,.0f}".format(
+                    name, case, latency * 1e6, 1 / latency)
+                if options.threads:
+                    line += " {:>20,.0f}".format(measure_threads(
+                        func, options.threads, options.number))
+                print(line)
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(options.tmpdir)
+
+
+if __name__ == "__main__":
+    main()
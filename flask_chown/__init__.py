@@ -1,2 +1,26 @@
 from .permission_manager import PermissionManager, PermissionManagerException
-from .permission_manager_redis import CachedPermissionManager
+
+__all__ = ["PermissionManager", "PermissionManagerException",
+           "CachedPermissionManager", "SnapshotPermissionManager"]
+
+# Imported on first access, apps using only `PermissionManager` do not load
+# the caching and snapshot modules
+_lazy = {
+    "CachedPermissionManager": ".permission_manager_redis",
+    "SnapshotPermissionManager": ".permission_manager_snapshot",
+}
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError("module {!r} has no attribute {!r}".format(
+            __name__, name))
+
+    from importlib import import_module
+    value = getattr(import_module(_lazy[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
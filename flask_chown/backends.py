@@ -0,0 +1,996 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_chown.backends
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Cache backends of the cached permission manager
+
+    :copyright: (c) 2018 by Matthias Riegler.
+    :license: APACHEv2, see LICENSE.md for more details.
+"""
+import asyncio
+import hashlib
+import mmap
+import itertools
+import os
+import random
+import struct
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+from time import monotonic, time
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription(object):
+    """ Handle of a `CacheBackend.subscribe` call
+
+    :param stop: function ending the subscription
+    """
+
+    def __init__(self, stop):
+        """ Init """
+        self._stop = stop
+
+    def stop(self):
+        """ Ends the subscription """
+        self._stop()
+
+
+class CacheBackend(object):
+    """ Storage interface used by the `CachedPermissionManager`
+
+    Backends store two kinds of entries: plain values (bytes) and member sets
+    (frozensets of strings). Timeouts are given in seconds, 0 means the entry
+    does not expire. Methods accepting ``with_ttl`` additionally return the
+    remaining time to live of the entry (`None` if it does not expire).
+
+    The `async` methods default to the blocking implementations, which is
+    fine for backends not doing any I/O.
+
+    Backends supporting messaging set `messaging` and implement `publish`
+    and `subscribe`, it is used to propagate invalidations and known users
+    to all processes.
+
+    Backends holding many keys set `indexed`, the `CachedPermissionManager`
+    then records its entries in member sets per user and group, so
+    invalidating them does not scan all keys. The index sets are passed to
+    `set_many` and `set_members_many` as ``index_items``, so they are written
+    together with the entries.
+
+    Exceptions in `errors` signal that the storage is unavailable, the
+    `CachedPermissionManager` then falls back to uncached lookups.
+    """
+
+    #: Exceptions raised if the storage is unavailable
+    errors = (OSError,)
+
+    #: Keys of a user have to share a hash tag (redis cluster)
+    hash_tags = False
+
+    #: Entries are found by index sets instead of scanning `keys`
+    indexed = False
+
+    #: Messages are delivered by `publish` and `subscribe`
+    messaging = False
+
+    def get(self, key, with_ttl=False):
+        """ :returns: value or `None` if missing """
+        raise NotImplementedError()
+
+    def get_many(self, keys):
+        """ :returns: list of values (`None` if missing) """
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, timeout=0):
+        """ Stores a value """
+        raise NotImplementedError()
+
+    def set_many(self, items, index_items=()):
+        """ Stores ``(key, value, timeout)`` items
+
+        :param index_items: ``(key, members, timeout)`` items passed to
+                            `add_members_many`
+        """
+        self.add_members_many(index_items)
+        for key, value, timeout in items:
+            self.set(key, value, timeout)
+
+    def add(self, key, value, timeout=0):
+        """ Stores a value unless the key is present
+
+        :returns: `True` if the value was stored
+        """
+        raise NotImplementedError()
+
+    def incr(self, key):
+        """ Increments a counter (stored as value) by one
+
+        :returns: the new value
+        """
+        raise NotImplementedError()
+
+    def delete(self, *keys):
+        """ Removes entries """
+        raise NotImplementedError()
+
+    def delete_if_equal(self, key, value):
+        """ Removes an entry if it still holds `value` (e.g. releasing a
+        lock only if it was not taken over)
+        """
+        if self.get(key) == value:
+            self.delete(key)
+
+    def exists(self, key):
+        """ :returns: `True` if a value is stored for the key """
+        return self.get(key) is not None
+
+    def keys(self, prefix):
+        """ :returns: list of keys starting with `prefix` """
+        raise NotImplementedError()
+
+    def publish(self, channel, message):
+        """ Sends a message (str) to all subscribers of a channel, a no-op if
+        messaging is not supported
+        """
+
+    def subscribe(self, channel, callback):
+        """ Calls ``callback(message)`` for every message published on the
+        channel, ``callback(None)`` if messages might have been lost (e.g.
+        the connection was interrupted)
+
+        :returns: `Subscription` or `None` if messaging is not supported
+        """
+        return None
+
+    def get_members(self, key, with_ttl=False):
+        """ :returns: frozenset of members or `None` if missing """
+        raise NotImplementedError()
+
+    def get_members_many(self, keys):
+        """ :returns: list of member sets (`None` if missing) """
+        return [self.get_members(key) for key in keys]
+
+    def is_member(self, key, member, with_ttl=False):
+        """ :returns: `True` or `False`, `None` if the set is missing """
+        members, ttl = self.get_members(key, with_ttl=True)
+        result = None if members is None else member in members
+        return (result, ttl) if with_ttl else result
+
+    def set_members(self, key, members, timeout=0):
+        """ Stores a member set, replacing the previous one """
+        raise NotImplementedError()
+
+    def set_members_many(self, items, index_items=()):
+        """ Stores ``(key, members, timeout)`` items
+
+        :param index_items: ``(key, members, timeout)`` items passed to
+                            `add_members_many`
+        """
+        self.add_members_many(index_items)
+        for key, members, timeout in items:
+            self.set_members(key, members, timeout)
+
+    def add_members_many(self, items):
+        """ Adds members to sets, ``(key, members, timeout)`` items. The
+        timeout of existing sets is replaced
+        """
+        for key, members, timeout in items:
+            self.set_members(key, (self.get_members(key) or frozenset()) |
+                             frozenset(members), timeout)
+
+    async def get_async(self, key, with_ttl=False):
+        """ :returns: value or `None` if missing """
+        return self.get(key, with_ttl)
+
+    async def set_async(self, key, value, timeout=0):
+        """ Stores a value """
+        self.set(key, value, timeout)
+
+    async def get_members_async(self, key, with_ttl=False):
+        """ :returns: frozenset of members or `None` if missing """
+        return self.get_members(key, with_ttl)
+
+    async def is_member_async(self, key, member, with_ttl=False):
+        """ :returns: `True` or `False`, `None` if the set is missing """
+        return self.is_member(key, member, with_ttl)
+
+    async def set_members_async(self, key, members, timeout=0):
+        """ Stores a member set, replacing the previous one """
+        self.set_members(key, members, timeout)
+
+    async def set_many_async(self, items, index_items=()):
+        """ Stores ``(key, value, timeout)`` items """
+        self.set_many(items, index_items)
+
+    async def set_members_many_async(self, items, index_items=()):
+        """ Stores ``(key, members, timeout)`` items """
+        self.set_members_many(items, index_items)
+
+
+class MemoryBackend(CacheBackend):
+    """ Keeps entries in the memory of the process, e.g. for single process
+    deployments or for testing without a redis server
+
+    :param maxsize: Maximum number of entries, the least recently used entry
+                    is evicted once the limit is reached
+    """
+
+    messaging = True
+
+    def __init__(self, maxsize=65536):
+        """ Init """
+        self._cache = LRUCache(maxsize=maxsize)
+        self._incr_lock = threading.Lock()
+        self._subscribers = {}
+
+    def get(self, key, with_ttl=False):
+        value, ttl = self._cache.get_with_ttl(key)
+        return (value, ttl) if with_ttl else value
+
+    def set(self, key, value, timeout=0):
+        self._cache.set(key, value, ttl=timeout)
+
+    def add(self, key, value, timeout=0):
+        return self._cache.add(key, value, ttl=timeout)
+
+    def incr(self, key):
+        with self._incr_lock:
+            value = int(self._cache.get(key) or 0) + 1
+            self._cache.set(key, str(value).encode(), ttl=0)
+        return value
+
+    def delete(self, *keys):
+        for key in keys:
+            self._cache.delete(key)
+
+    def keys(self, prefix):
+        return [key for key in self._cache.keys() if key.startswith(prefix)]
+
+    def publish(self, channel, message):
+        for callback in list(self._subscribers.get(channel, ())):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+        return Subscription(
+            lambda: self._subscribers[channel].remove(callback))
+
+    def get_members(self, key, with_ttl=False):
+        return self.get(key, with_ttl)
+
+    def set_members(self, key, members, timeout=0):
+        self._cache.set(key, frozenset(members), ttl=timeout)
+
+
+class RedisBackend(CacheBackend):
+    """ Stores entries in redis, member sets are stored as redis sets
+
+    `async` methods run the blocking client in the default executor of the
+    event loop, so they do not block it and share the connection pool of
+    the blocking client. Flask runs every `async` view in a new event loop,
+    clients bound to a loop (``redis.asyncio``) would connect per request.
+
+    The connection pool can be tuned, or an existing client or pool can be
+    shared::
+
+        RedisBackend("redis://localhost", max_connections=50,
+                     socket_timeout=0.1, socket_connect_timeout=0.5)
+        RedisBackend(client=app.redis)
+
+    Reads can be spread over replicas, writes always go to the primary.
+    Replicas are picked round robin, or by their latency (the faster of two
+    random replicas) with ``replica_selection="latency"``. Misses on a replica
+    are read again from the primary, as the entry might not be replicated
+    yet. `async` methods run the same reads in an executor, so they use the
+    replicas as well::
+
+        RedisBackend("redis://primary",
+                     replica_urls=["redis://replica1", "redis://replica2"])
+
+    :param redis_url: Redis connection url
+    :param client: Redis client used instead of connecting to `redis_url`,
+                   it must not decode responses
+    :param connection_pool: Connection pool used instead of connecting to
+                            `redis_url`
+    :param max_connections: Maximum number of connections of the pool
+    :param socket_timeout: Timeout of redis commands (in seconds)
+    :param socket_connect_timeout: Timeout of connecting (in seconds)
+    :param health_check_interval: Idle connections are checked before use
+                                  after this many seconds; 0 to disable
+    :param replica_urls: Connection urls of replicas used for reading
+    :param replicas: Redis clients of replicas used for reading
+    :param replica_selection: ``"round_robin"`` or ``"latency"``
+    """
+
+    #: Latency (in seconds) recorded for a failed replica read
+    replica_error_penalty = 1.0
+
+    #: Seconds to wait before reconnecting a lost subscription
+    resubscribe_interval = 1.0
+
+    indexed = True
+
+    messaging = True
+
+    #: Member added to every set, so empty sets can be stored
+    _SENTINEL = ""
+
+    # Compare and delete in one atomic step
+    _DELETE_IF_EQUAL = """
+        if redis.call("get", KEYS[1]) == ARGV[1] then
+            return redis.call("del", KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(
+            self,
+            redis_url="redis://localhost",
+            client=None,
+            connection_pool=None,
+            max_connections=None,
+            socket_timeout=None,
+            socket_connect_timeout=None,
+            health_check_interval=0,
+            replica_urls=(),
+            replicas=(),
+            replica_selection="round_robin"):
+        """ Init """
+        import redis
+
+        if replica_selection not in ("round_robin", "latency"):
+            raise ValueError("Unknown replica selection {}".format(
+                replica_selection))
+
+        self.errors = (redis.RedisError, OSError)
+        self._redis_url = redis_url
+        self._options = {"health_check_interval": health_check_interval}
+        for name, value in (("max_connections", max_connections),
+                            ("socket_timeout", socket_timeout),
+                            ("socket_connect_timeout",
+                             socket_connect_timeout)):
+            if value is not None:
+                self._options[name] = value
+
+        if client is not None:
+            self.redis = client
+        elif connection_pool is not None:
+            self.redis = redis.Redis(connection_pool=connection_pool)
+        else:
+            self.redis = self._connect()
+        self._delete_if_equal = self.redis.register_script(
+            self._DELETE_IF_EQUAL)
+
+        # Replicas serving reads
+        self._replica_urls = list(replica_urls)
+        self.replicas = self._connect_replicas() + list(replicas)
+        self.replica_selection = replica_selection
+
+        # Entries are read back as bytes, decoded replies never match them
+        for _client in [self.redis] + self.replicas:
+            if _client.get_connection_kwargs().get("decode_responses"):
+                raise ValueError("Redis clients decoding responses "
+                                 "(decode_responses=True) are not supported")
+        self._replica_counter = itertools.count()
+        # Moving average of the read latency per replica
+        self._replica_latency = [0.0] * len(self.replicas)
+
+    @staticmethod
+    async def _in_executor(func, *args):
+        """ :returns: result of a blocking call, run in the default executor
+                      of the running event loop
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, func, *args)
+
+    def _connect(self):
+        """ :returns: Redis client """
+        import redis
+        return redis.from_url(self._redis_url, **self._options)
+
+    def _connect_replicas(self):
+        """ :returns: list of Redis clients of the replicas """
+        import redis
+        return [redis.from_url(url, **self._options)
+                for url in self._replica_urls]
+
+    def _select_replica(self):
+        """ :returns: index of the replica serving the next read """
+        if self.replica_selection == "latency" and len(self.replicas) > 1:
+            # The faster of two random replicas, slow replicas still get
+            # some reads to update their latency
+            first, second = random.sample(range(len(self.replicas)), 2)
+            latency = self._replica_latency
+            return first if latency[first] <= latency[second] else second
+
+        return next(self._replica_counter) % len(self.replicas)
+
+    def _record_latency(self, index, latency):
+        """ Updates the moving average latency of a replica """
+        previous = self._replica_latency[index]
+        self._replica_latency[index] = (0.8 * previous + 0.2 * latency
+                                        if previous else latency)
+
+    def _read(self, read, missing, *args):
+        """ Calls ``read(client, *args)`` on a replica. The primary is asked
+        instead if the replica fails or ``missing(result)`` is true
+        """
+        if not self.replicas:
+            return read(self.redis, *args)
+
+        index = self._select_replica()
+        start = monotonic()
+        try:
+            result = read(self.replicas[index], *args)
+        except self.errors:
+            self._record_latency(index, self.replica_error_penalty)
+            return read(self.redis, *args)
+
+        self._record_latency(index, monotonic() - start)
+        if missing(result):
+            # Not replicated yet (or really missing)
+            return read(self.redis, *args)
+        return result
+
+    @staticmethod
+    def _missing(result):
+        """ :returns: if a read (with or without TTL) missed """
+        return (result[0] if isinstance(result, tuple) else result) is None
+
+    @staticmethod
+    def _ttl(ttl):
+        """ Normalizes a TTL reply, older clients return `None` """
+        return ttl if ttl is not None and ttl >= 0 else None
+
+    @classmethod
+    def _decode_members(cls, members):
+        """ :returns: member set without the sentinel, `None` if missing """
+        if not members:
+            return None
+        return frozenset(m.decode("utf-8") for m in members) - {cls._SENTINEL}
+
+    def _queue_set(self, pipe, key, value, timeout):
+        """ Queues storing a value in a pipeline """
+        # SET ... EX, so there is no window without a TTL
+        pipe.set(key, value, ex=timeout or None)
+
+    def _queue_members(self, pipe, key, members, timeout):
+        """ Queues storing a member set in a pipeline """
+        pipe.delete(key)
+        pipe.sadd(key, self._SENTINEL, *members)
+        if timeout > 0:
+            pipe.expire(key, timeout)
+
+    @staticmethod
+    def _queue_add_members(pipe, items):
+        """ Queues adding members to sets in a pipeline """
+        for key, members, timeout in items:
+            if not members:
+                continue
+            pipe.sadd(key, *members)
+            if timeout:
+                pipe.expire(key, timeout)
+
+    def get(self, key, with_ttl=False):
+        return self._read(self._get, self._missing, key, with_ttl)
+
+    def _get(self, client, key, with_ttl):
+        if not with_ttl:
+            return client.get(key)
+
+        pipe = client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.ttl(key)
+        value, ttl = pipe.execute()
+        return value, self._ttl(ttl)
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        return self._read(self._get_many, lambda r: None in r, keys)
+
+    def _get_many(self, client, keys):
+        return client.mget(keys)
+
+    def set(self, key, value, timeout=0):
+        self.redis.set(key, value, ex=timeout or None)
+
+    def set_many(self, items, index_items=()):
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_add_members(pipe, index_items)
+        for key, value, timeout in items:
+            self._queue_set(pipe, key, value, timeout)
+        pipe.execute()
+
+    def add(self, key, value, timeout=0):
+        return bool(self.redis.set(key, value, nx=True, ex=timeout or None))
+
+    def delete(self, *keys):
+        if keys:
+            self.redis.delete(*keys)
+
+    def delete_if_equal(self, key, value):
+        self._delete_if_equal(keys=[key], args=[value])
+
+    def incr(self, key):
+        return self.redis.incr(key)
+
+    def keys(self, prefix):
+        # Escape glob characters of the prefix
+        pattern = "".join("\\" + c if c in "*?[]\\" else c
+                          for c in prefix) + "*"
+        return [key.decode("utf-8")
+                for key in self.redis.scan_iter(match=pattern, count=1000)]
+
+    def publish(self, channel, message):
+        self.redis.publish(channel, message)
+
+    def subscribe(self, channel, callback):
+        stopped = threading.Event()
+
+        def handler(message):
+            # The worker thread might still be reading after `stop`
+            if not stopped.is_set():
+                callback(message["data"].decode("utf-8"))
+
+        def on_error(error, pubsub, thread):
+            # The worker reconnects and subscribes again on the next read,
+            # messages published meanwhile are lost
+            logger.warning("Subscription to {} interrupted: {}".format(
+                channel, error))
+            if not stopped.is_set():
+                callback(None)
+            stopped.wait(self.resubscribe_interval)
+
+        def stop():
+            stopped.set()
+            thread.stop()
+
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{channel: handler})
+        thread = pubsub.run_in_thread(sleep_time=1, daemon=True,
+                                      exception_handler=on_error)
+        return Subscription(stop)
+
+    def exists(self, key):
+        return bool(self.redis.exists(key))
+
+    def get_members(self, key, with_ttl=False):
+        return self._read(self._get_members, self._missing, key, with_ttl)
+
+    def _get_members(self, client, key, with_ttl):
+        if not with_ttl:
+            return self._decode_members(client.smembers(key))
+
+        pipe = client.pipeline(transaction=False)
+        pipe.smembers(key)
+        pipe.ttl(key)
+        members, ttl = pipe.execute()
+        return self._decode_members(members), self._ttl(ttl)
+
+    def get_members_many(self, keys):
+        return self._read(self._get_members_many, lambda r: None in r, keys)
+
+    def _get_members_many(self, client, keys):
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.smembers(key)
+        return [self._decode_members(m) for m in pipe.execute()]
+
+    def is_member(self, key, member, with_ttl=False):
+        return self._read(self._is_member, self._missing, key, member,
+                          with_ttl)
+
+    def _is_member(self, client, key, member, with_ttl):
+        # Let redis do the membership check, one round trip
+        pipe = client.pipeline(transaction=False)
+        pipe.sismember(key, member)
+        pipe.exists(key)
+        if with_ttl:
+            pipe.ttl(key)
+        is_member, exists, *ttl = pipe.execute()
+
+        result = bool(is_member) if exists else None
+        return (result, self._ttl(ttl[0])) if with_ttl else result
+
+    def set_members(self, key, members, timeout=0):
+        pipe = self.redis.pipeline()
+        self._queue_members(pipe, key, members, timeout)
+        pipe.execute()
+
+    def set_members_many(self, items, index_items=()):
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_add_members(pipe, index_items)
+        for key, members, timeout in items:
+            self._queue_members(pipe, key, members, timeout)
+        pipe.execute()
+
+    def add_members_many(self, items):
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_add_members(pipe, items)
+        pipe.execute()
+
+    async def get_async(self, key, with_ttl=False):
+        return await self._in_executor(self.get, key, with_ttl)
+
+    async def set_async(self, key, value, timeout=0):
+        await self._in_executor(self.set, key, value, timeout)
+
+    async def get_members_async(self, key, with_ttl=False):
+        return await self._in_executor(self.get_members, key, with_ttl)
+
+    async def is_member_async(self, key, member, with_ttl=False):
+        return await self._in_executor(self.is_member, key, member, with_ttl)
+
+    async def set_members_async(self, key, members, timeout=0):
+        await self._in_executor(self.set_members, key, members, timeout)
+
+    async def set_many_async(self, items, index_items=()):
+        await self._in_executor(self.set_many, items, index_items)
+
+    async def set_members_many_async(self, items, index_items=()):
+        await self._in_executor(self.set_members_many, items, index_items)
+
+
+# Shared memory backends reopening their file in forked children
+_forkable_backends = weakref.WeakSet()
+
+
+def _reopen_after_fork():
+    for backend in list(_forkable_backends):
+        backend._reopen()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reopen_after_fork)
+
+
+class SharedMemoryBackend(CacheBackend):
+    """ Stores entries in a memory mapped file, shared by all processes of a
+    host (e.g. gunicorn workers) without running a redis server::
+
+        backend = SharedMemoryBackend("/tmp/flask_chown.cache")
+
+    Entries live in a fixed size hash table: once all slots an entry may use
+    are taken, the entry expiring first is evicted. Entries not fitting into
+    a slot are not cached. All processes have to use the same `slots` and
+    `slot_size`. Requires a POSIX system (``fcntl``).
+
+    Messaging is not supported: invalidations of single users or groups are
+    not broadcasted, other processes keep serving their in-process cache
+    (``local_cache_size``) for up to ``local_cache_timeout`` seconds. Keep
+    that timeout short or disable the in-process cache if revocations have
+    to apply immediately. For the same reason `known_users` are not
+    supported: added users would not reach the other processes, and their
+    set would soon outgrow a slot.
+
+    :param path: Path of the file, created if missing
+    :param slots: Number of slots
+    :param slot_size: Size of a slot in bytes
+    """
+
+    # key hash, expiry (unix time, 0 = none), kind, key length, value length
+    _SLOT_HEADER = struct.Struct("<QdBHI")
+    # Slots checked for a key
+    _PROBES = 8
+
+    _VALUE = 1
+    _MEMBERS = 2
+
+    def __init__(self, path, slots=65536, slot_size=256):
+        """ Init """
+        import fcntl
+
+        self._fcntl = fcntl
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self._lock = threading.Lock()
+
+        size = slots * slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        self._mmap = mmap.mmap(self._fd, size)
+
+        # flock locks belong to the open file description, which a forked
+        # child shares with its parent (e.g. gunicorn --preload), so both
+        # would hold the lock at once
+        _forkable_backends.add(self)
+
+    def _reopen(self):
+        """ Opens the file again in a forked child, the mapping is kept """
+        if self._fd is None:
+            return
+
+        inherited = self._fd
+        self._fd = os.open(self.path, os.O_RDWR)
+        self._lock = threading.Lock()
+        # Closing does not release locks held by the parent
+        os.close(inherited)
+
+    def close(self):
+        """ Unmaps and closes the file """
+        _forkable_backends.discard(self)
+        self._mmap.close()
+        os.close(self._fd)
+        self._fd = None
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        """ Locks the table against other threads and processes """
+        fcntl = self._fcntl
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+
+        with self._lock:
+            fcntl.flock(self._fd, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _probe(self, key):
+        """ :returns: hash of the key and the slots it may be stored in """
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        # 0 marks an empty slot
+        key_hash = struct.unpack("<Q", digest)[0] or 1
+        start = key_hash % self.slots
+        return key_hash, [(start + i) % self.slots
+                          for i in range(self._PROBES)]
+
+    def _read_slot(self, slot):
+        """ :returns: hash, expiry, kind, key and value of a slot """
+        offset = slot * self.slot_size
+        key_hash, expires, kind, key_len, value_len = \
+            self._SLOT_HEADER.unpack_from(self._mmap, offset)
+
+        offset += self._SLOT_HEADER.size
+        key = self._mmap[offset:offset + key_len]
+        value = self._mmap[offset + key_len:offset + key_len + value_len]
+        return key_hash, expires, kind, key, value
+
+    def _find(self, key):
+        """ :returns: slot, expiry, kind and value of a key or `None` """
+        key_hash, slots = self._probe(key)
+        now = time()
+
+        for slot in slots:
+            slot_hash, expires, kind, slot_key, value = self._read_slot(slot)
+            if slot_hash == key_hash and slot_key == key:
+                if expires and expires <= now:
+                    return None
+                return slot, expires, kind, value
+
+        return None
+
+    def _write(self, key, kind, value, timeout):
+        """ Writes an entry, the lock has to be held exclusively """
+        key_hash, slots = self._probe(key)
+        size = self._SLOT_HEADER.size + len(key) + len(value)
+        now = time()
+
+        target = None
+        evict = None
+        for slot in slots:
+            slot_hash, expires, _, slot_key, _ = self._read_slot(slot)
+            if slot_hash == key_hash and slot_key == key:
+                target = slot
+                break
+            if target is None and (not slot_hash or
+                                   (expires and expires <= now)):
+                target = slot
+            if evict is None or (expires or float("inf")) < evict[1]:
+                evict = (slot, expires or float("inf"))
+
+        if target is None:
+            target = evict[0]
+
+        offset = target * self.slot_size
+        if size > self.slot_size:
+            # Does not fit, make sure no outdated entry is left
+            if self._read_slot(target)[3] == key:
+                self._clear(target)
+            return
+
+        expires = now + timeout if timeout > 0 else 0
+        self._SLOT_HEADER.pack_into(self._mmap, offset, key_hash, expires,
+                                    kind, len(key), len(value))
+        offset += self._SLOT_HEADER.size
+        self._mmap[offset:offset + len(key) + len(value)] = key + value
+
+    def _clear(self, slot):
+        """ Marks a slot as empty """
+        self._SLOT_HEADER.pack_into(self._mmap, slot * self.slot_size,
+                                    0, 0, 0, 0, 0)
+
+    @staticmethod
+    def _encode_key(key):
+        return key.encode("utf-8") if isinstance(key, str) else key
+
+    @staticmethod
+    def _encode_members(members):
+        return b"\0".join(sorted(m.encode("utf-8") for m in members))
+
+    @staticmethod
+    def _decode_members(value):
+        if not value:
+            return frozenset()
+        return frozenset(m.decode("utf-8") for m in value.split(b"\0"))
+
+    def _get(self, key, kind, with_ttl):
+        """ :returns: value of the given kind (and the TTL) """
+        with self._locked():
+            entry = self._find(self._encode_key(key))
+
+        if entry is None or entry[2] != kind:
+            return (None, None) if with_ttl else None
+
+        _, expires, _, value = entry
+        if kind == self._MEMBERS:
+            value = self._decode_members(value)
+
+        if not with_ttl:
+            return value
+        return value, (expires - time() if expires else None)
+
+    def get(self, key, with_ttl=False):
+        return self._get(key, self._VALUE, with_ttl)
+
+    def set(self, key, value, timeout=0):
+        with self._locked(exclusive=True):
+            self._write(self._encode_key(key), self._VALUE, value, timeout)
+
+    def set_many(self, items, index_items=()):
+        self.add_members_many(index_items)
+        with self._locked(exclusive=True):
+            for key, value, timeout in items:
+                self._write(self._encode_key(key), self._VALUE, value,
+                            timeout)
+
+    def add(self, key, value, timeout=0):
+        key = self._encode_key(key)
+        with self._locked(exclusive=True):
+            if self._find(key) is not None:
+                return False
+            self._write(key, self._VALUE, value, timeout)
+            return self._find(key) is not None
+
+    def incr(self, key):
+        key = self._encode_key(key)
+        with self._locked(exclusive=True):
+            entry = self._find(key)
+            value = int(entry[3] if entry else 0) + 1
+            self._write(key, self._VALUE, str(value).encode(), 0)
+        return value
+
+    def delete(self, *keys):
+        with self._locked(exclusive=True):
+            for key in keys:
+                entry = self._find(self._encode_key(key))
+                if entry is not None:
+                    self._clear(entry[0])
+
+    def keys(self, prefix):
+        prefix = self._encode_key(prefix)
+        now = time()
+        keys = []
+
+        with self._locked():
+            for slot in range(self.slots):
+                slot_hash, expires, _, key, _ = self._read_slot(slot)
+                if slot_hash and key.startswith(prefix) and \
+                        not (expires and expires <= now):
+                    keys.append(key.decode("utf-8"))
+
+        return keys
+
+    def get_members(self, key, with_ttl=False):
+        return self._get(key, self._MEMBERS, with_ttl)
+
+    def set_members(self, key, members, timeout=0):
+        with self._locked(exclusive=True):
+            self._write(self._encode_key(key), self._MEMBERS,
+                        self._encode_members(members), timeout)
+
+    def set_members_many(self, items, index_items=()):
+        self.add_members_many(index_items)
+        with self._locked(exclusive=True):
+            for key, members, timeout in items:
+                self._write(self._encode_key(key), self._MEMBERS,
+                            self._encode_members(members), timeout)
+
+
+def _reject_options(backend, options, names):
+    """ Raises `ValueError` if options the backend ignores are passed """
+    for name in names:
+        if options.get(name):
+            raise ValueError("{} does not support {}".format(
+                type(backend).__name__, name))
+
+
+class RedisClusterBackend(RedisBackend):
+    """ Stores entries in a redis cluster (requires redis-py >= 4.1)::
+
+        RedisClusterBackend("redis://node1:6379", socket_timeout=0.1)
+
+    Any node of the cluster can be passed, the others are discovered. The
+    `CachedPermissionManager` hash tags the keys of a user (``{user}``), so
+    they are stored in the same slot; the `key_prefix` must not contain
+    braces.
+
+    :param redis_url: Connection url of a node
+    :param read_from_replicas: Read from the replicas of the nodes
+    :param kwargs: Parameters of the `RedisBackend`, except for
+                   `connection_pool`, `replica_urls` and `replicas`
+                   (replicas are discovered)
+    """
+
+    hash_tags = True
+
+    def __init__(self, redis_url="redis://localhost",
+                 read_from_replicas=False, **kwargs):
+        """ Init """
+        _reject_options(self, kwargs,
+                        ("connection_pool", "replica_urls", "replicas"))
+        self._read_from_replicas = read_from_replicas
+        super().__init__(redis_url, **kwargs)
+
+    def _connect(self):
+        from redis.cluster import RedisCluster
+        return RedisCluster.from_url(
+            self._redis_url, read_from_replicas=self._read_from_replicas,
+            **self._options)
+
+    def _get_many(self, client, keys):
+        # The keys of a batch are spread over multiple slots
+        return client.mget_nonatomic(keys)
+
+
+class RedisSentinelBackend(RedisBackend):
+    """ Stores entries in the redis master monitored by sentinels, fail overs
+    are followed automatically::
+
+        RedisSentinelBackend([("sentinel1", 26379), ("sentinel2", 26379)],
+                             "mymaster", socket_timeout=0.1)
+
+    :param sentinels: List of ``(host, port)`` tuples of the sentinels
+    :param service_name: Name of the monitored master
+    :param sentinel_kwargs: Connection parameters of the sentinels
+    :param read_from_replicas: Read from the replicas of the master
+    :param kwargs: Parameters of the `RedisBackend`, used for the master,
+                   except for `client`, `connection_pool` and
+                   `replica_urls` (the sentinels are asked instead)
+    """
+
+    def __init__(self, sentinels, service_name, sentinel_kwargs=None,
+                 read_from_replicas=False, **kwargs):
+        """ Init """
+        from redis.sentinel import Sentinel
+
+        _reject_options(self, kwargs,
+                        ("client", "connection_pool", "replica_urls"))
+
+        self._service_name = service_name
+        self._read_from_replicas = read_from_replicas
+        self._sentinel = Sentinel(list(sentinels),
+                                  sentinel_kwargs=sentinel_kwargs)
+        super().__init__(redis_url=None, **kwargs)
+
+    def _connect(self):
+        return self._sentinel.master_for(self._service_name, **self._options)
+
+    def _connect_replicas(self):
+        if not self._read_from_replicas:
+            return []
+        # Balances between the replicas known to the sentinels
+        return [self._sentinel.slave_for(self._service_name,
+                                         **self._options)]
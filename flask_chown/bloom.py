@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_chown.bloom
+    ~~~~~~~~~~~~~~~~~
+
+    Bloom filter used to reject unknown users early
+
+    :copyright: (c) 2018 by Matthias Riegler.
+    :license: APACHEv2, see LICENSE.md for more details.
+"""
+import hashlib
+import math
+import struct
+import threading
+
+
+class BloomFilter(object):
+    """ A space efficient, probabilistic set. Membership tests never give
+    false negatives, but may give false positives at about `error_rate`::
+
+        users = BloomFilter(capacity=100000)
+        users.add("alice")
+        "alice" in users  # -> True
+        "mallory" in users  # -> False (most likely)
+
+    Items can not be removed.
+
+    :param capacity: Expected number of items
+    :param error_rate: False positive rate at `capacity` items
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """ Init """
+        if capacity <= 0:
+            raise ValueError("capacity has to be greater than 0")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate has to be between 0 and 1")
+
+        # Optimal number of bits and hash functions
+        self.size = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+        self._count = 0
+
+    #: Capacity of `from_iterable` filters relative to the number of items,
+    #: leaving room for items added later
+    growth_factor = 2
+
+    @classmethod
+    def from_iterable(cls, items, error_rate=0.01, capacity=None):
+        """ :returns: filter containing the items
+
+        :param capacity: Expected number of items including the ones added
+                         later, by default `growth_factor` times the number
+                         of items
+        """
+        items = list(items)
+        if capacity is None:
+            capacity = len(items) * cls.growth_factor
+        bloom = cls(max(capacity, len(items), 1), error_rate)
+        bloom.update(items)
+        return bloom
+
+    def _positions(self, item):
+        """ :returns: bit positions of an item (double hashing) """
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        """ Adds an item """
+        positions = self._positions(item)
+        with self._lock:
+            for pos in positions:
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+            self._count += 1
+
+    def update(self, items):
+        """ Adds all items """
+        for item in items:
+            self.add(item)
+
+    def clear(self):
+        """ Removes all items """
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+            self._count = 0
+
+    def __contains__(self, item):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+    def __len__(self):
+        """ :returns: number of added items (including duplicates) """
+        return self._count
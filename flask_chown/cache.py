@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_chown.cache
+    ~~~~~~~~~~~~~~~~~
+
+    In-process caching helpers
+
+    :copyright: (c) 2018 by Matthias Riegler.
+    :license: APACHEv2, see LICENSE.md for more details.
+"""
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class LRUCache(object):
+    """ A thread-safe, size bounded LRU cache with a per-entry TTL.
+    It is used as an in-process tier in front of remote caches::
+
+        cache = LRUCache(maxsize=1024, ttl=30)
+        cache.set(("user", "group"), True)
+        cache.get(("user", "group"))  # -> True
+
+    :param maxsize: Maximum number of entries, the least recently used entry
+                    is evicted once the limit is reached
+    :param ttl: Default time to live of an entry (in seconds);
+                Set to 0 for no timeout
+    """
+
+    def __init__(self, maxsize=1024, ttl=0):
+        """ Init """
+        if maxsize <= 0:
+            raise ValueError("maxsize has to be greater than 0")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        """ :returns: tuple of value and expiry or `None`, the lock has to
+                      be held
+        """
+        try:
+            value, expires = self._data[key]
+        except KeyError:
+            return None
+
+        if expires and expires <= monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value, expires
+
+    def get(self, key, default=None):
+        """ :returns: the cached value or `default` if the key is missing
+                      or expired
+        """
+        with self._lock:
+            entry = self._lookup(key)
+
+        return default if entry is None else entry[0]
+
+    def get_with_ttl(self, key):
+        """ :returns: tuple of the cached value and its remaining TTL
+                      (`None` if it does not expire), ``(None, None)`` if the
+                      key is missing or expired
+        """
+        with self._lock:
+            entry = self._lookup(key)
+
+        if entry is None:
+            return None, None
+
+        value, expires = entry
+        return value, (expires - monotonic() if expires else None)
+
+    def _store(self, key, value, ttl):
+        """ Stores a value, the lock has to be held """
+        ttl = self.ttl if ttl is None else ttl
+        expires = monotonic() + ttl if ttl > 0 else 0
+
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        """ Stores a value, optionally overriding the default TTL """
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        """ Stores a value unless the key is present
+
+        :returns: `True` if the value was stored
+        """
+        with self._lock:
+            if self._lookup(key) is not None:
+                return False
+
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        """ Removes a key if present """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_if(self, predicate):
+        """ Removes all entries for which ``predicate(key, value)`` is true """
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items()
+                        if predicate(key, value)]:
+                del self._data[key]
+
+    def keys(self):
+        """ :returns: list of all keys, including expired ones """
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        """ Removes all entries """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _Call(object):
+    """ An in-flight call of `SingleFlight` """
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Deduplicates concurrent calls: while a call for a key is in flight,
+    other threads asking for the same key wait for its result instead of
+    calling the function again::
+
+        flight = SingleFlight()
+        flight.do("user", resolve_groups, "user")
+    """
+
+    def __init__(self):
+        """ Init """
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """ Calls `func` unless a call for `key` is in flight, in which case
+        its result is returned (or its exception raised)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+
+class CircuitBreaker(object):
+    """ Stops calling a failing service for a while. After `threshold`
+    consecutive failures the circuit opens and `allow` returns `False` for
+    `reset_timeout` seconds, then a single trial call is allowed::
+
+        breaker = CircuitBreaker(threshold=5, reset_timeout=30)
+        if breaker.allow():
+            try:
+                result = call_service()
+            except ConnectionError:
+                breaker.failure()
+            except BaseException:
+                breaker.release()
+                raise
+            else:
+                breaker.success()
+
+    A trial call ending without `success`, `failure` or `release` is given
+    up after another `reset_timeout`.
+
+    :param threshold: Number of consecutive failures opening the circuit
+    :param reset_timeout: How long the circuit stays open (in seconds)
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        """ Init """
+        if threshold <= 0:
+            raise ValueError("threshold has to be greater than 0")
+
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = None
+        # Start of the pending trial call
+        self._trial = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """ :returns: `True` if calls are currently rejected """
+        with self._lock:
+            return self._opened is not None
+
+    def allow(self):
+        """ :returns: `True` if a call may be made """
+        with self._lock:
+            if self._opened is None:
+                return True
+
+            # Let one trial call through once the timeout is over
+            now = monotonic()
+            if now < self._opened + self.reset_timeout:
+                return False
+            if self._trial is not None and \
+                    now < self._trial + self.reset_timeout:
+                return False
+
+            self._trial = now
+            return True
+
+    def success(self):
+        """ Records a successful call, closing the circuit """
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._trial = None
+
+    def failure(self):
+        """ Records a failed call """
+        with self._lock:
+            self._failures += 1
+            if self._trial is not None or \
+                    self._failures >= self.threshold:
+                self._opened = monotonic()
+                self._trial = None
+
+    def release(self):
+        """ Ends a call without a result (e.g. a cancelled one), a pending
+        trial call is allowed again right away
+        """
+        with self._lock:
+            self._trial = None
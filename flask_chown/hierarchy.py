@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_chown.hierarchy
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Nested groups with a precomputed transitive closure
+
+    :copyright: (c) 2018 by Matthias Riegler.
+    :license: APACHEv2, see LICENSE.md for more details.
+"""
+import threading
+
+
+def _closure(start, edges):
+    """ :returns: frozenset of the groups reachable from `start` (excluding
+                  `start`)
+    """
+    found = set()
+    pending = list(edges.get(start, ()))
+    while pending:
+        group = pending.pop()
+        if group not in found:
+            found.add(group)
+            pending.extend(edges.get(group, ()))
+    return frozenset(found)
+
+
+class GroupHierarchy(object):
+    """ Groups including other groups, the members of an included group are
+    members of the including group as well::
+
+        hierarchy = GroupHierarchy()
+        hierarchy.add("staff", "admins")
+        hierarchy.add("admins", "root")
+        hierarchy.expand(["root"])  # -> {"root", "admins", "staff"}
+
+    The groups (transitively) including each group are precomputed and
+    updated incrementally, so expanding a set of groups takes one lookup per
+    group regardless of the depth of the hierarchy. Cycles are rejected.
+    """
+
+    def __init__(self):
+        """ Init """
+        # Direct edges
+        self._parents = {}
+        self._children = {}
+        # Transitive closure, replaced as a whole on updates so lookups
+        # never see a partial update
+        self._ancestors = {}
+        self._descendants = {}
+        self._lock = threading.Lock()
+
+    def add(self, group, included):
+        """ Makes the members of `included` members of `group`
+
+        :returns: `True` if the inclusion was added, `False` if it existed
+        """
+        with self._lock:
+            if group == included or \
+                    group in self._descendants.get(included, ()):
+                raise ValueError("{} already includes {}".format(
+                    included, group))
+            if included in self._children.get(group, ()):
+                return False
+
+            self._children.setdefault(group, set()).add(included)
+            self._parents.setdefault(included, set()).add(group)
+
+            # Everything above the edge now includes everything below it
+            above = self._ancestors.get(group, frozenset()) | {group}
+            below = self._descendants.get(included, frozenset()) | {included}
+
+            ancestors = dict(self._ancestors)
+            for member in below:
+                ancestors[member] = ancestors.get(member, frozenset()) | above
+            descendants = dict(self._descendants)
+            for member in above:
+                descendants[member] = descendants.get(
+                    member, frozenset()) | below
+
+            self._ancestors, self._descendants = ancestors, descendants
+            return True
+
+    def remove(self, group, included):
+        """ Removes the inclusion of `included` in `group`
+
+        :returns: `True` if the inclusion was removed, `False` if it did not
+                  exist
+        """
+        with self._lock:
+            if included not in self._children.get(group, ()):
+                return False
+
+            self._children[group].discard(included)
+            self._parents[included].discard(group)
+
+            # Only the closure of groups above and below the edge changes
+            above = self._ancestors.get(group, frozenset()) | {group}
+            below = self._descendants.get(included, frozenset()) | {included}
+
+            ancestors = dict(self._ancestors)
+            for member in below:
+                ancestors[member] = _closure(member, self._parents)
+            descendants = dict(self._descendants)
+            for member in above:
+                descendants[member] = _closure(member, self._children)
+
+            self._ancestors, self._descendants = ancestors, descendants
+            return True
+
+    def ancestors(self, group):
+        """ :returns: frozenset of the groups (transitively) including the
+                      group
+        """
+        return self._ancestors.get(group, frozenset())
+
+    def descendants(self, group):
+        """ :returns: frozenset of the groups (transitively) included by the
+                      group
+        """
+        return self._descendants.get(group, frozenset())
+
+    def expand(self, groups):
+        """ :returns: frozenset of the groups and all groups including them
+        """
+        ancestors = self._ancestors
+        groups = frozenset(groups)
+        if not ancestors:
+            return groups
+
+        return groups.union(*(ancestors[group] for group in groups
+                              if group in ancestors))
+
+    def __len__(self):
+        """ :returns: number of groups in the hierarchy """
+        return len(set(self._parents) | set(self._children))
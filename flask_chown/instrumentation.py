@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_chown.instrumentation
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Prometheus metrics and OpenTelemetry spans of permission checks, based
+    on `flask_chown.signals`
+
+    :copyright: (c) 2018 by Matthias Riegler.
+    :license: APACHEv2, see LICENSE.md for more details.
+"""
+from time import time_ns
+from .signals import (backend_failed, cache_hit, cache_miss, groups_resolved,
+                      permission_checked)
+
+
+class _Instrumentation(object):
+    """ Connects handlers to the signals of a permission manager (or of all
+    managers if `sender` is `None`)
+    """
+
+    def _handlers(self):
+        """ :returns: list of ``(signal, handler)`` tuples """
+        raise NotImplementedError()
+
+    def connect(self, sender=None):
+        """ Starts recording, returns itself """
+        for signal, handler in self._handlers():
+            if sender is None:
+                signal.connect(handler, weak=False)
+            else:
+                signal.connect(handler, sender=sender, weak=False)
+        return self
+
+    def disconnect(self):
+        """ Stops recording """
+        for signal, handler in self._handlers():
+            signal.disconnect(handler)
+
+
+class PrometheusInstrumentation(_Instrumentation):
+    """ Records Prometheus metrics (requires prometheus_client)::
+
+        PrometheusInstrumentation().connect(pm)
+
+    Metrics (prefixed by `namespace`):
+
+    * ``checks_total`` by `result` (``granted``/``denied``)
+    * ``check_duration_seconds``
+    * ``cache_requests_total`` by `tier` and `result` (``hit``/``miss``)
+    * ``backend_duration_seconds``
+    * ``callback_duration_seconds``
+    * ``backend_errors_total``
+
+    :param registry: Prometheus registry, the default registry if `None`
+    :param namespace: Prefix of the metric names
+    """
+
+    def __init__(self, registry=None, namespace="flask_chown"):
+        """ Init """
+        from prometheus_client import REGISTRY, Counter, Histogram
+
+        registry = REGISTRY if registry is None else registry
+        options = {"namespace": namespace, "registry": registry}
+
+        self.checks = Counter("checks_total", "Permission checks",
+                              ["result"], **options)
+        self.check_duration = Histogram(
+            "check_duration_seconds", "Duration of permission checks",
+            **options)
+        self.cache_requests = Counter(
+            "cache_requests_total", "Cache lookups", ["tier", "result"],
+            **options)
+        self.backend_duration = Histogram(
+            "backend_duration_seconds", "Duration of cache backend reads",
+            **options)
+        self.callback_duration = Histogram(
+            "callback_duration_seconds",
+            "Duration of groups_for_user(s) calls", **options)
+        self.backend_errors = Counter(
+            "backend_errors_total", "Cache backend failures", **options)
+
+    def _handlers(self):
+        return [(permission_checked, self._on_checked),
+                (groups_resolved, self._on_resolved),
+                (cache_hit, self._on_hit),
+                (cache_miss, self._on_miss),
+                (backend_failed, self._on_failed)]
+
+    def _on_checked(self, sender, granted, duration, **kwargs):
+        self.checks.labels("granted" if granted else "denied").inc()
+        self.check_duration.observe(duration)
+
+    def _on_resolved(self, sender, duration, **kwargs):
+        self.callback_duration.observe(duration)
+
+    def _on_cache(self, result, tier, duration):
+        self.cache_requests.labels(tier, result).inc()
+        if tier == "backend" and duration is not None:
+            self.backend_duration.observe(duration)
+
+    def _on_hit(self, sender, tier, duration, **kwargs):
+        self._on_cache("hit", tier, duration)
+
+    def _on_miss(self, sender, tier, duration, **kwargs):
+        self._on_cache("miss", tier, duration)
+
+    def _on_failed(self, sender, **kwargs):
+        self.backend_errors.inc()
+
+
+class OpenTelemetryInstrumentation(_Instrumentation):
+    """ Records OpenTelemetry spans of permission checks and callback calls,
+    cache lookups and backend errors are added as span events to the
+    current span (requires opentelemetry-api)::
+
+        OpenTelemetryInstrumentation().connect(pm)
+
+    :param tracer_provider: Tracer provider, the global one if `None`
+    """
+
+    def __init__(self, tracer_provider=None):
+        """ Init """
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = trace.get_tracer(__name__,
+                                       tracer_provider=tracer_provider)
+
+    def _handlers(self):
+        return [(permission_checked, self._on_checked),
+                (groups_resolved, self._on_resolved),
+                (cache_hit, self._on_hit),
+                (cache_miss, self._on_miss),
+                (backend_failed, self._on_failed)]
+
+    def _record_span(self, name, duration, attributes):
+        """ Records a span which just ended """
+        end = time_ns()
+        span = self.tracer.start_span(name, start_time=end - int(
+            duration * 1e9), attributes=attributes)
+        span.end(end_time=end)
+        return span
+
+    def _on_checked(self, sender, user, rule, granted, duration, **kwargs):
+        self._record_span("flask_chown.check", duration, {
+            "enduser.id": user or "",
+            "flask_chown.groups": sorted(rule.groups),
+            "flask_chown.granted": granted})
+
+    def _on_resolved(self, sender, users, duration, **kwargs):
+        self._record_span("flask_chown.groups_for_user", duration, {
+            "flask_chown.users": len(users)})
+
+    def _add_event(self, name, attributes):
+        span = self._trace.get_current_span()
+        if span.is_recording():
+            span.add_event(name, attributes)
+
+    def _on_hit(self, sender, tier, **kwargs):
+        self._add_event("flask_chown.cache_hit", {"flask_chown.tier": tier})
+
+    def _on_miss(self, sender, tier, **kwargs):
+        self._add_event("flask_chown.cache_miss", {"flask_chown.tier": tier})
+
+    def _on_failed(self, sender, error, **kwargs):
+        self._add_event("flask_chown.backend_failed",
+                        {"exception.message": str(error)})
@@ -8,24 +8,91 @@
     :copyright: (c) 2018 by Matthias Riegler.
     :license: APACHEv2, see LICENSE.md for more details.
 """
+import inspect
 import logging
 from functools import wraps
-from flask import abort, g
+from time import perf_counter
+from flask import abort, current_app, g, request
+from .hierarchy import GroupHierarchy
+from .rule import GroupRegistry, Rule
+from .signals import groups_resolved, has_receivers, permission_checked
 
 logger = logging.getLogger(__name__)
 
 try:
-    from flask import _app_ctx_stack as stack
-except ImportError:
-    from flask import _request_ctx_stack as stack
-    logging.warning("It is recommended to update flask to a current version")
+    # Flask >= 2.2, accessing the stacks is deprecated
+    from flask.globals import _cv_app, _cv_request
 
-try:
-    from flask_login import current_user
+    def _app_ctx():
+        return _cv_app.get(None)
+
+    def _request_ctx():
+        return _cv_request.get(None)
 except ImportError:
-    # If there is no flask login detected, just drop support
-    current_user = None
-    logging.warning("No flask-login available")
+    from flask import _app_ctx_stack, _request_ctx_stack
+
+    def _app_ctx():
+        return _app_ctx_stack.top
+
+    def _request_ctx():
+        return _request_ctx_stack.top
+
+# flask-login's current_user, imported on first use
+_UNRESOLVED = object()
+_login_user = _UNRESOLVED
+
+
+def _flask_login_user():
+    """ :returns: flask-login's `current_user` proxy, `None` if flask-login is
+                  not installed
+    """
+    global _login_user
+    if _login_user is _UNRESOLVED:
+        try:
+            from flask_login import current_user
+        except ImportError:
+            # If there is no flask login detected, just drop support
+            current_user = None
+        _login_user = current_user
+    return _login_user
+
+
+def _run(awaitable):
+    """ Runs an awaitable of an async callback used from a sync view """
+    import asyncio
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(awaitable)
+
+    # Waiting for the awaitable would block the running loop
+    if inspect.iscoroutine(awaitable):
+        awaitable.close()
+    raise PermissionManagerException(
+        "async callbacks can not be awaited by sync checks within a running "
+        "event loop, use check_granted_async or check_rule_async")
+
+
+def _view_rules(view):
+    """ :returns: dict of the managers to the ``(rule, action)`` (`None` if
+                  public) of a view, set by `protect` and `public`
+    """
+    try:
+        return view.flask_chown_rules
+    except AttributeError:
+        rules = view.flask_chown_rules = {}
+        return rules
+
+
+def _sync_hook(name):
+    """ :returns: coroutine method calling the sync method `name`, used for
+                  group hooks overridden without their `_async` variant
+    """
+    async def hook(self, *args, **kwargs):
+        return getattr(self, name)(*args, **kwargs)
+
+    hook.__name__ = name + "_async"
+    return hook
 
 
 class PermissionManagerException(Exception):
@@ -65,45 +132,249 @@ class PermissionManager(object):
     highly recommended to not use the `g` context,
     instead you can set `ctx.user` like this: ::
 
-        # Import the stack, _app_ctx_stack is only available for flask > 0.8,
-        # if you need to support older versions,
-        # just fall back to _request_ctx_stack
+        # The application context, _app_ctx_stack is removed in flask 3,
+        # if you need to support flask < 2.2, fall back to it
         try:
-            from flask import _app_ctx_stack as stack
+            from flask.globals import _cv_app
+
+            def app_ctx():
+                return _cv_app.get(None)
         except ImportError:
-            from flask import _request_ctx_stack as stack
+            from flask import _app_ctx_stack
+
+            def app_ctx():
+                return _app_ctx_stack.top
 
 
         def setuser_stack(username):
             def decorator(f):
                 @wraps(f)
                 def wrapper(*args, **kwargs):
-                    ctx = stack.top
+                    ctx = app_ctx()
                     ctx.user = username
                     return f(*args, **kwargs)
                 return wrapper
             return decorator
 
+    The groups of a user are memoized per request, so a request doing several
+    permission checks resolves them only once. The current user is looked up
+    on every check.
+
+    Instead of wrapping every view with `chown`, permissions can be enforced
+    by a single `before_request` hook (see `init_app`), using rules of views
+    (`protect`), blueprints (`protect_blueprint`) and the app config.
+
+    Groups can include other groups (see `include_group`), the groups
+    returned by `groups_for_user` are expanded by the groups including them.
     """
 
     def __init__(self, app=None):
         """ Initializes the PermissionManager """
+        self.group_registry = GroupRegistry()
+        self.group_hierarchy = GroupHierarchy()
+        # Blueprint name -> (rule, action)
+        self._blueprint_rules = {}
+
         if app:
             self.init_app(app)
 
-    def init_app(self, app):
-        """ Initializes the PermissionManager and registers an APP """
+    def init_app(self, app, enforce=False):
+        """ Initializes the PermissionManager and registers an APP
+
+        :param enforce: Check the rule of the requested endpoint in a
+                        `before_request` hook, see `build_route_table`. The
+                        user has to be set by an earlier `before_request`
+                        hook (or be resolved lazily, e.g. by flask-login)
+        """
         app.permission_manager = self
 
+        if enforce:
+            app.before_request(self._enforce)
+
+    def protect(self, owner=None, group=None, action=None,
+                require_all=False):
+        """ A decorator marking a view to be protected by the `before_request`
+        hook (see `init_app`), the view itself is not wrapped::
+
+            @app.route("/admin")
+            @pm.protect(group="admins")
+            def admin():
+                return "Hello Admin"
+
+        The parameters are the same as for `chown`.
+        """
+        entry = (self._compile_rule(owner, group, require_all), action)
+
+        def decorator(view):
+            _view_rules(view)[self] = entry
+            return view
+
+        return decorator
+
+    def public(self, view):
+        """ A decorator exempting a view from blueprint and default rules of
+        the `before_request` hook
+        """
+        _view_rules(view)[self] = None
+        return view
+
+    def protect_blueprint(self, blueprint, owner=None, group=None,
+                          action=None, require_all=False):
+        """ Protects all views of a blueprint by the `before_request` hook
+        (see `init_app`), unless they have a rule of their own::
+
+            admin = Blueprint("admin", __name__)
+            pm.protect_blueprint(admin, group="admins")
+
+        :param blueprint: Blueprint or its name, nested blueprints are named
+                          by their dotted path (e.g. ``"parent.child"``)
+        """
+        name = getattr(blueprint, "name", blueprint)
+        self._blueprint_rules[name] = (
+            self._compile_rule(owner, group, require_all), action)
+
+    def _compile_rule(self, owner, group, require_all):
+        """ :returns: `Rule`, its groups are registered right away """
+        if not owner and not group:
+            raise PermissionManagerException("You have to provide at least" +
+                                             "one out of owner and group")
+
+        rule = Rule(owner, group, require_all)
+        self.group_registry.register(rule.groups)
+        return rule
+
+    def _config_rule(self, options):
+        """ :returns: ``(rule, action)`` of a config entry, `None` if the
+                      entry is `None` (public)
+        """
+        if options is None:
+            return None
+        return (self._compile_rule(options.get("owner"),
+                                   options.get("group"),
+                                   options.get("require_all", False)), None)
+
+    def build_route_table(self, app):
+        """ Builds the table of endpoints to their ``(rule, action)``, used by
+        the `before_request` hook. The rule of an endpoint is the first one
+        found of:
+
+        1. ``CHOWN_RULES[endpoint]`` of the app config
+        2. The rule of the view set by this manager (`protect` or `public`)
+        3. The rule of the innermost blueprint, ``CHOWN_RULES[blueprint]``
+           overrides `protect_blueprint`
+        4. ``CHOWN_DEFAULT_RULE`` of the app config
+
+        ``CHOWN_RULES`` maps endpoint and blueprint names to dicts with the
+        keys `owner`, `group` and `require_all` or `None` for public
+        endpoints (e.g. ``"static"`` if there is a default rule). The table
+        is built on the first request, build it again if rules change
+        afterwards. Every manager enforcing rules on an app has its own
+        table, the app config applies to all of them.
+
+        :returns: dict of the protected endpoints
+        """
+        config = {name: self._config_rule(options) for name, options in
+                  app.config.get("CHOWN_RULES", {}).items()}
+        named = {**self._blueprint_rules, **config}
+        default = self._config_rule(app.config.get("CHOWN_DEFAULT_RULE"))
+
+        table = {}
+        for endpoint, view in app.view_functions.items():
+            if endpoint in config:
+                entry = config[endpoint]
+            elif self in getattr(view, "flask_chown_rules", ()):
+                entry = view.flask_chown_rules[self]
+            else:
+                entry = default
+                blueprint = endpoint.rpartition(".")[0]
+                while blueprint:
+                    if blueprint in named:
+                        entry = named[blueprint]
+                        break
+                    blueprint = blueprint.rpartition(".")[0]
+
+            if entry is not None:
+                table[endpoint] = entry
+
+        # Every manager enforces its own rules
+        app.extensions.setdefault("flask_chown", {})[self] = table
+        return table
+
+    def _enforce(self):
+        """ `before_request` hook checking the rule of the endpoint """
+        table = current_app.extensions.get("flask_chown", {}).get(self)
+        if table is None:
+            table = self.build_route_table(current_app)
+
+        entry = table.get(request.endpoint)
+        if entry is None or self.check_rule(entry[0]):
+            return None
+
+        action = entry[1]
+        if action:
+            return action()
+        return abort(401)
+
+    def _request_cache(self):
+        """ :returns: dict living as long as the current request or `None`
+                      outside of requests. Application contexts are not used,
+                      they may be shared by several requests
+        """
+        ctx = _request_ctx()
+        if ctx is None:
+            return None
+
+        caches = getattr(ctx, "flask_chown_cache", None)
+        if caches is None:
+            caches = ctx.flask_chown_cache = {}
+
+        # Every manager has its own cache
+        return caches.setdefault(id(self), {})
+
+    def _memoize(self, key, func, *args):
+        """ Calls `func` only once per request for a given key """
+        cache = self._request_cache()
+        if cache is None:
+            return func(*args)
+
+        try:
+            return cache[key]
+        except KeyError:
+            result = cache[key] = func(*args)
+            return result
+
+    async def _memoize_async(self, key, func, *args):
+        """ Awaits `func` only once per request for a given key """
+        cache = self._request_cache()
+        if cache is None:
+            return await func(*args)
+
+        try:
+            return cache[key]
+        except KeyError:
+            result = cache[key] = await func(*args)
+            return result
+
     @property
     def current_user(self):
         """
-        :returns: current user name
+        :returns: current user name or `None` if no user is set
         """
-        ctx = stack.top
-        return str(getattr(ctx, 'user', None) or
-                   getattr(g, 'current_user', None) or
-                   current_user.username)
+        # Not memoized, the user may change within a context
+        return self._resolve_current_user()
+
+    def _resolve_current_user(self):
+        """ Looks up the current user name """
+        ctx = _app_ctx()
+        user = (getattr(ctx, 'user', None) or
+                getattr(g, 'current_user', None))
+
+        if not user:
+            login_user = _flask_login_user()
+            if login_user is not None:
+                user = getattr(login_user, 'username', None)
+
+        return str(user) if user else None
 
     def groups_for_user(self, callback):
         """ A decorator that is used to get a function that returns a list of
@@ -116,37 +387,324 @@ class PermissionManager(object):
                 else:
                     return ["test1"]
 
+        The callback can be a coroutine function as well, it is awaited when
+        checking permissions for `async` views::
+
+            @pm.groups_for_user
+            async def groups_for_user(username):
+                return await directory.groups(username)
+
         """
 
         self._get_groups_for_user = callback
         return callback
 
-    def user_in_group(self, user, group):
-        """ Checks if a user is member of a given group """
+    def groups_for_users(self, callback):
+        """ A decorator that is used to get a function returning the groups
+        of multiple users at once, as a mapping of users to their groups. It
+        is used instead of `groups_for_user` whenever multiple users are
+        resolved (e.g. by `check_granted_many`), users missing in the mapping
+        are not member of any group::
+
+            @pm.groups_for_users
+            def groups_for_users(usernames):
+                return directory.groups_of(usernames)
+
+        """
+
+        self._get_groups_for_users = callback
+        return callback
+
+    def include_group(self, group, *included):
+        """ Makes the members of the included groups members of `group` as
+        well, nested inclusions are resolved::
+
+            pm.include_group("staff", "admins", "developers")
+            pm.include_group("admins", "root")
+            # Members of "root" are members of "admins" and "staff"
+
+        The hierarchy is held per process, apply the same changes in every
+        process sharing a cache. Raises `ValueError` on cycles.
+        """
+        changed = False
+        for member in included:
+            changed |= self.group_hierarchy.add(group, member)
+
+        if changed:
+            self._hierarchy_changed()
+
+    def exclude_group(self, group, *included):
+        """ Removes inclusions added by `include_group` """
+        changed = False
+        for member in included:
+            changed |= self.group_hierarchy.remove(group, member)
+
+        if changed:
+            self._hierarchy_changed()
+
+    def _hierarchy_changed(self):
+        """ Called after the group hierarchy changed """
+        cache = self._request_cache()
+        if cache is not None:
+            cache.clear()
+
+    def get_groups(self, user):
+        """ :returns: frozenset of groups the user is member of, as returned
+                      by the `groups_for_user` callback and expanded by the
+                      groups including them
+        """
+        return self._memoize(("groups", user), self._resolve_groups, user)
+
+    def get_groups_many(self, users):
+        """ :returns: dict mapping the users to frozensets of their groups,
+                      users are resolved at once if `groups_for_users` is
+                      set
+        """
+        cache = self._request_cache()
+        if cache is None:
+            return self._resolve_groups_many(list(dict.fromkeys(users)))
+
+        groups = {}
+        missing = []
+        for user in dict.fromkeys(users):
+            try:
+                groups[user] = cache[("groups", user)]
+            except KeyError:
+                missing.append(user)
+
+        if missing:
+            for user, user_groups in self._resolve_groups_many(
+                    missing).items():
+                groups[user] = cache[("groups", user)] = user_groups
+
+        return groups
+
+    async def get_groups_async(self, user):
+        """ :returns: frozenset of groups the user is member of, awaiting
+                      `async` callbacks
+        """
+        return await self._memoize_async(("groups", user),
+                                         self._resolve_groups_async, user)
+
+    def _resolve_groups(self, user):
+        """ Resolves the groups of a user """
+        return self.group_hierarchy.expand(self._call_groups_for_user(user))
+
+    def _call_groups_for_user(self, user):
+        """ :returns: frozenset of the groups returned by the
+                      `groups_for_user` callback (not expanded)
+        """
         get_groups = getattr(self, "_get_groups_for_user", lambda user: [])
+        start = perf_counter()
+        groups = get_groups(user)
+
+        # Async callback used from a sync view
+        if inspect.isawaitable(groups):
+            groups = _run(groups)
+
+        if has_receivers(groups_resolved):
+            groups_resolved.send(self, users=[user],
+                                 duration=perf_counter() - start)
+
+        return frozenset(groups)
+
+    def _resolve_groups_many(self, users):
+        """ Resolves the groups of multiple users """
+        if getattr(self, "_get_groups_for_users", None) is None:
+            return {user: self._resolve_groups(user) for user in users}
+
+        expand = self.group_hierarchy.expand
+        return {user: expand(groups) for user, groups in
+                self._call_groups_for_users(users).items()}
+
+    def _call_groups_for_users(self, users):
+        """ :returns: dict mapping the users to frozensets of the groups
+                      returned by the `groups_for_users` callback (not
+                      expanded)
+        """
+        start = perf_counter()
+        groups = self._get_groups_for_users(users)
+
+        # Async callback used from a sync view
+        if inspect.isawaitable(groups):
+            groups = _run(groups)
+
+        if has_receivers(groups_resolved):
+            groups_resolved.send(self, users=list(users),
+                                 duration=perf_counter() - start)
+
+        return {user: frozenset(groups.get(user, ())) for user in users}
+
+    async def _resolve_groups_async(self, user):
+        """ Resolves the groups of a user, awaiting `async` callbacks """
+        return self.group_hierarchy.expand(
+            await self._call_groups_for_user_async(user))
+
+    async def _call_groups_for_user_async(self, user):
+        """ :returns: frozenset of the groups returned by the
+                      `groups_for_user` callback (not expanded), awaiting
+                      `async` callbacks
+        """
+        get_groups = getattr(self, "_get_groups_for_user", lambda user: [])
+        start = perf_counter()
+        groups = get_groups(user)
+
+        if inspect.isawaitable(groups):
+            groups = await groups
+
+        if has_receivers(groups_resolved):
+            groups_resolved.send(self, users=[user],
+                                 duration=perf_counter() - start)
+
+        return frozenset(groups)
+
+    def user_in_group(self, user, group):
+        """ Checks if a user is member of a given group, rules with a single
+        group are checked by it, override it to customize checks
+        """
 
         # Checks if the user is a groupmember
-        if group in get_groups(user):
+        if group in self.get_groups(user):
             return True
 
         return False
 
-    def check_granted(self, owner, group):
+    async def user_in_group_async(self, user, group):
+        """ Checks if a user is member of a given group, awaiting `async`
+        group resolution
+        """
+        return group in await self.get_groups_async(user)
+
+    def check_granted_many(self, pairs):
+        """ Checks a batch of ``(user, group)`` pairs, resolving the groups of
+        every user only once::
+
+            pm.check_granted_many([("alice", "admins"), ("bob", "admins")])
+            # -> [True, False]
+
+        :param pairs: iterable of ``(user, group)`` tuples
+        :returns: list of booleans in the order of `pairs`
+        """
+        pairs = list(pairs)
+        groups = self.get_groups_many(user for user, _ in pairs)
+        return [group in groups[user] for user, group in pairs]
+
+    def user_in_groups(self, user, groups, require_all=False):
+        """ Checks if a user is member of at least one (or all) of the given
+        groups, rules with multiple groups are checked by it, override it to
+        customize checks
+        """
+        return Rule(group=groups, require_all=require_all).matches(
+            self.get_groups(user))
+
+    async def user_in_groups_async(self, user, groups, require_all=False):
+        """ Checks if a user is member of at least one (or all) of the given
+        groups, awaiting `async` group resolution
+        """
+        return Rule(group=groups, require_all=require_all).matches(
+            await self.get_groups_async(user))
+
+    def __init_subclass__(cls, **kwargs):
+        """ Async checks use the sync group hooks of subclasses overriding
+        them without their `_async` variant, so the override is not bypassed
+        """
+        super().__init_subclass__(**kwargs)
+        for hook in ("user_in_group", "user_in_groups"):
+            if hook in vars(cls) and hook + "_async" not in vars(cls):
+                setattr(cls, hook + "_async", _sync_hook(hook))
+
+    def _check_groups(self, user, rule):
+        """ Evaluates the group part of a rule by `user_in_group` or
+        `user_in_groups`
+        """
+        if len(rule.groups) == 1:
+            (group,) = rule.groups
+            return self.user_in_group(user, group)
+        return self.user_in_groups(user, rule.groups, rule.require_all)
+
+    async def _check_groups_async(self, user, rule):
+        """ Evaluates the group part of a rule, awaiting `async` callbacks """
+        if len(rule.groups) == 1:
+            (group,) = rule.groups
+            return await self.user_in_group_async(user, group)
+        return await self.user_in_groups_async(user, rule.groups,
+                                               rule.require_all)
+
+    def check_granted(self, owner, group, require_all=False):
         """ Checks if a user is granted access to a view based on owner
         and group """
+        return self.check_rule(Rule(owner, group, require_all))
 
-        # Base case, user equals the current user
-        if owner and self.current_user == owner:
+    async def check_granted_async(self, owner, group, require_all=False):
+        """ Checks if a user is granted access to a view based on owner
+        and group, awaiting `async` group resolution """
+        return await self.check_rule_async(Rule(owner, group, require_all))
+
+    def check_rule(self, rule):
+        """ Checks if a user is granted access based on a compiled `Rule` """
+        if not has_receivers(permission_checked):
+            return self._check_rule(rule)
+
+        start = perf_counter()
+        granted = self._check_rule(rule)
+        permission_checked.send(self, user=self.current_user, rule=rule,
+                                granted=granted,
+                                duration=perf_counter() - start)
+        return granted
+
+    def _check_rule(self, rule):
+        """ Evaluates a rule for the current user """
+        user = self.current_user
+
+        # Nobody is logged in
+        if user is None:
+            return False
+
+        # Base case, user is one of the owners
+        if user in rule.owners:
             return True
 
         # User has to be in a group to gain access to the view
-        if group and self.user_in_group(self.current_user, group):
+        if rule.groups and self._check_groups(user, rule):
             return True
 
         # Default return False
         return False
 
-    def chown(self, owner=None, group=None, action=None):
+    async def check_rule_async(self, rule):
+        """ Checks if a user is granted access based on a compiled `Rule`,
+        awaiting `async` group resolution
+        """
+        if not has_receivers(permission_checked):
+            return await self._check_rule_async(rule)
+
+        start = perf_counter()
+        granted = await self._check_rule_async(rule)
+        permission_checked.send(self, user=self.current_user, rule=rule,
+                                granted=granted,
+                                duration=perf_counter() - start)
+        return granted
+
+    async def _check_rule_async(self, rule):
+        """ Evaluates a rule for the current user """
+        user = self.current_user
+
+        # Nobody is logged in
+        if user is None:
+            return False
+
+        # Base case, user is one of the owners
+        if user in rule.owners:
+            return True
+
+        # User has to be in a group to gain access to the view
+        if rule.groups and await self._check_groups_async(user, rule):
+            return True
+
+        # Default return False
+        return False
+
+    def chown(self, owner=None, group=None, action=None, require_all=False):
         """ A decorator that is used to determine whether a logged in user has
         access to a view::
 
@@ -161,20 +719,50 @@ class PermissionManager(object):
             def index():
                 return "Hello World"
 
-        :param owner: owner
-        :param group: group
+            @app.route("/")
+            # Collections of owners and groups are accepted as well
+            @pm.chown(owner=["root", "test"], group=["admins", "staff"],
+                      require_all=True)
+            def index():
+                return "Hello World"
+
+        Coroutine views are supported, the permission check is awaited
+        without blocking the event loop::
+
+            @app.route("/")
+            @pm.chown(group="users")
+            async def index():
+                return "Hello World"
+
+        :param owner: owner or collection of owners, any of them is granted
+        :param group: group or collection of groups
         :param action: lambda which handles redirects/abort whenever access
                        is denied
+        :param require_all: The user has to be member of all groups instead
+                            of at least one of them
         """
 
-        if not owner and not group:
-            raise PermissionManagerException("You have to provide at least" +
-                                             "one out of owner and group")
+        rule = self._compile_rule(owner, group, require_all)
 
         def decorator(view):
+            if inspect.iscoroutinefunction(view):
+                @wraps(view)
+                async def async_wrapper(*args, **kwargs):
+                    if await self.check_rule_async(rule):
+                        return await view(*args, **kwargs)
+                    else:
+                        if action:
+                            result = action()
+                            if inspect.isawaitable(result):
+                                result = await result
+                            return result
+                        else:
+                            return abort(401)
+                return async_wrapper
+
             @wraps(view)
             def wrapper(*args, **kwargs):
-                if self.check_granted(owner, group):
+                if self.check_rule(rule):
                     return view(*args, **kwargs)
                 else:
                     if action:
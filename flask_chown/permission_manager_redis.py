@@ -8,14 +8,28 @@
     :copyright: (c) 2018 by Matthias Riegler.
     :license: APACHEv2, see LICENSE.md for more details.
 """
-import logging
+import asyncio
+import itertools
 import json
-from . import PermissionManager
-
-import redis
+import logging
+import math
+import random
+import threading
+from time import monotonic, perf_counter, sleep, time
+from collections.abc import Mapping
+from uuid import uuid4
+from flask import current_app, has_app_context
+from .permission_manager import PermissionManager
+from .backends import RedisBackend
+from .bloom import BloomFilter
+from .cache import CircuitBreaker, LRUCache, SingleFlight
+from .signals import backend_failed, cache_hit, cache_miss, has_receivers
 
 logger = logging.getLogger(__name__)
 
+# Result of backend calls if the backend is unavailable
+_UNAVAILABLE = object()
+
 
 class CachedPermissionManager(PermissionManager):
     """ Caches user groups in a redis datastore, optionally pass a timeout
@@ -28,57 +42,1491 @@ class CachedPermissionManager(PermissionManager):
 
     In this example, a timeout of one hour is set (60 minutes a 60 seconds)
 
+    Lookups can additionally be served from a bounded in-process cache which
+    is checked before redis, so hot users do not cause a network round trip::
+
+        pm = CachedPermissionManager(redis_url="redis://localhost",
+                                     timeout=3600,
+                                     local_cache_size=10000,
+                                     local_cache_timeout=30)
+
+    Instead of caching one result per user/group pair, the complete group set
+    of a user can be cached as a redis set by passing ``cache_groups=True``.
+    The `groups_for_user` callback is then called once per user and
+    membership checks are answered by redis (``SISMEMBER``)::
+
+        pm = CachedPermissionManager(redis_url="redis://localhost",
+                                     timeout=3600,
+                                     cache_groups=True)
+
+    Concurrent cache misses for the same user share one call of the
+    `groups_for_user` callback within a process. Passing
+    ``distributed_lock=True`` additionally coalesces misses across processes
+    using a redis lock, other processes wait for the cached result instead of
+    calling the callback themselves.
+
+    To keep directory lookups out of the request path for hot users, cached
+    entries can be served for a grace period after `timeout` while they are
+    refreshed in a background thread. Entries can also be refreshed early
+    with a probability growing towards their expiry, and timeouts can be
+    jittered so entries written together do not expire together::
+
+        pm = CachedPermissionManager(redis_url="redis://localhost",
+                                     timeout=3600,
+                                     stale_timeout=300,
+                                     early_refresh=1.0,
+                                     timeout_jitter=0.1)
+
+    Permission checks of `async` views use the `async` methods of the
+    backend, so reads and writes do not block the event loop (the
+    `groups_for_user` callback is awaited if it is a coroutine function).
+
+    The storage is pluggable (see `flask_chown.backends`), redis is used by
+    default. E.g. to share the cache between the workers of a single host
+    without running redis::
+
+        from flask_chown.backends import SharedMemoryBackend
+
+        pm = CachedPermissionManager(
+            backend=SharedMemoryBackend("/tmp/flask_chown.cache"),
+            timeout=3600)
+
+    A redis cluster or a sentinel monitored master is used by passing a
+    `RedisClusterBackend` or `RedisSentinelBackend`::
+
+        pm = CachedPermissionManager(
+            backend=RedisClusterBackend("redis://node1:6379"),
+            timeout=3600)
+
+    Keys are namespaced by a version counter stored in the backend. Calling
+    `invalidate_all` bumps it, so every cached entry is invalidated at once
+    (old entries are left to expire, set a `timeout`). Other processes pick
+    up the new version within `version_check_interval` seconds.
+
+    Single users or groups can be invalidated with `invalidate_user` and
+    `invalidate_group`, e.g. after revoking a membership. Invalidations are
+    broadcasted (redis pub/sub), managers with an in-process cache drop the
+    affected entries immediately. Backends without messaging (e.g. the
+    `SharedMemoryBackend`) do not broadcast, other managers keep serving
+    their in-process entries for up to `local_cache_timeout` seconds::
+
+        pm.invalidate_user("alice")
+        pm.invalidate_group("admins")
+
+    After a deploy the cache can be populated with `warm_up`, from the
+    `groups_for_user` callback or from a membership dump. With the factory
+    pattern, a warm up can be started in a background thread by `init_app`::
+
+        pm = CachedPermissionManager(redis_url="redis://localhost")
+        pm.groups_for_user(get_groups)
+        pm.init_app(app, warm_up=load_active_users)
+
+    Denials can be cached for a different time than grants with
+    `negative_timeout`. To keep unknown users (e.g. scanners) away from the
+    cache and the `groups_for_user` callback, pass the users holding any group
+    as `known_users`; group checks of all other users are denied right away.
+    The filter is probabilistic (a `BloomFilter`), a few unknown users are
+    still looked up. Users getting their first group have to be added with
+    `add_known_users`, the additions are stored in the backend and broadcasted
+    to the other managers. This requires a backend supporting messaging (not
+    the `SharedMemoryBackend`)::
+
+        pm = CachedPermissionManager(redis_url="redis://localhost",
+                                     timeout=3600,
+                                     negative_timeout=60,
+                                     known_users=load_users_with_groups())
+
+    If the backend fails, permissions are resolved without the cache
+    (using the `groups_for_user` callback and the in-process cache). After
+    repeated failures the backend is skipped for a while by a
+    `CircuitBreaker`. Set short socket timeouts, so a slow redis does not
+    block requests::
+
+        pm = CachedPermissionManager(
+            redis_url="redis://localhost",
+            redis_options={"max_connections": 50,
+                           "socket_timeout": 0.1,
+                           "socket_connect_timeout": 0.5},
+            circuit_breaker=CircuitBreaker(threshold=5, reset_timeout=30))
+
     :param redis_url: Redis connection url
     :param timeout: Sepcify how long the groups should be cached (in seconds);
                     Set to 0 for no timeout
+    :param local_cache_size: Maximum number of entries kept in the in-process
+                             cache; Set to 0 to disable it
+    :param local_cache_timeout: How long entries are kept in the in-process
+                                cache (in seconds); Set to 0 for no timeout
+    :param cache_groups: Cache the group set per user instead of one entry
+                         per user/group pair
+    :param single_flight: Deduplicate concurrent callback calls for the same
+                          user within the process
+    :param distributed_lock: Coalesce cache misses across processes
+    :param lock_timeout: Maximum time a redis lock is held (in seconds)
+    :param stale_timeout: How long an expired entry is still served while it
+                          is refreshed in the background (in seconds);
+                          Set to 0 to disable
+    :param early_refresh: Probabilistic early refresh factor, higher values
+                          refresh earlier; Set to 0 to disable
+    :param timeout_jitter: Randomizes the timeout by up to this fraction,
+                           e.g. 0.1 for +-10%
+    :param backend: `CacheBackend` used instead of redis at `redis_url`
+    :param key_prefix: Prefix of all keys, e.g. to share a redis server
+                       between applications
+    :param version_check_interval: How often the namespace version is read
+                                   from the backend (in seconds)
+    :param negative_timeout: Timeout of denials and empty group sets (in
+                             seconds); `None` to use `timeout`
+    :param known_users: Users holding groups, an iterable or a `BloomFilter`
+                        (sized for the users added later)
+    :param redis_options: Keyword arguments of the `RedisBackend`, e.g.
+                          ``max_connections``, ``socket_timeout`` or
+                          ``replica_urls``
+    :param circuit_breaker: `CircuitBreaker` used to skip an unavailable
+                            backend, `True` for the default settings or
+                            `False` to disable it (failing calls still fall
+                            back to uncached lookups)
     """
 
+    #: Interval in which processes waiting for a lock poll the cache
+    lock_poll_interval = 0.05
+
+    #: Seconds between attempts to subscribe to invalidations
+    subscribe_retry_interval = 5
+
     def __init__(
             self,
             *args,
             redis_url="redis://localhost",
             timeout=0,
+            local_cache_size=0,
+            local_cache_timeout=60,
+            cache_groups=False,
+            single_flight=True,
+            distributed_lock=False,
+            lock_timeout=10,
+            stale_timeout=0,
+            early_refresh=0,
+            timeout_jitter=0,
+            backend=None,
+            key_prefix="fc",
+            version_check_interval=1,
+            negative_timeout=None,
+            known_users=None,
+            redis_options=None,
+            circuit_breaker=True,
             **kwargs):
         """ Init """
         super().__init__(*args, **kwargs)
         self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.cache_groups = cache_groups
+        self.distributed_lock = distributed_lock
+        self.lock_timeout = lock_timeout
+        self._single_flight = SingleFlight() if single_flight else None
+
+        # Background refresh of cached entries
+        self.stale_timeout = stale_timeout
+        self.early_refresh = early_refresh
+        self.timeout_jitter = timeout_jitter
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        # Moving average of the callback duration, used for early refreshes
+        self._resolve_time = 0.0
+
+        # Users not in the filter hold no groups
+        if known_users is not None and \
+                not isinstance(known_users, BloomFilter):
+            known_users = BloomFilter.from_iterable(known_users)
+        self.known_users = known_users
+
+        # In-process cache tier, checked before the backend
+        self._local_cache = None
+        if local_cache_size > 0:
+            self._local_cache = LRUCache(maxsize=local_cache_size,
+                                         ttl=local_cache_timeout)
+
+        # Connect to redis unless another backend is passed
+        if backend is None:
+            backend = RedisBackend(redis_url, **(redis_options or {}))
+        self._backend = backend
+
+        # Other managers would never learn about added users
+        if known_users is not None and not backend.messaging:
+            raise ValueError("known_users requires a backend supporting "
+                             "messaging")
+
+        # Skip the backend while it is unavailable
+        if circuit_breaker is True:
+            circuit_breaker = CircuitBreaker()
+        self.circuit_breaker = circuit_breaker or None
+
+        # Namespace version, part of every key
+        self.key_prefix = key_prefix
+        self.version_check_interval = version_check_interval
+        self._version = None
+        self._version_checked = 0
+        self._prefix = None
+
+        # Drop in-process entries invalidated by other processes and learn
+        # about their known users, subscribed on the first lookup (`None`
+        # once subscribed)
+        self._subscription = None
+        self._subscribe_at = None
+        if self._local_cache is not None or self.known_users is not None:
+            self._subscribe_at = 0
+        self._subscribe_lock = threading.Lock()
+
+    def init_app(self, app, warm_up=None, enforce=False):
+        """ Initializes the PermissionManager and registers an APP
+
+        :param warm_up: Function returning the users (or a mapping of users to
+                        their groups) to cache, called in a background thread
+        :param enforce: See `PermissionManager.init_app`
+        """
+        super().init_app(app, enforce=enforce)
+
+        if warm_up is not None:
+            def run():
+                users = warm_up()
+                if isinstance(users, Mapping):
+                    self.warm_up(memberships=users)
+                else:
+                    self.warm_up(users=users)
+
+            self._in_background("Warm up", app, run)
+
+    def warm_up(self, users=None, memberships=None, batch_size=500,
+                background=False):
+        """ Populates the cache, writing `batch_size` users per round trip
+
+        :param users: Users whose groups are resolved and cached
+        :param memberships: Mapping (or iterable of tuples) of users to their
+                            groups, cached without calling `groups_for_user`
+        :param batch_size: Number of users per batch
+        :param background: Run in a background thread
+        :returns: number of cached users, the started thread if `background`
+        """
+        if background:
+            return self._in_background("Warm up", None, self.warm_up, users,
+                                       memberships, batch_size)
+
+        if isinstance(memberships, Mapping):
+            memberships = memberships.items()
+        entries = itertools.chain(
+            ((user, frozenset(groups)) for user, groups in memberships or ()),
+            ((user, None) for user in users or ()))
+
+        count = 0
+        while True:
+            batch = list(itertools.islice(entries, batch_size))
+            if not batch:
+                return count
+            self._warm_up_batch(batch)
+            count += len(batch)
+
+    def _warm_up_batch(self, batch):
+        """ Caches a batch of ``(user, groups)`` tuples, groups are resolved
+        if `None`
+        """
+        loaded = self._load_groups_many(
+            [user for user, groups in batch if groups is None])
+        batch = [(user, loaded[user] if groups is None else groups)
+                 for user, groups in batch]
+
+        prefix = self._key_prefix()
+        if self.cache_groups:
+            self.backend.set_members_many(
+                [(self._gen_groups_key(user, prefix), groups,
+                  self._cache_timeout(not groups))
+                 for user, groups in batch])
+        else:
+            # Groups used by rules (and the groups they include), and the
+            # ones of the user
+            registered = frozenset(self.group_registry)
+            registered = registered.union(*map(
+                self.group_hierarchy.descendants, registered))
+            pairs = []
+            items = []
+            for user, groups in batch:
+                for group in registered | groups:
+                    result = group in groups
+                    pairs.append((user, group))
+                    items.append((self._gen_key(user, group, prefix),
+                                  self._encode(result),
+                                  self._cache_timeout(not result)))
+            self.backend.set_many(items,
+                                  self._index_items(prefix, pairs))
+
+        self.add_known_users(*(user for user, groups in batch if groups))
+
+    def _version_outdated(self):
+        """ :returns: if the namespace version has to be read again """
+        return self._prefix is None or monotonic() >= \
+            self._version_checked + self.version_check_interval
+
+    def _key_prefix(self):
+        """ :returns: prefix of the current namespace version """
+        if self._version_outdated():
+            _cached = self.backend.get(self._gen_version_key())
+            self._set_version(int(_cached) if _cached else 0)
+        return self._prefix
+
+    async def _key_prefix_async(self):
+        """ :returns: prefix of the current namespace version, read without
+                      blocking the event loop
+        """
+        if self._version_outdated():
+            _cached = await self.backend.get_async(self._gen_version_key())
+            self._set_version(int(_cached) if _cached else 0)
+        return self._prefix
+
+    def _set_version(self, version):
+        """ Switches to a namespace version """
+        self._version_checked = monotonic()
+
+        if version != self._version:
+            self._version = version
+            self._prefix = "{}:{}:".format(self.key_prefix, version)
+            # Entries of the previous version are outdated
+            if self._local_cache is not None:
+                self._local_cache.clear()
+
+    @property
+    def namespace_version(self):
+        """ :returns: current namespace version """
+        self._key_prefix()
+        return self._version
+
+    def invalidate_all(self):
+        """ Invalidates all cached entries by bumping the namespace version """
+        self._set_version(self.backend.incr(self._gen_version_key()))
+        self.backend.publish(self._gen_channel(), "*")
+
+    def invalidate_user(self, user):
+        """ Invalidates all cached entries of a user """
+        keys = [self._gen_groups_key(user)]
+
+        if self.backend.indexed:
+            index_keys = self._index_keys(self._gen_user_index_key, user)
+            keys += index_keys
+            for groups in self.backend.get_members_many(index_keys):
+                keys += [self._gen_key(user, group) for group in groups or ()]
+        else:
+            keys += self.backend.keys(self._gen_key(user, ""))
+
+        self._delete(keys)
+        self._invalidate_local("u:" + user)
+
+    def invalidate_group(self, group):
+        """ Invalidates all cached entries of a group
+
+        Group sets (``cache_groups``) of users who were just added to the
+        group do not contain it, so all entries are invalidated by bumping
+        the namespace version (see `invalidate_all`). Otherwise backends
+        which are not `indexed` scan all keys of the namespace
+        """
+        if self.cache_groups:
+            self.invalidate_all()
+            return
+
+        if self.backend.indexed:
+            index_keys = self._index_keys(self._gen_group_index_key, group)
+            keys = list(index_keys)
+            for users in self.backend.get_members_many(index_keys):
+                keys += [self._gen_key(user, group) for user in users or ()]
+        else:
+            prefix = self._key_prefix()
+            keys = [key for key in self.backend.keys(prefix + "p:")
+                    if self._split_key(key, prefix,
+                                       self.backend.hash_tags)[1] == group]
+
+        self._delete(keys)
+        self._invalidate_local("g:" + group)
+
+    def _delete(self, keys, batch_size=1000):
+        """ Deletes keys in batches """
+        keys = list(dict.fromkeys(keys))
+        for i in range(0, len(keys), batch_size):
+            self.backend.delete(*keys[i:i + batch_size])
+
+    def _invalidate_local(self, message):
+        """ Drops in-process entries and broadcasts the invalidation """
+        self._on_invalidate(message)
+        self.backend.publish(self._gen_channel(), message)
+
+    def _on_invalidate(self, message):
+        """ Drops in-process entries matching an invalidation message:
+        ``u:<user>``, ``g:<group>`` or ``*`` (also used if messages were
+        lost, `message` is `None` then). ``k:<users>`` adds known users.
+        """
+        if message is None and self.known_users is not None:
+            self._load_known_users()
+        elif message is not None and message.startswith("k:"):
+            if self.known_users is not None:
+                self.known_users.update(json.loads(message[2:]))
+            return
+
+        local_cache = self._local_cache
+        if local_cache is None:
+            return
+
+        kind, _, name = (message or "*").partition(":")
+        if kind == "*":
+            # Read the new version on the next lookup
+            self._version_checked = float("-inf")
+            local_cache.clear()
+        elif kind == "u":
+            # Keys are users (group sets) or user/group pairs
+            local_cache.discard_if(
+                lambda key, _: (key[0] == name if isinstance(key, tuple)
+                                else key == name))
+        elif kind == "g":
+            # Any group set may lack the group of a new member
+            local_cache.discard_if(
+                lambda key, _: not isinstance(key, tuple) or key[1] == name)
+
+    def _subscribe(self):
+        """ Listens for invalidations of other processes, retried later if
+        the backend is unavailable
+        """
+        if not self._subscribe_lock.acquire(blocking=False):
+            return
+
+        try:
+            if self._subscribe_at is None:
+                return
+            self._subscription = self.backend.subscribe(
+                self._gen_channel(), self._on_invalidate)
+            self._subscribe_at = None
+            if self.known_users is not None:
+                # Additions broadcasted before subscribing
+                self._load_known_users()
+        except self.backend.errors:
+            logger.exception("Subscribing to invalidations failed")
+            self._subscribe_at = monotonic() + self.subscribe_retry_interval
+        finally:
+            self._subscribe_lock.release()
+
+    def close(self):
+        """ Stops listening for invalidations """
+        with self._subscribe_lock:
+            self._subscribe_at = None
+            if self._subscription is not None:
+                self._subscription.stop()
+                self._subscription = None
+
+    @staticmethod
+    def _split_key(key, prefix, hash_tags=False):
+        """ :returns: user and group of a key generated by `_gen_key` """
+        length, _, rest = key[len(prefix) + 2:].partition(":")
+        length = int(length)
+        if hash_tags:
+            rest = rest[1:length + 1] + rest[length + 2:]
+        return rest[:length], rest[length + 1:]
+
+    def _gen_version_key(self):
+        return self.key_prefix + ":version"
+
+    def _gen_channel(self):
+        return self.key_prefix + ":invalidate"
+
+    def _gen_known_users_key(self):
+        # Not versioned, `invalidate_all` keeps the known users
+        return self.key_prefix + ":known"
+
+    def _gen_key(self, user, group, prefix=None):
+        # The user is length prefixed, so user and group can not be mixed up
+        return "{}p:{}:{}:{}".format(prefix or self._key_prefix(), len(user),
+                                     self._hash_tag(user), group)
+
+    def _gen_groups_key(self, user, prefix=None):
+        return "{}s:{}".format(prefix or self._key_prefix(),
+                               self._hash_tag(user))
+
+    def _gen_user_index_key(self, user, prefix=None, bucket=0):
+        return "{}iu:{}:{}".format(prefix or self._key_prefix(), bucket,
+                                   self._hash_tag(user))
+
+    def _gen_group_index_key(self, group, prefix=None, bucket=0):
+        return "{}ig:{}:{}".format(prefix or self._key_prefix(), bucket,
+                                   group)
+
+    def _hash_tag(self, user):
+        """ :returns: user as hash tag if required by the backend, so all
+                      keys of a user are stored in the same cluster slot
+        """
+        return "{" + user + "}" if self.backend.hash_tags else user
+
+    def _gen_lock_key(self, key):
+        return "{}:lock:{}".format(self.key_prefix, key)
+
+    @staticmethod
+    def _encode(result):
+        """ :returns: cached representation of a result, a single byte """
+        return b"\x01" if result else b"\x00"
+
+    @staticmethod
+    def _decode(_cached):
+        """ :returns: result of a cached value """
+        return _cached == b"\x01"
+
+    def _load_groups(self, user):
+        """ Calls the `groups_for_user` callback, concurrent calls for the
+        same user share the result. The groups are cached as returned by the
+        callback and expanded after reading them
+        """
+        start = monotonic()
+
+        if self._single_flight is None:
+            groups = self._call_groups_for_user(user)
+        else:
+            groups = self._single_flight.do(user, self._call_groups_for_user,
+                                            user)
+
+        duration = monotonic() - start
+        self._resolve_time = (0.8 * self._resolve_time + 0.2 * duration
+                              if self._resolve_time else duration)
+
+        return groups
+
+    def _load_groups_many(self, users):
+        """ Calls the `groups_for_users` callback if set, otherwise
+        `groups_for_user` per user
+        """
+        if getattr(self, "_get_groups_for_users", None) is None:
+            return {user: self._load_groups(user) for user in users}
+
+        start = monotonic()
+        groups = self._call_groups_for_users(users)
+
+        # Per user, to be comparable with single calls
+        duration = (monotonic() - start) / max(len(users), 1)
+        self._resolve_time = (0.8 * self._resolve_time + 0.2 * duration
+                              if self._resolve_time else duration)
+
+        return groups
+
+    @property
+    def _refresh_enabled(self):
+        """ :returns: if the remaining TTL of entries has to be checked """
+        return self.timeout > 0 and (self.stale_timeout > 0 or
+                                     self.early_refresh > 0)
+
+    def _cache_timeout(self, negative=False):
+        """ :returns: timeout of a new entry, including jitter and the
+                      stale period
+        """
+        timeout = self.timeout
+        if negative and self.negative_timeout is not None:
+            timeout = self.negative_timeout
+
+        if not timeout:
+            return 0
+
+        if self.timeout_jitter:
+            timeout *= 1 + random.uniform(-self.timeout_jitter,
+                                          self.timeout_jitter)
+        return max(1, int(round(timeout + self.stale_timeout)))
+
+    def _index_timeout(self):
+        """ :returns: timeout of index sets, outliving the entries they index
+        """
+        timeouts = [self.timeout]
+        if self.negative_timeout is not None:
+            timeouts.append(self.negative_timeout)
+        if not all(timeouts):
+            return 0
+
+        return int(math.ceil(max(timeouts) * (1 + self.timeout_jitter) +
+                             self.stale_timeout)) + 1
+
+    def _index_items(self, prefix, pairs):
+        """ :returns: ``(key, members, timeout)`` items recording entries in
+                      the index sets of users and groups, used by
+                      `invalidate_user` and `invalidate_group`
+
+        :param pairs: ``(user, group)`` tuples of cached results
+        """
+        if not self.backend.indexed:
+            return []
+
+        timeout = self._index_timeout()
+        bucket = self._index_bucket(timeout)
+        index = {}
+        for user, group in pairs:
+            index.setdefault(self._gen_user_index_key(user, prefix, bucket),
+                             set()).add(group)
+            index.setdefault(self._gen_group_index_key(group, prefix, bucket),
+                             set()).add(user)
+
+        return [(key, members, timeout) for key, members in index.items()]
+
+    @staticmethod
+    def _index_bucket(period):
+        """ :returns: current bucket of the index sets. A new set is started
+                      every `period` seconds (the index timeout), so sets
+                      stop growing and expire with the entries they index
+        """
+        return int(time() // period) if period else 0
+
+    def _index_keys(self, gen_key, name):
+        """ :returns: keys of the index sets of a user or group which might
+                      index entries that did not expire yet
+        """
+        period = self._index_timeout()
+        if not period:
+            return [gen_key(name)]
+
+        # Entries outlive their bucket by up to one period, the next bucket
+        # covers clock differences between hosts
+        bucket = self._index_bucket(period)
+        prefix = self._key_prefix()
+        return [gen_key(name, prefix, b)
+                for b in (bucket - 1, bucket, bucket + 1)]
+
+    def _needs_refresh(self, ttl):
+        """ Checks if an entry with the remaining `ttl` should be refreshed,
+        either because it is stale or (probabilistically) about to expire
+        """
+        # Missing or no expiry
+        if ttl is None or ttl < 0:
+            return False
+
+        fresh = ttl - self.stale_timeout
+        if fresh <= 0:
+            return True
+
+        if self.early_refresh > 0 and self._resolve_time > 0:
+            # The closer to the expiry and the slower the callback, the more
+            # likely an early refresh is
+            return (-self._resolve_time * self.early_refresh *
+                    math.log(1.0 - random.random()) >= fresh)
+
+        return False
+
+    def _store_local(self, key, value, negative=False):
+        """ Stores a value in the in-process cache, denials do not outlive
+        `negative_timeout`
+        """
+        ttl = None
+        if negative and self.negative_timeout:
+            ttl = self.negative_timeout
+            if self._local_cache.ttl:
+                ttl = min(ttl, self._local_cache.ttl)
+        self._local_cache.set(key, value, ttl)
+
+    def add_known_users(self, *users):
+        """ Adds users to the `known_users` filter, e.g. after they got their
+        first group. The users are stored in the backend and broadcasted to
+        the filters of the other managers.
+        """
+        if self.known_users is None or not users:
+            return
+
+        self.known_users.update(users)
+        self.backend.add_members_many(
+            [(self._gen_known_users_key(), users, 0)])
+        self.backend.publish(self._gen_channel(),
+                             "k:" + json.dumps(list(users)))
+
+    def _load_known_users(self):
+        """ Adds the users stored by `add_known_users` to the filter """
+        try:
+            users = self.backend.get_members(self._gen_known_users_key())
+        except self.backend.errors:
+            logger.exception("Loading known users failed")
+            return
+        self.known_users.update(users or ())
+
+    def _is_unknown(self, user):
+        """ :returns: `True` if the user surely holds no groups """
+        if self.known_users is None:
+            return False
+        if self._subscribe_at is not None:
+            self._check_subscription()
+        return user not in self.known_users
+
+    def _check_subscription(self):
+        """ Subscribes to invalidations if the (next) attempt is due """
+        if self._subscribe_at is not None and \
+                monotonic() >= self._subscribe_at:
+            self._subscribe()
+
+    async def _check_subscription_async(self):
+        """ Subscribes to invalidations if the (next) attempt is due, in the
+        default executor so a slow or unavailable backend does not block
+        the event loop
+        """
+        if self._subscribe_at is not None and \
+                monotonic() >= self._subscribe_at:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._subscribe)
+
+    def _backend_failed(self, error):
+        """ Records a backend failure """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.failure()
+        logger.exception("Cache backend failed, not using the cache")
+        if has_receivers(backend_failed):
+            backend_failed.send(self, error=error)
+
+    def _get_local(self, key):
+        """ :returns: value of the in-process cache or `None` """
+        if self._subscribe_at is not None:
+            self._check_subscription()
+
+        value = self._local_cache.get(key)
+        if has_receivers(cache_hit) or has_receivers(cache_miss):
+            (cache_miss if value is None else cache_hit).send(
+                self, tier="local", duration=None)
+        return value
+
+    @staticmethod
+    def _is_miss(result):
+        """ :returns: if a backend read (with or without TTL) missed """
+        return (result[0] if isinstance(result, tuple) else result) is None
+
+    def _read(self, read, *args):
+        """ :returns: result of a backend read, timed if it is observed """
+        if not (has_receivers(cache_hit) or has_receivers(cache_miss)):
+            return read(*args)
+
+        start = perf_counter()
+        result = read(*args)
+        (cache_miss if self._is_miss(result) else cache_hit).send(
+            self, tier="backend", duration=perf_counter() - start)
+        return result
+
+    async def _read_async(self, read, *args):
+        """ :returns: result of a backend read, timed if it is observed """
+        if not (has_receivers(cache_hit) or has_receivers(cache_miss)):
+            return await read(*args)
+
+        start = perf_counter()
+        result = await read(*args)
+        (cache_miss if self._is_miss(result) else cache_hit).send(
+            self, tier="backend", duration=perf_counter() - start)
+        return result
 
-        # Connect to redis
-        self._redis = redis.from_url(redis_url)
+    def _read_many(self, read, keys):
+        """ :returns: results of a batched backend read """
+        results = read(keys)
+        if has_receivers(cache_hit) or has_receivers(cache_miss):
+            for result in results:
+                (cache_miss if result is None else cache_hit).send(
+                    self, tier="backend", duration=None)
+        return results
 
-    @classmethod
-    def _gen_json_pair(cls, user, group):
-        return "flask_chown:CachedPermissionManager:granted" + json.dumps({
-            "user": user,
-            "group": group
-            })
+    def _guarded(self, func, *args):
+        """ Calls `func`, which may only use the backend. Callbacks are called
+        outside, so their errors are not taken for backend failures
+
+        :returns: result of `func`, `_UNAVAILABLE` if the backend fails or the
+                  circuit breaker is open
+        """
+        breaker = self.circuit_breaker
+        if breaker is not None and not breaker.allow():
+            return _UNAVAILABLE
+
+        try:
+            result = func(*args)
+        except self.backend.errors as e:
+            self._backend_failed(e)
+            return _UNAVAILABLE
+        except BaseException:
+            # Not a backend failure (e.g. cancelled), give up a pending
+            # trial call
+            if breaker is not None:
+                breaker.release()
+            raise
+
+        if breaker is not None:
+            breaker.success()
+        return result
+
+    async def _guarded_async(self, func, *args):
+        """ Awaits `func`, which may only use the backend
+
+        :returns: result of `func`, `_UNAVAILABLE` if the backend fails or the
+                  circuit breaker is open
+        """
+        breaker = self.circuit_breaker
+        if breaker is not None and not breaker.allow():
+            return _UNAVAILABLE
+
+        try:
+            result = await func(*args)
+        except self.backend.errors as e:
+            self._backend_failed(e)
+            return _UNAVAILABLE
+        except BaseException:
+            # Not a backend failure (e.g. cancelled), give up a pending
+            # trial call
+            if breaker is not None:
+                breaker.release()
+            raise
+
+        if breaker is not None:
+            breaker.success()
+        return result
+
+    def _refresh_in_background(self, key, func, *args):
+        """ Calls `func` in a background thread, unless a refresh of `key` is
+        already running
+        """
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                func(*args)
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+
+        self._in_background("Refreshing {}".format(key), None, refresh)
+
+    @staticmethod
+    def _in_background(name, app, func, *args):
+        """ Calls `func` in a daemon thread within the application context of
+        `app` (or the current one), exceptions are logged
+
+        :returns: the started thread
+        """
+        if app is None and has_app_context():
+            app = current_app._get_current_object()
+
+        def run():
+            try:
+                if app is None:
+                    func(*args)
+                else:
+                    with app.app_context():
+                        func(*args)
+            except Exception:
+                logger.exception("{} failed".format(name))
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _load_and_store(self, load, store, *args):
+        """ :returns: result of `load`, stored in the backend by `store` """
+        result = load(*args)
+        self._guarded(store, result, *args)
+        return result
+
+    def _with_lock(self, key, lookup, load, store, *args):
+        """ Calls `load` and `store`s the result while holding a lock for
+        `key` in the backend, if distributed locking is enabled. Processes not
+        getting the lock wait until `lookup` returns a cached result (or the
+        lock is gone)
+        """
+        if not self.distributed_lock:
+            return self._load_and_store(load, store, *args)
+
+        lock_key = self._gen_lock_key(key)
+        token = uuid4().hex.encode()
+
+        locked = self._guarded(self.backend.add, lock_key, token,
+                               self.lock_timeout)
+        if locked is _UNAVAILABLE:
+            return load(*args)
+        if locked:
+            try:
+                return self._load_and_store(load, store, *args)
+            finally:
+                # Only release our own lock, it might have timed out
+                self._guarded(self.backend.delete_if_equal, lock_key, token)
+
+        deadline = monotonic() + self.lock_timeout
+        while monotonic() < deadline:
+            sleep(self.lock_poll_interval)
+
+            result = self._guarded(lookup)
+            if result is _UNAVAILABLE:
+                return load(*args)
+            if result is not None:
+                return result
+
+            exists = self._guarded(self.backend.exists, lock_key)
+            if exists is _UNAVAILABLE:
+                return load(*args)
+            if not exists:
+                break
+
+        # The lock holder failed or took too long
+        return self._load_and_store(load, store, *args)
+
+    def _resolve_groups(self, user):
+        """ :returns: groups of the user, served from the cache if group sets
+                      are cached
+        """
+        return self.group_hierarchy.expand(self._cached_groups(user))
+
+    def _cached_groups(self, user):
+        """ :returns: groups returned by the callback, looked up in the cache
+                      tiers if group sets are cached
+        """
+        if self._is_unknown(user):
+            return frozenset()
+
+        if not self.cache_groups:
+            return self._load_groups(user)
+
+        if self._local_cache is not None:
+            groups = self._get_local(user)
+            if groups is not None:
+                return groups
+
+        found = self._guarded(self._lookup_groups, user)
+        if found is _UNAVAILABLE:
+            groups = self._load_groups(user)
+        else:
+            key, groups = found
+            if groups is None:
+                groups = self._cache_groups(key, user)
+
+        if self._local_cache is not None:
+            self._store_local(user, groups, not groups)
+
+        return groups
+
+    def _lookup_groups(self, user):
+        """ :returns: key and group set cached in the backend (`None` if
+                      missing)
+        """
+        key = self._gen_groups_key(user)
+
+        if self._refresh_enabled:
+            groups, ttl = self._read(self.backend.get_members, key, True)
+            if groups is not None and self._needs_refresh(ttl):
+                self._refresh_groups(key, user)
+        else:
+            groups = self._read(self.backend.get_members, key)
+
+        return key, groups
+
+    def _refresh_groups(self, key, user):
+        """ Resolves and stores the group set of a user in the background """
+        self._refresh_in_background(key, self._load_and_store,
+                                    self._load_groups, self._store_groups,
+                                    user)
+
+    def _resolve_groups_many(self, users):
+        """ :returns: groups of the users, served from the cache if group
+                      sets are cached
+        """
+        if self.cache_groups:
+            groups = self._get_groups_many(users)
+        else:
+            groups = self._load_known_groups_many(users)
+
+        expand = self.group_hierarchy.expand
+        return {user: expand(groups[user]) for user in users}
+
+    def _load_known_groups_many(self, users):
+        """ Resolves the groups of multiple users, skipping unknown users """
+        groups = dict.fromkeys(users, frozenset())
+        groups.update(self._load_groups_many(
+            [user for user in users if not self._is_unknown(user)]))
+        return groups
+
+    async def _resolve_groups_async(self, user):
+        """ :returns: groups of the user, served from the cache if group sets
+                      are cached
+        """
+        return self.group_hierarchy.expand(
+            await self._cached_groups_async(user))
+
+    async def _cached_groups_async(self, user):
+        """ :returns: groups returned by the callback, looked up in the cache
+                      tiers if group sets are cached
+        """
+        await self._check_subscription_async()
+        if self._is_unknown(user):
+            return frozenset()
+
+        if not self.cache_groups:
+            return await self._call_groups_for_user_async(user)
+
+        if self._local_cache is not None:
+            groups = self._get_local(user)
+            if groups is not None:
+                return groups
+
+        found = await self._guarded_async(self._lookup_groups_async, user)
+        if found is _UNAVAILABLE:
+            groups = await self._call_groups_for_user_async(user)
+        else:
+            prefix, groups = found
+            if groups is None:
+                groups = await self._cache_groups_async(user, prefix)
+
+        if self._local_cache is not None:
+            self._store_local(user, groups, not groups)
+
+        return groups
+
+    async def _lookup_groups_async(self, user):
+        """ :returns: key prefix and group set cached in the backend (`None`
+                      if missing)
+        """
+        prefix = await self._key_prefix_async()
+        key = self._gen_groups_key(user, prefix)
+
+        if self._refresh_enabled:
+            groups, ttl = await self._read_async(
+                self.backend.get_members_async, key, True)
+            if groups is not None and self._needs_refresh(ttl):
+                self._refresh_groups(key, user)
+        else:
+            groups = await self._read_async(self.backend.get_members_async,
+                                            key)
+
+        return prefix, groups
 
     def user_in_group(self, user, group):
-        """ Cache this function """
-        _cached = self.redis.get(self._gen_json_pair(user, group))
-        if _cached:
-            return b"True" == self.redis.get(self._gen_json_pair(user, group))
+        """ Cache this function, results are memoized per request """
+        if self._is_unknown(user):
+            return False
+        return self._memoize(("granted", user, group),
+                             self._cached_user_in_group, user, group)
+
+    def _cached_user_in_group(self, user, group):
+        """ Looks up the membership in the cache tiers """
+        if self.cache_groups:
+            return self._user_in_cached_groups(user, group)
+
+        # Results are cached for the groups returned by the callback, the
+        # members of included groups are members as well
+        included = self.group_hierarchy.descendants(group)
+        if included:
+            return any(self._check_pairs(
+                [(user, member) for member in (group, *included)]))
+
+        return self._cached_pair(user, group)
+
+    def _cached_pair(self, user, group):
+        """ Looks up a result in the cache tiers """
+        if self._local_cache is not None:
+            result = self._get_local((user, group))
+            if result is not None:
+                return result
+
+        found = self._guarded(self._lookup, user, group)
+        if found is _UNAVAILABLE:
+            result = self._load(user, group)
         else:
-            return self._cache(user, group)
+            key, result = found
+            if result is None:
+                result = self._cache(key, user, group)
+
+        if self._local_cache is not None:
+            self._store_local((user, group), result, not result)
+
+        return result
+
+    def _lookup(self, user, group):
+        """ :returns: key and result cached in the backend (`None` if
+                      missing)
+        """
+        key = self._gen_key(user, group)
+
+        if self._refresh_enabled:
+            _cached, ttl = self._read(self.backend.get, key, True)
+            if _cached and self._needs_refresh(ttl):
+                self._refresh_in_background(key, self._load_and_store,
+                                            self._load, self._store,
+                                            user, group)
+        else:
+            _cached = self._read(self.backend.get, key)
+
+        return key, self._decode(_cached) if _cached else None
+
+    def _load(self, user, group):
+        """ :returns: uncached result """
+        return group in self._load_groups(user)
 
-    def _cache(self, user, group):
-        """ Caches the call """
-        result = super().user_in_group(user, group)
+    async def user_in_group_async(self, user, group):
+        """ Cache this function, results are memoized per request """
+        await self._check_subscription_async()
+        if self._is_unknown(user):
+            return False
+        return await self._memoize_async(("granted", user, group),
+                                         self._cached_user_in_group_async,
+                                         user, group)
 
-        key = self._gen_json_pair(user, group)
+    async def _cached_user_in_group_async(self, user, group):
+        """ Looks up the membership in the cache tiers """
+        if self.cache_groups:
+            return await self._user_in_cached_groups_async(user, group)
 
-        # Cache in redis
-        self.redis.set(key, result)
-        # Set timeout if requested
-        if self.timeout > 0:
-            self.redis.expire(key, self.timeout)
+        for member in (group, *self.group_hierarchy.descendants(group)):
+            if await self._cached_pair_async(user, member):
+                return True
+        return False
+
+    async def _cached_pair_async(self, user, group):
+        """ Looks up a result in the cache tiers """
+        if self._local_cache is not None:
+            result = self._get_local((user, group))
+            if result is not None:
+                return result
+
+        found = await self._guarded_async(self._lookup_async, user, group)
+        if found is _UNAVAILABLE:
+            result = await self._load_async(user, group)
+        else:
+            prefix, result = found
+            if result is None:
+                result = await self._load_async(user, group)
+                await self._guarded_async(self._store_async, result, user,
+                                          group, prefix)
+
+        if self._local_cache is not None:
+            self._store_local((user, group), result, not result)
 
         return result
 
+    async def _lookup_async(self, user, group):
+        """ :returns: key prefix and result cached in the backend (`None` if
+                      missing)
+        """
+        prefix = await self._key_prefix_async()
+        key = self._gen_key(user, group, prefix)
+
+        if self._refresh_enabled:
+            _cached, ttl = await self._read_async(self.backend.get_async, key,
+                                                  True)
+            if _cached and self._needs_refresh(ttl):
+                self._refresh_in_background(key, self._load_and_store,
+                                            self._load, self._store,
+                                            user, group)
+        else:
+            _cached = await self._read_async(self.backend.get_async, key)
+
+        return prefix, self._decode(_cached) if _cached else None
+
+    async def _load_async(self, user, group):
+        """ :returns: uncached result """
+        return group in await self._call_groups_for_user_async(user)
+
+    def check_granted_many(self, pairs):
+        """ Checks a batch of ``(user, group)`` pairs with one backend round
+        trip for reading and one for caching misses
+
+        :param pairs: iterable of ``(user, group)`` tuples
+        :returns: list of booleans in the order of `pairs`
+        """
+        pairs = list(pairs)
+
+        if self.cache_groups:
+            groups = self._resolve_groups_many(
+                list(dict.fromkeys(user for user, _ in pairs)))
+            return [group in groups[user] for user, group in pairs]
+
+        # Members of included groups are members as well
+        descendants = self.group_hierarchy.descendants
+        checks = [(user, (group, *descendants(group)))
+                  for user, group in pairs]
+        members = list(dict.fromkeys((user, member) for user, groups in checks
+                                     for member in groups))
+        granted = dict(zip(members, self._check_pairs(members)))
+        return [any(granted[user, member] for member in groups)
+                for user, groups in checks]
+
+    def _check_pairs(self, pairs):
+        """ Checks ``(user, group)`` pairs against the groups returned by the
+        callback, cached per pair
+        """
+        results = [None] * len(pairs)
+        pending = []
+
+        for i, pair in enumerate(pairs):
+            if self._is_unknown(pair[0]):
+                results[i] = False
+            elif self._local_cache is not None:
+                results[i] = self._get_local(pair)
+            if results[i] is None:
+                pending.append(i)
+
+        if not pending:
+            return results
+
+        found = self._guarded(self._lookup_many,
+                              [pairs[i] for i in pending])
+        if found is _UNAVAILABLE:
+            # Resolved without caching
+            found = [(None, None)] * len(pending)
+
+        misses = []
+        for i, (key, result) in zip(pending, found):
+            if result is None:
+                misses.append((i, key))
+            else:
+                results[i] = result
+
+        if misses:
+            groups = self._load_groups_many(
+                list(dict.fromkeys(pairs[i][0] for i, _ in misses)))
+            stored = []
+            items = []
+            for i, key in misses:
+                user, group = pairs[i]
+                results[i] = group in groups[user]
+                if key is not None:
+                    stored.append(pairs[i])
+                    items.append((key, self._encode(results[i]),
+                                  self._cache_timeout(not results[i])))
+            if items:
+                self._guarded(self._store_many, stored, items)
+
+        if self._local_cache is not None:
+            for i in pending:
+                self._store_local(pairs[i], results[i], not results[i])
+
+        return results
+
+    def _lookup_many(self, pairs):
+        """ :returns: keys and results cached in the backend (`None` if
+                      missing) of ``(user, group)`` tuples
+        """
+        keys = [self._gen_key(*pair) for pair in pairs]
+        return [(key, self._decode(_cached) if _cached else None)
+                for key, _cached in zip(
+                    keys, self._read_many(self.backend.get_many, keys))]
+
+    def _store_many(self, pairs, items):
+        """ Stores the results of ``(user, group)`` tuples as ``(key, value,
+        timeout)`` items
+        """
+        self.backend.set_many(
+            items, self._index_items(self._key_prefix(), pairs))
+
+    def _get_groups_many(self, users):
+        """ :returns: dict of cached group sets, misses are resolved and
+                      cached in one round trip
+        """
+        groups = {}
+        pending = []
+
+        for user in users:
+            if self._is_unknown(user):
+                groups[user] = frozenset()
+            elif self._local_cache is not None:
+                groups[user] = self._get_local(user)
+            if groups.get(user) is None:
+                pending.append(user)
+
+        if not pending:
+            return groups
+
+        found = self._guarded(self._lookup_groups_many, pending)
+        if found is _UNAVAILABLE:
+            # Resolved without caching
+            found = [(None, None)] * len(pending)
+
+        misses = []
+        for user, (key, members) in zip(pending, found):
+            if members is None:
+                misses.append((user, key))
+            else:
+                groups[user] = members
+
+        if misses:
+            groups.update(self._load_groups_many(
+                [user for user, _ in misses]))
+            items = [(key, groups[user], self._cache_timeout(not groups[user]))
+                     for user, key in misses if key is not None]
+            if items:
+                self._guarded(self._store_groups_many, items)
+
+        if self._local_cache is not None:
+            for user in pending:
+                self._store_local(user, groups[user], not groups[user])
+
+        return groups
+
+    def _lookup_groups_many(self, users):
+        """ :returns: keys and group sets cached in the backend (`None` if
+                      missing) of the users
+        """
+        keys = [self._gen_groups_key(user) for user in users]
+        return list(zip(keys, self._read_many(self.backend.get_members_many,
+                                              keys)))
+
+    def _store_groups_many(self, items):
+        """ Stores ``(key, groups, timeout)`` items in one round trip """
+        self.backend.set_members_many(items)
+
+    def _check_groups(self, user, rule):
+        """ Checks the groups one by one, unless the complete group set has
+        to be fetched anyways
+        """
+        if self.cache_groups and (self._local_cache is not None or
+                                  len(rule.groups) > 1):
+            return super()._check_groups(user, rule)
+
+        check = all if rule.require_all else any
+        return check(self.user_in_group(user, group) for group in rule.groups)
+
+    async def _check_groups_async(self, user, rule):
+        """ Checks the groups one by one, unless the complete group set has
+        to be fetched anyways
+        """
+        if self.cache_groups and (self._local_cache is not None or
+                                  len(rule.groups) > 1):
+            return await super()._check_groups_async(user, rule)
+
+        # Stop at the first group deciding the result
+        for group in rule.groups:
+            granted = await self.user_in_group_async(user, group)
+            if granted != rule.require_all:
+                return granted
+
+        return rule.require_all
+
+    def _user_in_cached_groups(self, user, group):
+        """ Checks the membership against the cached group set """
+        if not group:
+            return False
+
+        # The in-process cache needs the complete set anyways, as do groups
+        # including other groups
+        if self._local_cache is not None or \
+                self.group_hierarchy.descendants(group):
+            return group in self.get_groups(user)
+
+        found = self._guarded(self._lookup_membership, user, group)
+        if found is _UNAVAILABLE:
+            return self._load(user, group)
+
+        key, is_member = found
+        if is_member is None:
+            is_member = group in self._cache_groups(key, user)
+        return is_member
+
+    def _lookup_membership(self, user, group):
+        """ :returns: key of the group set and the membership checked by the
+                      backend (`None` if the set is missing)
+        """
+        key = self._gen_groups_key(user)
+
+        # Let the backend do the membership check
+        if self._refresh_enabled:
+            is_member, ttl = self._read(self.backend.is_member, key, group,
+                                        True)
+            if is_member is not None and self._needs_refresh(ttl):
+                self._refresh_groups(key, user)
+        else:
+            is_member = self._read(self.backend.is_member, key, group)
+
+        return key, is_member
+
+    async def _user_in_cached_groups_async(self, user, group):
+        """ Checks the membership against the cached group set """
+        if not group:
+            return False
+
+        # The in-process cache needs the complete set anyways, as do groups
+        # including other groups
+        if self._local_cache is not None or \
+                self.group_hierarchy.descendants(group):
+            return group in await self.get_groups_async(user)
+
+        found = await self._guarded_async(self._lookup_membership_async,
+                                          user, group)
+        if found is _UNAVAILABLE:
+            return await self._load_async(user, group)
+
+        prefix, is_member = found
+        if is_member is None:
+            is_member = group in await self._cache_groups_async(user, prefix)
+        return is_member
+
+    async def _lookup_membership_async(self, user, group):
+        """ :returns: key prefix and the membership checked by the backend
+                      (`None` if the set is missing)
+        """
+        prefix = await self._key_prefix_async()
+        key = self._gen_groups_key(user, prefix)
+
+        if self._refresh_enabled:
+            is_member, ttl = await self._read_async(
+                self.backend.is_member_async, key, group, True)
+            if is_member is not None and self._needs_refresh(ttl):
+                self._refresh_groups(key, user)
+        else:
+            is_member = await self._read_async(self.backend.is_member_async,
+                                               key, group)
+
+        return prefix, is_member
+
+    def _cache_groups(self, key, user):
+        """ Resolves and caches the group set of a user """
+        return self._with_lock(key, lambda: self.backend.get_members(key),
+                               self._load_groups, self._store_groups, user)
+
+    def _store_groups(self, groups, user):
+        """ Stores the group set of a user """
+        self.backend.set_members(self._gen_groups_key(user), groups,
+                                 self._cache_timeout(not groups))
+
+    async def _cache_groups_async(self, user, prefix):
+        """ Resolves and caches the group set of a user """
+        groups = await self._call_groups_for_user_async(user)
+        await self._guarded_async(self._store_groups_async, groups, user,
+                                  prefix)
+        return groups
+
+    async def _store_groups_async(self, groups, user, prefix):
+        """ Stores the group set of a user """
+        await self.backend.set_members_async(
+            self._gen_groups_key(user, prefix), groups,
+            self._cache_timeout(not groups))
+
+    def _cache(self, key, user, group):
+        """ Resolves and caches the call """
+        return self._with_lock(key, lambda: self._get_cached(key),
+                               self._load, self._store, user, group)
+
+    def _get_cached(self, key):
+        """ :returns: cached result or `None` """
+        _cached = self.backend.get(key)
+        return self._decode(_cached) if _cached else None
+
+    def _store(self, result, user, group):
+        """ Stores the result and its index entries in one round trip """
+        prefix = self._key_prefix()
+        self.backend.set_many(
+            [(self._gen_key(user, group, prefix), self._encode(result),
+              self._cache_timeout(not result))],
+            self._index_items(prefix, [(user, group)]))
+
+    async def _store_async(self, result, user, group, prefix):
+        """ Stores the result and its index entries """
+        await self.backend.set_many_async(
+            [(self._gen_key(user, group, prefix), self._encode(result),
+              self._cache_timeout(not result))],
+            self._index_items(prefix, [(user, group)]))
+
+    @property
+    def local_cache(self):
+        """ :returns: In-process cache or `None` if disabled """
+        return self._local_cache
+
+    @property
+    def backend(self):
+        """ :returns: Cache backend """
+        return self._backend
+
     @property
     def redis(self):
-        """ Redis """
-        return self._redis
+        """ Redis, `None` if another backend is used """
+        return getattr(self._backend, "redis", None)
 
     @property
     def timeout(self):
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_chown.permission_manager_snapshot
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Permission manager reading memberships from a snapshot file
+
+    :copyright: (c) 2018 by Matthias Riegler.
+    :license: APACHEv2, see LICENSE.md for more details.
+"""
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections.abc import Mapping
+from time import monotonic
+from .cache import LRUCache
+from .permission_manager import PermissionManager
+
+logger = logging.getLogger(__name__)
+
+# Snapshot layout (little endian):
+#   header:  magic, format version, flags, #users, #groups, #group ids
+#   groups:  (name offset, name length) per group
+#   users:   (name offset, name length, first group id, #group ids) per
+#            user, sorted by name
+#   ids:     group ids of all users
+#   strings: utf-8 encoded names, offsets are relative to this section
+_MAGIC = b"FCSN"
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHHIII")
+_GROUP = struct.Struct("<II")
+_USER = struct.Struct("<IIII")
+_ID = struct.Struct("<I")
+
+
+def write_snapshot(path, memberships):
+    """ Writes a snapshot of the memberships, the file is replaced
+    atomically so running managers never read a partial snapshot::
+
+        write_snapshot("/var/lib/app/groups.snapshot",
+                       {"alice": ["admins", "staff"], "bob": ["staff"]})
+
+    :param path: Path of the snapshot file
+    :param memberships: Mapping (or iterable of tuples) of users to their
+                        groups
+    """
+    if isinstance(memberships, Mapping):
+        memberships = memberships.items()
+
+    users = sorted((user.encode("utf-8"), frozenset(groups))
+                   for user, groups in memberships)
+    groups = sorted(frozenset().union(*(g for _, g in users)))
+    group_ids = {group: i for i, group in enumerate(groups)}
+
+    strings = bytearray()
+
+    def add_string(value):
+        offset = len(strings)
+        strings.extend(value)
+        return offset, len(value)
+
+    group_table = b"".join(_GROUP.pack(*add_string(group.encode("utf-8")))
+                           for group in groups)
+
+    user_table = bytearray()
+    ids = bytearray()
+    count = 0
+    for name, user_groups in users:
+        offset, length = add_string(name)
+        user_table += _USER.pack(offset, length, count, len(user_groups))
+        for group in sorted(user_groups):
+            ids += _ID.pack(group_ids[group])
+        count += len(user_groups)
+
+    header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, 0, len(users),
+                          len(groups), count)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix=".snapshot")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header + group_table + user_table + ids + strings)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class _Snapshot(object):
+    """ Memory mapped snapshot, users are looked up by binary search
+
+    :param cache_size: Maximum number of decoded group sets kept in memory;
+                       Set to 0 to disable
+    """
+
+    def __init__(self, fd, cache_size=0):
+        """ Init """
+        self._mmap = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+
+        # Group sets decoded from this snapshot, dropped with it
+        self.cache = None
+        if cache_size > 0:
+            self.cache = LRUCache(maxsize=cache_size)
+
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError("Snapshot is truncated")
+        magic, version, _, self.users, groups, ids = _HEADER.unpack_from(
+            self._mmap)
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            raise ValueError("Not a snapshot of format version {}".format(
+                _FORMAT_VERSION))
+
+        self._users_at = _HEADER.size + groups * _GROUP.size
+        self._ids_at = self._users_at + self.users * _USER.size
+        self._strings_at = self._ids_at + ids * _ID.size
+        if len(self._mmap) < self._strings_at:
+            raise ValueError("Snapshot is truncated")
+
+        # Few groups, they are decoded once
+        self.groups = [self._string(*_GROUP.unpack_from(
+            self._mmap, _HEADER.size + i * _GROUP.size)).decode("utf-8")
+            for i in range(groups)]
+
+    def _string(self, offset, length):
+        offset += self._strings_at
+        return self._mmap[offset:offset + length]
+
+    def lookup(self, user):
+        """ :returns: frozenset of the groups of the user """
+        name = user.encode("utf-8")
+        low, high = 0, self.users
+
+        while low < high:
+            middle = (low + high) // 2
+            offset, length, first, count = _USER.unpack_from(
+                self._mmap, self._users_at + middle * _USER.size)
+            key = self._string(offset, length)
+
+            if key < name:
+                low = middle + 1
+            elif key > name:
+                high = middle
+            else:
+                ids = struct.unpack_from(
+                    "<{}I".format(count), self._mmap,
+                    self._ids_at + first * _ID.size)
+                return frozenset(self.groups[i] for i in ids)
+
+        return frozenset()
+
+
+class SnapshotPermissionManager(PermissionManager):
+    """ Reads the groups of users from a snapshot file instead of calling
+    `groups_for_user`, without any network dependency. The file is memory
+    mapped, so all workers of a host share its pages::
+
+        write_snapshot("/var/lib/app/groups.snapshot", load_memberships())
+
+        pm = SnapshotPermissionManager(path="/var/lib/app/groups.snapshot")
+
+    Users are looked up by binary search, decoded group sets are kept in a
+    bounded in-process cache. The file is checked for changes every
+    `check_interval` seconds and reloaded atomically. Write new snapshots
+    with `write_snapshot`, the file must never be modified in place (it is
+    mapped into memory). Users not in the snapshot are not member of any
+    group.
+
+    :param path: Path of the snapshot file
+    :param check_interval: How often the file is checked for changes (in
+                           seconds)
+    :param cache_size: Maximum number of decoded group sets kept in memory;
+                       Set to 0 to disable
+    """
+
+    def __init__(self, *args, path, check_interval=1, cache_size=4096,
+                 **kwargs):
+        """ Init """
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._stat = None
+        self._checked = monotonic()
+        self._lock = threading.Lock()
+        self.cache_size = cache_size
+
+        self.reload()
+        super().__init__(*args, **kwargs)
+
+    def reload(self):
+        """ Loads the snapshot file, raises `OSError` or `ValueError` if it
+        can not be read (the current snapshot is kept)
+        """
+        with self._lock:
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                stat = os.fstat(fd)
+                snapshot = _Snapshot(fd, self.cache_size)
+            finally:
+                os.close(fd)
+
+            self._snapshot = snapshot
+            self._stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _current_snapshot(self):
+        """ :returns: the snapshot, reloaded if the file changed """
+        now = monotonic()
+        if now >= self._checked + self.check_interval:
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+                if (stat.st_ino, stat.st_mtime_ns,
+                        stat.st_size) != self._stat:
+                    self.reload()
+            except (OSError, ValueError):
+                logger.exception("Reloading {} failed".format(self.path))
+
+        return self._snapshot
+
+    @property
+    def users(self):
+        """ :returns: number of users in the snapshot """
+        return self._current_snapshot().users
+
+    def _resolve_groups(self, user):
+        """ Looks up the groups of a user in the snapshot """
+        snapshot = self._current_snapshot()
+        cache = snapshot.cache
+        if cache is None:
+            return self.group_hierarchy.expand(snapshot.lookup(user))
+
+        # The groups are cached as in the snapshot, expanded on every lookup.
+        # Every snapshot has its own cache, so results of a replaced snapshot
+        # are never served from the new one
+        groups = cache.get(user)
+        if groups is None:
+            groups = snapshot.lookup(user)
+            cache.set(user, groups)
+
+        return self.group_hierarchy.expand(groups)
+
+    def _resolve_groups_many(self, users):
+        """ Looks up the groups of multiple users in the snapshot """
+        return {user: self._resolve_groups(user) for user in users}
+
+    async def _resolve_groups_async(self, user):
+        """ Looks up the groups of a user in the snapshot """
+        return self._resolve_groups(user)
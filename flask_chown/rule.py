@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_chown.rule
+    ~~~~~~~~~~~~~~~~
+
+    Compiled access rules
+
+    :copyright: (c) 2018 by Matthias Riegler.
+    :license: APACHEv2, see LICENSE.md for more details.
+"""
+import sys
+import threading
+
+
+def _as_frozenset(value):
+    """ Normalizes a single name or a collection of names to a frozenset """
+    if not value:
+        return frozenset()
+    if isinstance(value, str):
+        return frozenset([value])
+    return frozenset(value)
+
+
+class GroupRegistry(object):
+    """ Groups used by the rules of a manager, registered when rules are
+    compiled (usually once at startup). Ad-hoc checks do not register their
+    groups.
+    """
+
+    def __init__(self):
+        """ Init """
+        self._groups = frozenset()
+        self._lock = threading.Lock()
+
+    def register(self, groups):
+        """ Registers groups """
+        with self._lock:
+            self._groups = self._groups.union(groups)
+
+    def __contains__(self, group):
+        return group in self._groups
+
+    def __iter__(self):
+        """ :returns: iterator over the registered groups """
+        return iter(self._groups)
+
+    def __len__(self):
+        return len(self._groups)
+
+
+class Rule(object):
+    """ Access rule of a view, compiled once when the view is decorated so
+    evaluating it per request boils down to set lookups
+
+    :param owner: owner or collection of owners, any of them is granted
+    :param group: group or collection of groups
+    :param require_all: The user has to be member of all groups instead of
+                        at least one of them
+    """
+
+    __slots__ = ("owners", "groups", "require_all")
+
+    def __init__(self, owner=None, group=None, require_all=False):
+        """ Init """
+        self.owners = frozenset(sys.intern(str(o))
+                                for o in _as_frozenset(owner))
+        self.groups = _as_frozenset(group)
+        self.require_all = require_all
+
+    def matches(self, groups):
+        """ :returns: if the groups of a user satisfy the group part of the
+                      rule
+        """
+        if self.require_all:
+            return self.groups.issubset(groups)
+        return not self.groups.isdisjoint(groups)
+
+    def __repr__(self):
+        return "<Rule owners={!r} groups={!r} require_all={!r}>".format(
+            sorted(self.owners), sorted(self.groups), self.require_all)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_chown.signals
+    ~~~~~~~~~~~~~~~~~~~
+
+    Signals emitted by the permission managers (requires blinker)
+
+    Signals are only sent if they have receivers, so instrumentation has no
+    measurable overhead unless it is used::
+
+        from flask_chown.signals import permission_checked
+
+        @permission_checked.connect
+        def log_denials(pm, user, rule, granted, duration):
+            if not granted:
+                logger.info("Denied {} access to {}".format(user, rule))
+
+    All signals are sent with the permission manager as sender, durations are
+    given in seconds.
+
+    :copyright: (c) 2018 by Matthias Riegler.
+    :license: APACHEv2, see LICENSE.md for more details.
+"""
+from flask.signals import Namespace
+
+_signals = Namespace()
+
+#: A rule was checked; `user`, `rule`, `granted` and `duration`
+permission_checked = _signals.signal("permission-checked")
+
+#: Groups were resolved by the `groups_for_user` or `groups_for_users`
+#: callback; `users` (list) and `duration`
+groups_resolved = _signals.signal("groups-resolved")
+
+#: A lookup was answered by a cache tier; `tier` (``"local"`` or
+#: ``"backend"``) and `duration` (`None` if not measured)
+cache_hit = _signals.signal("cache-hit")
+
+#: A lookup missed a cache tier; `tier` and `duration`
+cache_miss = _signals.signal("cache-miss")
+
+#: The cache backend failed; `error`
+backend_failed = _signals.signal("backend-failed")
+
+
+def has_receivers(signal):
+    """ :returns: `True` if the signal has receivers, always `False` without
+                  blinker
+    """
+    return bool(getattr(signal, "receivers", None))
@@ -31,16 +31,28 @@ setup(
         "Framework :: Flask",
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
     ],
 
     keywords="flask permission flask-login flask-principal",
-    packages=find_packages(exclude=["contrib", "docs", "tests"]),
+    packages=find_packages(exclude=["contrib", "docs", "tests", "benchmarks",
+                                    "benchmarks.*"]),
+    python_requires=">=3.7",
     install_requires=["flask"],
     setup_requires=['pytest-runner'],
     tests_require=['pytest', 'future'],
 
     extras_require={  # Optional
-        "caching support": ["redis"]
+        "caching support": ["redis>=4.1"],
+        "async support": ["asgiref"],
+        "signals": ["blinker"],
+        "metrics": ["blinker", "prometheus_client"],
+        "tracing": ["blinker", "opentelemetry-api"],
     },
 
     project_urls={  # Optional
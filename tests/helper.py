@@ -4,9 +4,16 @@ from flask import Flask, g
 from flask_chown import PermissionManager, CachedPermissionManager
 
 try:
-    from flask import _app_ctx_stack as stack
+    # Flask >= 2.2, the stacks are removed in Flask 3
+    from flask.globals import _cv_app
+
+    def app_ctx():
+        return _cv_app.get(None)
 except ImportError:
-    from flask import _request_ctx_stack as stack
+    from flask import _app_ctx_stack
+
+    def app_ctx():
+        return _app_ctx_stack.top
 
 
 def setuser(username):
@@ -31,7 +38,7 @@ def setuser_stack(username):
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            ctx = stack.top
+            ctx = app_ctx()
             ctx.user = username
             return f(*args, **kwargs)
         return wrapper
@@ -57,7 +64,9 @@ def mkapp(
         group,
         use_factory=False,
         cached=False,
-        cached_timeout=0):
+        cached_timeout=0,
+        require_all=False,
+        **cached_kwargs):
     """ Basic test app factory """
 
     app = Flask(__name__)
@@ -68,13 +77,15 @@ def mkapp(
         if not cached:
             pm = PermissionManager()
         else:
-            pm = CachedPermissionManager(timeout=cached_timeout)
+            pm = CachedPermissionManager(timeout=cached_timeout,
+                                         **cached_kwargs)
         pm.init_app(app)
     else:
         if not cached:
             pm = PermissionManager(app)
         else:
-            pm = CachedPermissionManager(app, timeout=cached_timeout)
+            pm = CachedPermissionManager(app, timeout=cached_timeout,
+                                         **cached_kwargs)
 
     # Simple group resolution
     @pm.groups_for_user
@@ -84,7 +95,7 @@ def mkapp(
     # Sample view so we can test behaviour
     @app.route("/")
     @setuser_function(current_user)
-    @pm.chown(owner=owner, group=group)
+    @pm.chown(owner=owner, group=group, require_all=require_all)
     def index():
         return "OK"
 
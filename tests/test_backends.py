@@ -0,0 +1,468 @@
+import asyncio
+import unittest
+import os
+import shutil
+import tempfile
+from time import sleep
+from unittest import mock
+import redis
+from redis.crc import key_slot
+from flask_chown import CachedPermissionManager
+from flask_chown.backends import (MemoryBackend, RedisBackend,
+                                  RedisClusterBackend, RedisSentinelBackend,
+                                  SharedMemoryBackend)
+
+
+class MemoryBackendTest(unittest.TestCase):
+    """ Tests the backend interface, subclasses run the same tests against
+    the other backends
+    """
+
+    def setUp(self):
+        """ Setup the testcase """
+        self.backend = self.make_backend()
+        self.backend.delete("flask_chown:test:a", "flask_chown:test:b",
+                            "flask_chown:test:set")
+
+    def make_backend(self):
+        return MemoryBackend()
+
+    def test_get_set(self):
+        """ Checks if values are stored """
+        backend = self.backend
+        assert backend.get("flask_chown:test:a") is None
+
+        backend.set("flask_chown:test:a", b"True")
+        assert b"True" == backend.get("flask_chown:test:a")
+        assert backend.exists("flask_chown:test:a")
+        assert (b"True", None) == backend.get("flask_chown:test:a",
+                                              with_ttl=True)
+
+        backend.delete("flask_chown:test:a")
+        assert not backend.exists("flask_chown:test:a")
+
+    def test_async(self):
+        """ Checks if the async methods store the same way """
+        backend = self.backend
+
+        async def run():
+            await backend.set_async("flask_chown:test:a", b"1")
+            await backend.set_members_async("flask_chown:test:set",
+                                            ["a", "b"])
+            return (await backend.get_async("flask_chown:test:a"),
+                    await backend.get_members_async("flask_chown:test:set"),
+                    await backend.is_member_async("flask_chown:test:set",
+                                                  "b"),
+                    await backend.is_member_async("flask_chown:test:b",
+                                                  "b"))
+
+        assert (b"1", {"a", "b"}, True, None) == asyncio.run(run())
+        assert {"a", "b"} == backend.get_members("flask_chown:test:set")
+
+    def test_timeout(self):
+        """ Checks if values expire """
+        backend = self.backend
+        backend.set("flask_chown:test:a", b"True", 1)
+
+        _, ttl = backend.get("flask_chown:test:a", with_ttl=True)
+        assert 0 < ttl <= 1
+        sleep(1.2)
+        assert backend.get("flask_chown:test:a") is None
+
+    def test_many(self):
+        """ Checks if batches are stored """
+        backend = self.backend
+        backend.set_many([("flask_chown:test:a", b"True", 10),
+                          ("flask_chown:test:b", b"False", 0)])
+
+        assert [b"True", b"False", None] == backend.get_many(
+            ["flask_chown:test:a", "flask_chown:test:b", "flask_chown:x"])
+
+    def test_many_index(self):
+        """ Checks if index sets are written with batches """
+        backend = self.backend
+        backend.set_many([("flask_chown:test:a", b"True", 10)],
+                         [("flask_chown:test:index", ["a"], 10)])
+        backend.set_members_many([("flask_chown:test:b", ["x"], 10)],
+                                 [("flask_chown:test:index", ["b"], 10)])
+
+        assert b"True" == backend.get("flask_chown:test:a")
+        assert {"x"} == backend.get_members("flask_chown:test:b")
+        assert {"a", "b"} == backend.get_members("flask_chown:test:index")
+
+    def test_add(self):
+        """ Checks if values are only added if missing """
+        backend = self.backend
+        assert backend.add("flask_chown:test:a", b"1", 10)
+        assert not backend.add("flask_chown:test:a", b"2", 10)
+        assert b"1" == backend.get("flask_chown:test:a")
+
+    def test_delete_if_equal(self):
+        """ Checks if values are only deleted if they match """
+        backend = self.backend
+        backend.set("flask_chown:test:a", b"1")
+        backend.delete_if_equal("flask_chown:test:a", b"2")
+        assert b"1" == backend.get("flask_chown:test:a")
+
+        backend.delete_if_equal("flask_chown:test:a", b"1")
+        assert backend.get("flask_chown:test:a") is None
+
+    def test_incr(self):
+        """ Checks if counters are incremented """
+        backend = self.backend
+        assert 1 == backend.incr("flask_chown:test:a")
+        assert 2 == backend.incr("flask_chown:test:a")
+        assert b"2" == backend.get("flask_chown:test:a")
+
+    def test_members(self):
+        """ Checks if member sets are stored """
+        backend = self.backend
+        key = "flask_chown:test:set"
+        assert backend.get_members(key) is None
+        assert backend.is_member(key, "a") is None
+
+        backend.set_members(key, ["a", "b"], 10)
+        assert {"a", "b"} == backend.get_members(key)
+        assert backend.is_member(key, "a")
+        assert not backend.is_member(key, "c")
+        members, ttl = backend.get_members(key, with_ttl=True)
+        assert 0 < ttl <= 10
+
+        backend.set_members(key, [])
+        assert frozenset() == backend.get_members(key)
+        assert not backend.is_member(key, "a")
+
+        backend.set_members_many([(key, ["c"], 0)])
+        assert [{"c"}] == backend.get_members_many([key])
+
+    def test_keys(self):
+        """ Checks if keys are listed by prefix """
+        backend = self.backend
+        backend.set("flask_chown:test:a", b"1")
+        backend.set_members("flask_chown:test:set", ["a"])
+
+        assert ["flask_chown:test:a", "flask_chown:test:set"] == sorted(
+            backend.keys("flask_chown:test:"))
+        # Glob characters are matched literally
+        assert [] == backend.keys("flask_chown:test*")
+
+    def test_publish(self):
+        """ Checks if messages are delivered to subscribers """
+        messages = []
+        subscription = self.backend.subscribe("flask_chown:test",
+                                              messages.append)
+        sleep(0.2)
+        self.backend.publish("flask_chown:test", "a")
+        sleep(0.2)
+        subscription.stop()
+        self.backend.publish("flask_chown:test", "b")
+        sleep(0.2)
+
+        assert ["a"] == messages
+
+    def test_add_members(self):
+        """ Checks if members are added to sets """
+        backend = self.backend
+        backend.add_members_many([("flask_chown:test:set", ["a"], 10)])
+        backend.add_members_many([("flask_chown:test:set", ["b", "c"], 10),
+                                  ("flask_chown:test:b", [], 10)])
+
+        assert {"a", "b", "c"} == backend.get_members("flask_chown:test:set")
+        assert not backend.get_members("flask_chown:test:b")
+
+
+class SharedMemoryBackendTest(MemoryBackendTest):
+
+    def make_backend(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._path = os.path.join(self._tmpdir, "cache")
+        return SharedMemoryBackend(self._path, slots=64, slot_size=64)
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self._tmpdir)
+
+    def test_shared(self):
+        """ Checks if entries are shared between instances (processes) """
+        other = SharedMemoryBackend(self._path, slots=64, slot_size=64)
+        self.backend.set("flask_chown:test:a", b"True")
+
+        assert b"True" == other.get("flask_chown:test:a")
+        other.close()
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+    def test_lock_after_fork(self):
+        """ Checks if the lock excludes forked children (e.g. gunicorn
+        workers of a preloaded app)
+        """
+        import fcntl
+
+        with self.backend._locked(exclusive=True):
+            pid = os.fork()
+            if not pid:
+                try:
+                    fcntl.flock(self.backend._fd,
+                                fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os._exit(0)
+                os._exit(1)
+            _, status = os.waitpid(pid, 0)
+
+        assert 0 == os.WEXITSTATUS(status)
+
+        # The child uses the table once the parent released the lock
+        pid = os.fork()
+        if not pid:
+            try:
+                self.backend.set("flask_chown:test:a", b"True")
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        assert b"True" == self.backend.get("flask_chown:test:a")
+
+    def test_too_large(self):
+        """ Checks if entries not fitting into a slot are not cached """
+        self.backend.set("flask_chown:test:a", b"True")
+        self.backend.set("flask_chown:test:a", b"x" * 64)
+
+        assert self.backend.get("flask_chown:test:a") is None
+
+    def test_publish(self):
+        """ Checks if messaging is reported as unsupported """
+        assert self.backend.subscribe("flask_chown:test", print) is None
+        self.backend.publish("flask_chown:test", "a")
+
+    def test_eviction(self):
+        """ Checks if the table keeps working when full """
+        for i in range(200):
+            self.backend.set("flask_chown:test:{}".format(i), b"1", 10)
+
+        assert b"1" == self.backend.get("flask_chown:test:199")
+
+
+class RedisBackendTest(MemoryBackendTest):
+    """ !!! THIS TESTS REQUIRES A LOCAL RUNNING REDIS SERVER !!! """
+
+    def make_backend(self):
+        return RedisBackend("redis://localhost")
+
+    def test_options(self):
+        """ Checks if the connection pool is configured """
+        backend = RedisBackend("redis://localhost", max_connections=5,
+                               socket_timeout=1)
+        assert 5 == backend.redis.connection_pool.max_connections
+
+        shared = RedisBackend(client=backend.redis)
+        assert backend.redis is shared.redis
+        shared = RedisBackend(connection_pool=backend.redis.connection_pool)
+        assert backend.redis.connection_pool is \
+            shared.redis.connection_pool
+
+    def test_decode_responses(self):
+        """ Checks if clients decoding responses are rejected """
+        with self.assertRaises(ValueError):
+            RedisBackend(client=redis.Redis(decode_responses=True))
+        with self.assertRaises(ValueError):
+            RedisBackend("redis://localhost?decode_responses=True")
+        with self.assertRaises(ValueError):
+            RedisBackend("redis://localhost",
+                         replicas=[redis.Redis(decode_responses=True)])
+
+    def test_subscription_error(self):
+        """ Checks if a subscription survives connection errors """
+        backend = RedisBackend("redis://localhost")
+        backend.resubscribe_interval = 0
+        failures = [redis.ConnectionError("Connection lost")]
+        pubsub = backend.redis.pubsub
+
+        def flaky_pubsub(**kwargs):
+            result = pubsub(**kwargs)
+            get_message = result.get_message
+
+            def flaky_get_message(*args, **kwargs):
+                if failures:
+                    raise failures.pop()
+                return get_message(*args, **kwargs)
+
+            result.get_message = flaky_get_message
+            return result
+
+        backend.redis.pubsub = flaky_pubsub
+        messages = []
+        subscription = backend.subscribe("flask_chown:test",
+                                         messages.append)
+        self.addCleanup(subscription.stop)
+        sleep(0.2)
+        backend.publish("flask_chown:test", "a")
+        sleep(0.2)
+
+        # Lost messages are signaled by `None`
+        assert [None, "a"] == messages
+
+    def test_async_connections(self):
+        """ Checks if event loops share the connection pool """
+        backend = RedisBackend("redis://localhost")
+        for _ in range(20):
+            asyncio.run(backend.get_async("flask_chown:test:a"))
+
+        assert 1 == len(backend.redis.connection_pool._available_connections)
+
+    def test_replicas(self):
+        """ Checks if reads are served by replicas """
+        backend = RedisBackend("redis://localhost",
+                               replica_urls=["redis://localhost/1"])
+        replica = backend.replicas[0]
+        replica.delete("flask_chown:test:a")
+        backend.set("flask_chown:test:a", b"1")
+
+        # Not replicated, read from the primary
+        assert b"1" == backend.get("flask_chown:test:a")
+        assert [b"1"] == backend.get_many(["flask_chown:test:a"])
+
+        replica.set("flask_chown:test:a", b"2")
+        assert b"2" == backend.get("flask_chown:test:a")
+        assert [b"2"] == backend.get_many(["flask_chown:test:a"])
+        replica.delete("flask_chown:test:a")
+
+    def test_replica_latency(self):
+        """ Checks if failing replicas are avoided """
+        backend = RedisBackend(
+            "redis://localhost",
+            replica_urls=["redis://localhost/1", "redis://localhost:1"],
+            replica_selection="latency", socket_connect_timeout=0.1)
+        backend.set("flask_chown:test:a", b"1")
+
+        for _ in range(20):
+            assert b"1" == backend.get("flask_chown:test:a")
+
+        assert backend._replica_latency[0] < backend._replica_latency[1]
+
+
+class _FakeCluster(redis.Redis):
+    """ Rejects multi key commands spanning slots, like a redis cluster """
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.options = kwargs
+        self.batches = []
+
+    def mget(self, keys, *args):
+        keys = list(keys) + list(args)
+        if len({key_slot(key.encode("utf-8")) for key in keys}) > 1:
+            raise redis.ResponseError("CROSSSLOT Keys in request don't hash "
+                                      "to the same slot")
+        return super().mget(keys)
+
+    def mget_nonatomic(self, keys, *args):
+        self.batches.append(list(keys) + list(args))
+        return super().mget(keys, *args)
+
+
+class RedisClusterBackendTest(unittest.TestCase):
+    """ !!! THIS TESTS REQUIRES A LOCAL RUNNING REDIS SERVER !!! """
+
+    def setUp(self):
+        """ Setup the testcase """
+        patcher = mock.patch("redis.cluster.RedisCluster.from_url",
+                             lambda url, **kwargs: _FakeCluster(**kwargs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_connect(self):
+        """ Checks if the cluster is connected with the options """
+        backend = RedisClusterBackend("redis://node1", socket_timeout=1,
+                                      read_from_replicas=True)
+        assert isinstance(backend.redis, _FakeCluster)
+        assert 1 == backend.redis.options["socket_timeout"]
+        assert backend.redis.options["read_from_replicas"]
+        assert [] == backend.replicas
+
+    def test_unsupported(self):
+        """ Checks if options the cluster ignores are rejected """
+        with self.assertRaises(ValueError):
+            RedisClusterBackend("redis://node1",
+                                replica_urls=["redis://node2"])
+        with self.assertRaises(ValueError):
+            RedisClusterBackend("redis://node1",
+                                connection_pool=redis.ConnectionPool())
+
+    def test_hash_tags(self):
+        """ Checks if the keys of a user share a slot and batches are split
+        by slot
+        """
+        backend = RedisClusterBackend("redis://node1")
+        pm = CachedPermissionManager(backend=backend,
+                                     key_prefix="fctestcluster")
+        self.addCleanup(lambda: backend.delete(
+            *backend.keys("fctestcluster:")))
+        pm.groups_for_user(lambda user: ["testgroup1"])
+        pm.invalidate_all()
+        users = ["testuser{}".format(i) for i in range(20)]
+
+        assert pm.user_in_group("a:b", "testgroup1")
+        assert not pm.user_in_group("a:b", "testgroup2")
+        slots = {key_slot(key.encode("utf-8"))
+                 for key in backend.keys(pm._key_prefix() + "p:")}
+        assert {key_slot(b"{a:b}")} == slots
+
+        assert [True] * 20 == pm.check_granted_many(
+            (user, "testgroup1") for user in users)
+        assert [True] * 20 == pm.check_granted_many(
+            (user, "testgroup1") for user in users)
+        assert 2 == len(backend.redis.batches)
+        assert 1 < len({key_slot(key.encode("utf-8"))
+                        for key in backend.redis.batches[-1]})
+
+
+class _FakeSentinel(object):
+    """ Hands out clients of the local redis server """
+
+    def __init__(self, sentinels, sentinel_kwargs=None):
+        self.sentinels = sentinels
+
+    def master_for(self, service_name, **kwargs):
+        client = redis.Redis()
+        client.role = ("master", service_name, kwargs)
+        return client
+
+    def slave_for(self, service_name, **kwargs):
+        client = redis.Redis()
+        client.role = ("replica", service_name, kwargs)
+        return client
+
+
+class RedisSentinelBackendTest(unittest.TestCase):
+    """ !!! THIS TESTS REQUIRES A LOCAL RUNNING REDIS SERVER !!! """
+
+    def setUp(self):
+        """ Setup the testcase """
+        patcher = mock.patch("redis.sentinel.Sentinel", _FakeSentinel)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_discovery(self):
+        """ Checks if the master and the replicas are asked for """
+        backend = RedisSentinelBackend([("sentinel1", 26379)], "mymaster",
+                                       socket_timeout=1)
+        assert "master" == backend.redis.role[0]
+        assert "mymaster" == backend.redis.role[1]
+        assert 1 == backend.redis.role[2]["socket_timeout"]
+        assert [] == backend.replicas
+
+        backend = RedisSentinelBackend([("sentinel1", 26379)], "mymaster",
+                                       read_from_replicas=True)
+        assert [("replica", "mymaster")] == [
+            replica.role[:2] for replica in backend.replicas]
+
+        backend.set("flask_chown:test:a", b"True")
+        assert b"True" == backend.get("flask_chown:test:a")
+        backend.delete("flask_chown:test:a")
+
+    def test_unsupported(self):
+        """ Checks if options bypassing the sentinels are rejected """
+        for options in ({"replica_urls": ["redis://replica"]},
+                        {"client": redis.Redis()},
+                        {"connection_pool": redis.ConnectionPool()}):
+            with self.assertRaises(ValueError):
+                RedisSentinelBackend([("sentinel1", 26379)], "mymaster",
+                                     **options)
@@ -0,0 +1,51 @@
+import unittest
+from flask_chown.bloom import BloomFilter
+
+
+class BloomFilterTest(unittest.TestCase):
+    """ Tests the bloom filter """
+
+    def test_contains(self):
+        """ Checks if added items are found """
+        bloom = BloomFilter(capacity=100)
+        bloom.update("user{}".format(i) for i in range(100))
+
+        assert all("user{}".format(i) in bloom for i in range(100))
+        assert 100 == len(bloom)
+
+    def test_error_rate(self):
+        """ Checks if the false positive rate is in range """
+        bloom = BloomFilter.from_iterable(
+            ("user{}".format(i) for i in range(1000)), error_rate=0.01)
+        false_positives = sum("other{}".format(i) in bloom
+                              for i in range(10000))
+
+        assert false_positives < 300
+
+    def test_growth(self):
+        """ Checks if filters from iterables leave room for more items """
+        bloom = BloomFilter.from_iterable(
+            ("user{}".format(i) for i in range(1000)), error_rate=0.01)
+        bloom.update("user{}".format(i) for i in range(1000, 2000))
+        false_positives = sum("other{}".format(i) in bloom
+                              for i in range(10000))
+
+        assert false_positives < 300
+        assert BloomFilter.from_iterable(["user"], capacity=100).size == \
+            BloomFilter(capacity=100).size
+
+    def test_clear(self):
+        """ Checks if the filter is emptied """
+        bloom = BloomFilter(capacity=10)
+        bloom.add("user")
+        bloom.clear()
+
+        assert "user" not in bloom
+        assert 0 == len(bloom)
+
+    def test_invalid(self):
+        """ Checks if invalid parameters are rejected """
+        with self.assertRaises(ValueError):
+            BloomFilter(capacity=0)
+        with self.assertRaises(ValueError):
+            BloomFilter(capacity=10, error_rate=1)
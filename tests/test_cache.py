@@ -0,0 +1,168 @@
+import unittest
+import threading
+from time import sleep
+from flask_chown.cache import CircuitBreaker, LRUCache, SingleFlight
+
+
+class LRUCacheTest(unittest.TestCase):
+    """ Tests the in-process LRU cache """
+
+    def test_get_set(self):
+        """ Checks if stored values can be retrieved """
+        cache = LRUCache(maxsize=2)
+        cache.set("a", True)
+        cache.set("b", False)
+
+        assert cache.get("a") is True
+        assert cache.get("b") is False
+        assert cache.get("c") is None
+        assert cache.get("c", 1) == 1
+
+    def test_eviction(self):
+        """ Checks if the least recently used entry is evicted """
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        # Touch a, so b is the least recently used one
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert len(cache) == 2
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_ttl(self):
+        """ Checks if entries expire """
+        cache = LRUCache(maxsize=10, ttl=0.1)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=0)
+
+        assert cache.get("a") == 1
+        sleep(0.2)
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+
+    def test_delete_clear(self):
+        """ Checks if entries can be removed """
+        cache = LRUCache(maxsize=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.delete("a")
+
+        assert cache.get("a") is None
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_threaded(self):
+        """ Checks if the size bound holds with concurrent writers """
+        cache = LRUCache(maxsize=50)
+
+        def fill(offset):
+            for i in range(1000):
+                cache.set(offset + i, i)
+                cache.get(offset + i // 2)
+
+        threads = [threading.Thread(target=fill, args=(i * 1000,))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(cache) == 50
+
+    def test_invalid_size(self):
+        """ Checks if an invalid size is rejected """
+        with self.assertRaises(ValueError):
+            LRUCache(maxsize=0)
+
+
+class SingleFlightTest(unittest.TestCase):
+    """ Tests the call deduplication """
+
+    def test_concurrent_calls(self):
+        """ Checks if concurrent calls for the same key call once """
+        flight = SingleFlight()
+        calls = []
+        results = []
+
+        def slow(value):
+            calls.append(value)
+            sleep(0.2)
+            return value
+
+        threads = [threading.Thread(
+                    target=lambda: results.append(flight.do("a", slow, 1)))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert [1] == calls
+        assert [1] * 8 == results
+
+        # Once finished, the next call is executed again
+        assert 2 == flight.do("a", slow, 2)
+        assert [1, 2] == calls
+
+    def test_error(self):
+        """ Checks if errors are raised """
+        flight = SingleFlight()
+
+        def fail():
+            raise KeyError("fail")
+
+        with self.assertRaises(KeyError):
+            flight.do("a", fail)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """ Tests the circuit breaker """
+
+    def test_open(self):
+        """ Checks if the circuit opens after consecutive failures """
+        breaker = CircuitBreaker(threshold=2, reset_timeout=10)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        assert breaker.allow()
+
+        breaker.failure()
+        assert breaker.is_open
+        assert not breaker.allow()
+
+    def test_trial(self):
+        """ Checks if a single trial call is allowed after the timeout """
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0.1)
+        breaker.failure()
+        sleep(0.2)
+
+        assert breaker.allow()
+        assert not breaker.allow()
+
+        # A failed trial opens the circuit again
+        breaker.failure()
+        assert not breaker.allow()
+        sleep(0.2)
+        assert breaker.allow()
+        breaker.success()
+        assert not breaker.is_open
+        assert breaker.allow()
+
+    def test_release(self):
+        """ Checks if a trial call ending without a result is given up """
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0.1)
+        breaker.failure()
+        sleep(0.2)
+
+        assert breaker.allow()
+        breaker.release()
+        assert breaker.is_open
+        assert breaker.allow()
+
+        # Never ended, given up after the timeout
+        assert not breaker.allow()
+        sleep(0.2)
+        assert breaker.allow()
@@ -1,7 +1,18 @@
 import unittest
+import os
+import shutil
+import tempfile
 from .helper import mkapp, setuser, return_time
-from time import sleep
-import redis
+from flask_chown.backends import (MemoryBackend, RedisBackend,
+                                  SharedMemoryBackend)
+from flask_chown.cache import CircuitBreaker
+from flask_chown.rule import Rule
+from time import sleep, time
+from unittest import mock
+import threading
+import asyncio
+from flask import Flask, g
+from flask_chown import CachedPermissionManager
 
 
 class CachedPermissionManagerTest(unittest.TestCase):
@@ -31,12 +42,20 @@ class CachedPermissionManagerTest(unittest.TestCase):
 
         self._groups_for_user = groups_for_user
         self._setuser = setuser
+        self._backend = self.make_backend()
+
+    def make_backend(self):
+        """ :returns: backend shared by all managers of a test, `None` for
+                      the default redis backend
+        """
+        return None
 
     def get_client(
             self,
             current_user=None,
             owner=None,
-            group=None):
+            group=None,
+            **kwargs):
         """ Creates a client """
         app, pm = mkapp(self._setuser,
                         self._groups_for_user,
@@ -45,7 +64,9 @@ class CachedPermissionManagerTest(unittest.TestCase):
                         group,
                         use_factory=False,
                         cached=True,
-                        cached_timeout=self.TTL)
+                        cached_timeout=self.TTL,
+                        backend=self._backend,
+                        **kwargs)
 
         return app.test_client(), pm
 
@@ -54,40 +75,36 @@ class CachedPermissionManagerTest(unittest.TestCase):
         client, _ = self.get_client(*args, **kwargs)
         return client.open("/").status_code
 
-    def get_redis(self):
-        """ Connects to the local running redis server """
-        return redis.from_url("redis://localhost")
-
     def test_ttl_set(self):
         """ Checks if the expires is set correctly """
-        rd = self.get_redis()
         client, pm = self.get_client(current_user="testuser1",
                                      group="testgroup1")
-        key = pm._gen_json_pair("testuser1", "testgroup1")
+        key = pm._gen_key("testuser1", "testgroup1")
 
-        # Do a request so that the redis key gets generated
+        # Do a request so that the key gets generated
         assert 200 == client.open("/").status_code
 
         # Now check if the key TTL is in range of 0..TTL
-        assert rd.ttl(key) <= self.TTL and rd.ttl(key) > 0
+        _, ttl = pm.backend.get(key, with_ttl=True)
+        assert ttl <= self.TTL and ttl > 0
 
     def test_stored_key_access(self):
         """ Checks if access right is stored correctly """
-        rd = self.get_redis()
         client, pm = self.get_client(current_user="testuser1",
                                      group="testgroup1")
-        key = pm._gen_json_pair("testuser1", "testgroup1")
+        key = pm._gen_key("testuser1", "testgroup1")
 
-        assert b"True" == rd.get(key)
+        assert 200 == client.open("/").status_code
+        assert b"\x01" == pm.backend.get(key)
 
     def test_stored_key_denied(self):
         """ Checks if access denied is stored correctly """
-        rd = self.get_redis()
         client, pm = self.get_client(current_user="testuser2",
                                      group="testgroup1")
-        key = pm._gen_json_pair("testuser2", "testgroup1")
+        key = pm._gen_key("testuser2", "testgroup1")
 
-        assert b"False" == rd.get(key)
+        assert 401 == client.open("/").status_code
+        assert b"\x00" == pm.backend.get(key)
 
     def test_caching_persistant_user_in_group(self):
         """ Test if cached result always performs the same """
@@ -119,3 +136,896 @@ class CachedPermissionManagerTest(unittest.TestCase):
         get()  # First call for caching :-)
         for _ in range(10):
             assert 1.0 > get()
+
+    def test_require_all_groups(self):
+        """ Tests if rules with multiple groups are evaluated """
+        client, _ = self.get_client(current_user="testuser1",
+                                    group=["testgroup1", "testgroup2"],
+                                    require_all=True)
+        assert 200 == client.open("/").status_code
+
+        client, _ = self.get_client(current_user="testuser2",
+                                    group=["testgroup1", "testgroup2"],
+                                    require_all=True)
+        assert 401 == client.open("/").status_code
+
+    def _count_concurrent_calls(self, user, pms):
+        """ Checks the same user concurrently with the given managers,
+        :returns: number of callback calls
+        """
+        calls = []
+
+        def groups_for_user(username):
+            calls.append(username)
+            sleep(0.5)
+            return ["testgroup1"]
+
+        for pm in pms:
+            pm.groups_for_user(groups_for_user)
+
+        pms[0].backend.delete(pms[0]._gen_key(user, "testgroup1"),
+                              pms[0]._gen_groups_key(user))
+
+        results = []
+        threads = [threading.Thread(target=lambda pm=pm: results.append(
+                    pm.user_in_group(user, "testgroup1")))
+                   for pm in pms for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert [True] * len(threads) == results
+        return len(calls)
+
+    def test_single_flight(self):
+        """ Tests if concurrent misses call the callback once """
+        _, pm = self.get_client(current_user="testuser6", group="testgroup1")
+        assert 1 == self._count_concurrent_calls("testuser6", [pm])
+
+    def test_distributed_lock(self):
+        """ Tests if concurrent misses of several managers (processes) call
+        the callback once
+        """
+        pms = [self.get_client(current_user="testuser7", group="testgroup1",
+                               distributed_lock=True)[1]
+               for _ in range(3)]
+        assert 1 == self._count_concurrent_calls("testuser7", pms)
+
+    def test_check_granted_many(self):
+        """ Tests if batches are cached """
+        calls = []
+
+        def groups_for_user(username):
+            calls.append(username)
+            return ["testgroup1"] if username == "testuser10" else []
+
+        self._groups_for_user = groups_for_user
+        _, pm = self.get_client(group="testgroup1", local_cache_size=10)
+        users = ["testuser10", "testuser11"]
+        pm.backend.delete(
+            *[pm._gen_key(u, g) for u in users
+              for g in ["testgroup1", "testgroup2"]] +
+            [pm._gen_groups_key(u) for u in users])
+
+        pairs = [(u, g) for u in users for g in ["testgroup1", "testgroup2"]]
+        expected = [True, False, False, False]
+
+        assert expected == pm.check_granted_many(pairs)
+        assert users == calls
+
+        # Served from the backend
+        pm.local_cache.clear()
+        assert expected == pm.check_granted_many(pairs)
+        # Served from the in-process cache
+        assert expected == pm.check_granted_many(pairs)
+        assert users == calls
+
+    def test_key_format(self):
+        """ Tests if keys are compact and unambiguous """
+        _, pm = self.get_client(group="testgroup1", key_prefix="fctest")
+        version = pm.namespace_version
+
+        assert "fctest:{}:p:3:a:b:c".format(version) == pm._gen_key("a:b",
+                                                                    "c")
+        assert pm._gen_key("a:b", "c") != pm._gen_key("a", "b:c")
+        assert "fctest:{}:s:a".format(version) == pm._gen_groups_key("a")
+
+    def test_warm_up(self):
+        """ Tests if users and memberships are cached in batches """
+        pm, calls, _ = self._get_counting_pm()
+
+        assert 3 == pm.warm_up(users=["testuser13", "testuser15"],
+                               memberships={"testuser16": ["testgroup2"]},
+                               batch_size=2)
+        assert ["testuser13", "testuser15"] == calls
+
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert not pm.user_in_group("testuser15", "testgroup1")
+        assert pm.user_in_group("testuser16", "testgroup2")
+        assert not pm.user_in_group("testuser16", "testgroup1")
+        assert ["testuser13", "testuser15"] == calls
+
+    def test_warm_up_background(self):
+        """ Tests if the warm up runs in a background thread """
+        pm, calls, _ = self._get_counting_pm()
+
+        pm.warm_up(users=["testuser13"], background=True).join()
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert ["testuser13"] == calls
+
+        app = Flask(__name__)
+        pm.init_app(app, warm_up=lambda: {"testuser17": ["testgroup1"]})
+        sleep(0.2)
+        assert pm.user_in_group("testuser17", "testgroup1")
+        assert ["testuser13"] == calls
+
+    def test_groups_for_users(self):
+        """ Tests if batches resolve misses with the bulk callback """
+        pm, calls, groups = self._get_counting_pm()
+        bulk_calls = []
+
+        @pm.groups_for_users
+        def groups_for_users(usernames):
+            bulk_calls.append(usernames)
+            return groups
+
+        assert [True, False, True] == pm.check_granted_many(
+            [("testuser13", "testgroup1"), ("testuser15", "testgroup1"),
+             ("testuser14", "testgroup1")])
+        assert 2 == pm.warm_up(users=["testuser18", "testuser19"])
+        assert not pm.user_in_group("testuser18", "testgroup1")
+
+        assert [] == calls
+        assert [["testuser13", "testuser15", "testuser14"],
+                ["testuser18", "testuser19"]] == bulk_calls
+
+    def test_hash_tags(self):
+        """ Tests if keys of a user share a hash tag if required """
+        _, pm = self.get_client(group="testgroup1", key_prefix="fctest")
+        pm.backend.hash_tags = True
+        version = pm.namespace_version
+
+        assert "fctest:{}:p:3:{{a:b}}:c".format(version) == pm._gen_key(
+            "a:b", "c")
+        assert "fctest:{}:s:{{a}}".format(version) == pm._gen_groups_key("a")
+
+        assert pm.user_in_group("testuser1", "testgroup1")
+        pm.invalidate_group("testgroup1")
+        assert not pm.backend.exists(pm._gen_key("testuser1", "testgroup1"))
+        assert pm.backend.get_members(pm._gen_groups_key("testuser1")) is None
+
+    def test_invalidate_all(self):
+        """ Tests if bumping the namespace version invalidates entries """
+        calls = []
+
+        def groups_for_user(username):
+            calls.append(username)
+            return ["testgroup1"]
+
+        self._groups_for_user = groups_for_user
+        _, pm = self.get_client(group="testgroup1", local_cache_size=10,
+                                version_check_interval=0)
+        _, other = self.get_client(group="testgroup1",
+                                   version_check_interval=0)
+        pm.invalidate_all()
+
+        assert pm.user_in_group("testuser12", "testgroup1")
+        assert other.user_in_group("testuser12", "testgroup1")
+        assert 1 == len(calls)
+
+        version = pm.namespace_version
+        other.invalidate_all()
+        assert version + 1 == other.namespace_version
+        assert version + 1 == pm.namespace_version
+
+        # Both the backend and the in-process cache miss
+        assert pm.user_in_group("testuser12", "testgroup1")
+        assert 2 == len(calls)
+
+    def _get_counting_pm(self, **kwargs):
+        """ Creates a manager counting callback calls """
+        calls = []
+        groups = {"testuser13": ["testgroup1"], "testuser14": ["testgroup1"]}
+
+        def groups_for_user(username):
+            calls.append(username)
+            return groups.get(username, [])
+
+        self._groups_for_user = groups_for_user
+        _, pm = self.get_client(group="testgroup1", **kwargs)
+        pm.invalidate_all()
+        return pm, calls, groups
+
+    def test_group_hierarchy(self):
+        """ Tests if the cached groups are expanded by the hierarchy of each
+        manager, without invalidating them
+        """
+        for cache_groups in (False, True):
+            for local_cache_size in (0, 10):
+                pm, calls, _ = self._get_counting_pm(
+                    local_cache_size=local_cache_size,
+                    cache_groups=cache_groups)
+                other = self.get_client(group="testgroup1",
+                                        local_cache_size=local_cache_size,
+                                        cache_groups=cache_groups)[1]
+                pm.group_registry.register(["testgroup2"])
+                version = pm.namespace_version
+
+                assert pm.user_in_group("testuser13", "testgroup1")
+                assert not pm.user_in_group("testuser13", "testgroup2")
+                count = len(calls)
+
+                pm.include_group("testgroup2", "testgroup1")
+                assert pm.user_in_group("testuser13", "testgroup2")
+                assert asyncio.run(
+                    pm.user_in_group_async("testuser13", "testgroup2"))
+                assert [True] == pm.check_granted_many(
+                    [("testuser13", "testgroup2")])
+                # Shared entries hold the groups returned by the callback
+                assert not other.user_in_group("testuser13", "testgroup2")
+
+                pm.exclude_group("testgroup2", "testgroup1")
+                assert not pm.user_in_group("testuser13", "testgroup2")
+                assert count == len(calls)
+                assert version == pm.namespace_version
+
+                pm.include_group("testgroup2", "testgroup1")
+                assert 1 == pm.warm_up(
+                    memberships={"testuser14": ["testgroup1"]})
+                assert pm.user_in_group("testuser14", "testgroup2")
+                assert not other.user_in_group("testuser14", "testgroup2")
+                assert count == len(calls)
+                assert "testgroup2" in pm.get_groups("testuser13")
+
+    def test_invalidate_user(self):
+        """ Tests if only entries of the user are invalidated """
+        pm, calls, groups = self._get_counting_pm(local_cache_size=10)
+
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert pm.user_in_group("testuser14", "testgroup1")
+        groups["testuser13"] = []
+        pm.invalidate_user("testuser13")
+
+        assert not pm.user_in_group("testuser13", "testgroup1")
+        assert pm.user_in_group("testuser14", "testgroup1")
+        assert ["testuser13", "testuser14", "testuser13"] == calls
+
+    def test_invalidate_group(self):
+        """ Tests if only entries of the group are invalidated """
+        pm, calls, groups = self._get_counting_pm(local_cache_size=10)
+
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert not pm.user_in_group("testuser15", "testgroup2")
+        groups["testuser13"] = []
+        pm.invalidate_group("testgroup1")
+
+        assert not pm.user_in_group("testuser13", "testgroup1")
+        assert not pm.user_in_group("testuser15", "testgroup2")
+        assert ["testuser13", "testuser15", "testuser13"] == calls
+
+    def test_invalidate_group_grant(self):
+        """ Tests if users added to a group are members after invalidating
+        the group
+        """
+        for local_cache_size in (0, 10):
+            pm, _, groups = self._get_counting_pm(
+                local_cache_size=local_cache_size)
+
+            assert not pm.user_in_group("testuser15", "testgroup1")
+            groups["testuser15"] = ["testgroup1"]
+            pm.invalidate_group("testgroup1")
+
+            assert pm.user_in_group("testuser15", "testgroup1")
+
+    def test_invalidate_indexed(self):
+        """ Tests if indexed backends invalidate without scanning keys """
+        pm, calls, groups = self._get_counting_pm()
+        if not pm.backend.indexed:
+            self.skipTest("Backend is not indexed")
+
+        def keys(prefix):
+            raise AssertionError("Keys are scanned")
+
+        pm.backend.keys = keys
+        self.addCleanup(delattr, pm.backend, "keys")
+
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert pm.check_granted_many([("testuser14", "testgroup1")]) == [True]
+        groups["testuser13"] = groups["testuser14"] = []
+        pm.invalidate_group("testgroup1")
+        assert not pm.user_in_group("testuser13", "testgroup1")
+        assert not pm.user_in_group("testuser14", "testgroup1")
+
+        groups["testuser13"] = ["testgroup1"]
+        pm.invalidate_user("testuser13")
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert ["testuser13", "testuser14"] * 2 + ["testuser13"] == calls
+
+    def test_index_written_with_entries(self):
+        """ Tests if index sets are written in the same call as entries """
+        pm, _, groups = self._get_counting_pm()
+        if not pm.backend.indexed:
+            self.skipTest("Backend is not indexed")
+
+        def add_members_many(items):
+            raise AssertionError("Index written separately")
+
+        pm.backend.add_members_many = add_members_many
+        self.addCleanup(delattr, pm.backend, "add_members_many")
+
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert pm.check_granted_many([("testuser14", "testgroup1")]) == [True]
+        groups["testuser13"] = []
+        pm.invalidate_group("testgroup1")
+        assert not pm.user_in_group("testuser13", "testgroup1")
+
+    def test_index_buckets(self):
+        """ Tests if index sets are replaced periodically, so they stop
+        growing and expire
+        """
+        pm, calls, groups = self._get_counting_pm()
+        if not pm.backend.indexed:
+            self.skipTest("Backend is not indexed")
+        period = pm._index_timeout()
+        start = time()
+
+        def at(offset):
+            return mock.patch("flask_chown.permission_manager_redis.time",
+                              lambda: start + offset)
+
+        with at(0):
+            assert pm.user_in_group("testuser13", "testgroup1")
+        with at(period):
+            assert pm.user_in_group("testuser14", "testgroup1")
+            # Entries of the previous period are still found
+            groups["testuser13"] = groups["testuser14"] = []
+            pm.invalidate_group("testgroup1")
+            assert not pm.user_in_group("testuser13", "testgroup1")
+            assert not pm.user_in_group("testuser14", "testgroup1")
+        with at(3 * period):
+            groups["testuser15"] = ["testgroup1"]
+            assert pm.user_in_group("testuser15", "testgroup1")
+            key = pm._gen_group_index_key(
+                "testgroup1", None, pm._index_bucket(period))
+            members, ttl = pm.backend.get_members(key, with_ttl=True)
+
+        assert {"testuser15"} == members
+        assert 0 < ttl <= period
+
+    def test_invalidation_broadcast(self):
+        """ Tests if invalidations drop in-process entries of other
+        managers
+        """
+        pm, calls, groups = self._get_counting_pm(local_cache_size=10)
+        _, other = self.get_client(group="testgroup1", local_cache_size=10)
+        self.addCleanup(pm.close)
+        self.addCleanup(other.close)
+        # Wait for the subscriptions
+        sleep(0.2)
+
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert other.user_in_group("testuser13", "testgroup1")
+        groups["testuser13"] = []
+        pm.invalidate_user("testuser13")
+        sleep(0.2)
+
+        if other._subscription is None:
+            # Messaging not supported, the in-process entry is kept
+            assert other.user_in_group("testuser13", "testgroup1")
+        else:
+            assert not other.user_in_group("testuser13", "testgroup1")
+
+    def test_negative_timeout(self):
+        """ Tests if denials are cached with their own timeout """
+        pm, _, _ = self._get_counting_pm(negative_timeout=2)
+
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert not pm.user_in_group("testuser15", "testgroup1")
+
+        assert 2 == pm._cache_timeout(negative=True)
+        assert self.TTL == pm._cache_timeout()
+        _, ttl = pm.backend.get(pm._gen_key("testuser15", "testgroup1"),
+                                with_ttl=True)
+        if ttl is None:
+            _, ttl = pm.backend.get_members(pm._gen_groups_key("testuser15"),
+                                            with_ttl=True)
+        assert 0 < ttl <= 2
+
+    def test_known_users(self):
+        """ Tests if unknown users are denied without any lookup """
+        pm, calls, _ = self._get_counting_pm(known_users=["testuser13"])
+        pm.backend.delete(pm._gen_known_users_key())
+        self.addCleanup(pm.close)
+
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert not pm.user_in_group("testuser14", "testgroup1")
+        assert not pm.check_granted_many([("testuser14", "testgroup1")])[0]
+        assert frozenset() == pm.get_groups("testuser14")
+        assert ["testuser13"] == calls
+        assert not pm.backend.exists(pm._gen_key("testuser14", "testgroup1"))
+
+        pm.add_known_users("testuser14")
+        assert pm.user_in_group("testuser14", "testgroup1")
+
+    def test_known_users_shared(self):
+        """ Tests if known users are added to the filters of other managers
+        """
+        pm, _, _ = self._get_counting_pm(known_users=["testuser13"])
+        pm.backend.delete(pm._gen_known_users_key())
+        other = self.get_client(group="testgroup1",
+                                known_users=["testuser13"])[1]
+        self.addCleanup(pm.close)
+        self.addCleanup(other.close)
+
+        # Subscribes
+        assert not other.user_in_group("testuser14", "testgroup1")
+        sleep(0.2)
+        pm.add_known_users("testuser14")
+        sleep(0.2)
+
+        assert other.user_in_group("testuser14", "testgroup1")
+
+        # Managers started later load the added users
+        late = self.get_client(group="testgroup1",
+                               known_users=["testuser13"])[1]
+        self.addCleanup(late.close)
+        assert late.user_in_group("testuser13", "testgroup1")
+        assert late.user_in_group("testuser14", "testgroup1")
+
+    def _get_refreshing_pm(self, user, **kwargs):
+        """ Creates a manager counting callback calls """
+        calls = []
+
+        def groups_for_user(username):
+            calls.append(username)
+            sleep(0.1)
+            return ["testgroup1"]
+
+        self._groups_for_user = groups_for_user
+        _, pm = self.get_client(current_user=user, group="testgroup1",
+                                **kwargs)
+        pm.backend.delete(pm._gen_key(user, "testgroup1"),
+                          pm._gen_groups_key(user))
+        return pm, calls
+
+    def test_stale_while_revalidate(self):
+        """ Tests if stale entries are served and refreshed in background """
+        pm, calls = self._get_refreshing_pm("testuser8", stale_timeout=10)
+        pm.timeout = 1
+
+        assert pm.user_in_group("testuser8", "testgroup1")
+        assert 1 == len(calls)
+        sleep(1.2)
+
+        @return_time
+        def get():
+            assert pm.user_in_group("testuser8", "testgroup1")
+
+        # Served from the stale entry
+        assert 0.1 > get()
+        sleep(0.5)
+        assert 2 == len(calls)
+
+    def test_stale_while_revalidate_async(self):
+        """ Tests if async checks serve stale entries and refresh them in
+        background
+        """
+        pm, calls = self._get_refreshing_pm("testuser8", stale_timeout=10)
+        pm.timeout = 1
+
+        assert asyncio.run(pm.user_in_group_async("testuser8", "testgroup1"))
+        assert 1 == len(calls)
+        sleep(1.2)
+
+        @return_time
+        def get():
+            assert asyncio.run(pm.user_in_group_async("testuser8",
+                                                      "testgroup1"))
+
+        # Served from the stale entry
+        assert 0.1 > get()
+        sleep(0.5)
+        assert 2 == len(calls)
+
+    def test_early_refresh(self):
+        """ Tests if entries are refreshed before they expire """
+        pm, calls = self._get_refreshing_pm("testuser9",
+                                            early_refresh=1e9)
+
+        assert pm.user_in_group("testuser9", "testgroup1")
+        assert pm.user_in_group("testuser9", "testgroup1")
+        sleep(0.5)
+        assert 2 == len(calls)
+
+    def test_timeout_jitter(self):
+        """ Tests if the timeout is randomized in range """
+        _, pm = self.get_client(group="testgroup1", timeout_jitter=0.5,
+                                stale_timeout=5)
+        timeouts = {pm._cache_timeout() for _ in range(100)}
+
+        assert all(15 <= t <= 35 for t in timeouts)
+        assert len(timeouts) > 1
+
+    def test_async(self):
+        """ Tests if the async path caches the same way """
+        client, pm = self.get_client(current_user="testuser2",
+                                     group="testgroup2")
+        pm.version_check_interval = 0
+
+        if isinstance(pm.backend, RedisBackend):
+            # Blocking calls must not be made in the event loop
+            def blocking(func):
+                def wrapper(*args, **kwargs):
+                    with self.assertRaises(RuntimeError):
+                        asyncio.get_running_loop()
+                    return func(*args, **kwargs)
+                return wrapper
+
+            for name in ("get", "set_many", "get_members", "is_member",
+                         "set_members_many"):
+                setattr(pm.backend, name, blocking(getattr(pm.backend,
+                                                           name)))
+
+        async def check(group):
+            with client.application.test_request_context("/"):
+                g.current_user = "testuser2"
+                return await pm.check_rule_async(Rule(group=group))
+
+        assert asyncio.run(check("testgroup2"))
+        assert not asyncio.run(check("testgroup1"))
+        assert asyncio.run(check(["testgroup1", "testgroup2"]))
+        assert not asyncio.run(check(["testgroup1", "testgroup3"]))
+
+    def test_local_cache(self):
+        """ Tests if the in-process cache answers without asking the
+        backend
+        """
+        client, pm = self.get_client(current_user="testuser3",
+                                     group="testgroup3",
+                                     local_cache_size=10)
+
+        assert 200 == client.open("/").status_code
+        assert pm.local_cache.get(("testuser3", "testgroup3")) is True
+
+        # Remove the backend entry, the local cache still has the result
+        pm.backend.delete(pm._gen_key("testuser3", "testgroup3"))
+
+        @return_time
+        def get():
+            assert 200 == client.open("/").status_code
+
+        assert 1.0 > get()
+
+
+class CachedGroupsPermissionManagerTest(CachedPermissionManagerTest):
+    """ Tests caching the complete group set per user
+
+        !!! THIS TESTS REQUIRES A LOCAL RUNNING REDIS SERVER !!!
+    """
+
+    def get_client(self, *args, **kwargs):
+        """ Creates a client caching group sets """
+        kwargs.setdefault("cache_groups", True)
+        return super().get_client(*args, **kwargs)
+
+    def test_ttl_set(self):
+        """ Checks if the expires is set correctly """
+        client, pm = self.get_client(current_user="testuser1",
+                                     group="testgroup1")
+        key = pm._gen_groups_key("testuser1")
+
+        assert 200 == client.open("/").status_code
+        _, ttl = pm.backend.get_members(key, with_ttl=True)
+        assert ttl <= self.TTL and ttl > 0
+
+    def test_stored_key_access(self):
+        """ Checks if the group set is stored correctly """
+        client, pm = self.get_client(current_user="testuser1",
+                                     group="testgroup1")
+
+        assert 200 == client.open("/").status_code
+        assert {"testgroup1", "testgroup2"} == pm.backend.get_members(
+            pm._gen_groups_key("testuser1"))
+
+    def test_stored_key_denied(self):
+        """ Checks if users without groups are cached as well """
+        client, pm = self.get_client(current_user="testuser4",
+                                     group="testgroup1")
+
+        assert 401 == client.open("/").status_code
+        assert frozenset() == pm.backend.get_members(
+            pm._gen_groups_key("testuser4"))
+
+    def test_single_callback_per_user(self):
+        """ Checks if the callback is called once for multiple groups """
+        calls = []
+
+        def groups_for_user(username):
+            calls.append(username)
+            return ["testgroup1", "testgroup2"]
+
+        self._groups_for_user = groups_for_user
+        _, pm = self.get_client(current_user="testuser5",
+                                group="testgroup1")
+        pm.backend.delete(pm._gen_groups_key("testuser5"))
+
+        assert pm.user_in_group("testuser5", "testgroup1")
+        assert pm.user_in_group("testuser5", "testgroup2")
+        assert not pm.user_in_group("testuser5", "testgroup3")
+        assert not pm.user_in_group("testuser5", "")
+        assert ["testuser5"] == calls
+
+    def test_invalidate_group(self):
+        """ Tests if all group sets are invalidated, any of them may lack
+        the group
+        """
+        pm, calls, groups = self._get_counting_pm(local_cache_size=10)
+
+        assert pm.user_in_group("testuser13", "testgroup1")
+        assert not pm.user_in_group("testuser15", "testgroup1")
+        groups["testuser13"] = []
+        groups["testuser15"] = ["testgroup1"]
+        pm.invalidate_group("testgroup1")
+
+        assert not pm.user_in_group("testuser13", "testgroup1")
+        assert pm.user_in_group("testuser15", "testgroup1")
+        assert ["testuser13", "testuser15"] * 2 == calls
+
+    def test_invalidate_group_message(self):
+        """ Tests if invalidations of other processes drop all group sets of
+        the in-process cache
+        """
+        pm, _, _ = self._get_counting_pm(local_cache_size=10)
+        pm.user_in_group("testuser13", "testgroup1")
+        pm.user_in_group("testuser15", "testgroup1")
+
+        pm._on_invalidate("g:testgroup1")
+        assert 0 == len(pm.local_cache)
+
+    def test_index_buckets(self):
+        """ Group sets are not indexed """
+        self.skipTest("Group sets are not indexed")
+
+    def test_local_cache(self):
+        """ Tests if the in-process cache holds the group set """
+        client, pm = self.get_client(current_user="testuser3",
+                                     group="testgroup3",
+                                     local_cache_size=10)
+
+        assert 200 == client.open("/").status_code
+        assert frozenset(["testgroup3"]) == pm.local_cache.get("testuser3")
+
+
+class MemoryBackendMixin(object):
+    """ Runs the tests against the in-process backend """
+
+    def make_backend(self):
+        return MemoryBackend()
+
+
+class SharedMemoryBackendMixin(object):
+    """ Runs the tests against the shared memory backend """
+
+    def make_backend(self):
+        self._tmpdir = tempfile.mkdtemp()
+        return SharedMemoryBackend(os.path.join(self._tmpdir, "cache"),
+                                   slots=1024)
+
+    def tearDown(self):
+        self._backend.close()
+        shutil.rmtree(self._tmpdir)
+
+    def test_known_users(self):
+        """ Tests if known users are rejected, they would not be shared """
+        with self.assertRaises(ValueError):
+            self.get_client(group="testgroup1", known_users=["testuser13"])
+
+    def test_known_users_shared(self):
+        """ Tests if known users are rejected, they would not be shared """
+        self.test_known_users()
+
+
+class MemoryCachedPermissionManagerTest(
+        MemoryBackendMixin, CachedPermissionManagerTest):
+    pass
+
+
+class MemoryCachedGroupsPermissionManagerTest(
+        MemoryBackendMixin, CachedGroupsPermissionManagerTest):
+    pass
+
+
+class SharedMemoryCachedPermissionManagerTest(
+        SharedMemoryBackendMixin, CachedPermissionManagerTest):
+    pass
+
+
+class SharedMemoryCachedGroupsPermissionManagerTest(
+        SharedMemoryBackendMixin, CachedGroupsPermissionManagerTest):
+    pass
+
+
+class _Unavailable(object):
+    """ Fails on every access, like a storage which is down """
+
+    def __getattr__(self, name):
+        raise ConnectionError("unavailable")
+
+
+class _Cancelled(object):
+    """ Cancels the task on every access """
+
+    def __getattr__(self, name):
+        raise asyncio.CancelledError()
+
+
+class _UnsubscribableBackend(MemoryBackend):
+    """ Fails to subscribe until `available` is set """
+
+    available = False
+
+    def subscribe(self, channel, callback):
+        if not self.available:
+            raise ConnectionError("unavailable")
+        return super().subscribe(channel, callback)
+
+
+class SubscriptionTest(unittest.TestCase):
+    """ Tests subscribing to invalidations """
+
+    def test_lazy_subscription(self):
+        """ Tests if subscribing is retried if the backend is down """
+        backend = _UnsubscribableBackend()
+        pm = CachedPermissionManager(backend=backend, local_cache_size=10)
+        pm.subscribe_retry_interval = 0.1
+        pm.groups_for_user(lambda user: ["testgroup1"])
+        self.addCleanup(pm.close)
+
+        assert pm.user_in_group("testuser1", "testgroup1")
+        assert pm._subscription is None
+
+        backend.available = True
+        sleep(0.2)
+        assert pm.user_in_group("testuser2", "testgroup1")
+        assert pm._subscription is not None
+
+        # Lost messages drop all in-process entries
+        pm._on_invalidate(None)
+        assert 0 == len(pm.local_cache)
+
+    def test_async_subscription(self):
+        """ Tests if async checks subscribe outside of the event loop """
+        threads = []
+
+        class RecordingBackend(_UnsubscribableBackend):
+            def subscribe(self, channel, callback):
+                threads.append(threading.current_thread())
+                return super().subscribe(channel, callback)
+
+        backend = RecordingBackend()
+        pm = CachedPermissionManager(backend=backend, local_cache_size=10,
+                                     known_users=["testuser1"])
+        pm.groups_for_user(lambda user: ["testgroup1"])
+        self.addCleanup(pm.close)
+
+        async def check():
+            granted = [await pm.user_in_group_async("testuser1",
+                                                    "testgroup1")]
+            # Retry right away
+            backend.available = True
+            pm._subscribe_at = 0
+            granted.append(await pm.get_groups_async("testuser1"))
+            return granted
+
+        assert [True, {"testgroup1"}] == asyncio.run(check())
+        assert pm._subscription is not None
+        assert 2 == len(threads)
+        assert threading.current_thread() not in threads
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """ Tests falling back to uncached lookups if the backend fails """
+
+    def setUp(self):
+        """ Setup the testcase """
+        self.calls = []
+
+        def groups_for_user(username):
+            self.calls.append(username)
+            return ["testgroup1"]
+
+        self.backend = MemoryBackend()
+        self.breaker = CircuitBreaker(threshold=2, reset_timeout=0.5)
+        self.pm = mkapp(setuser, groups_for_user, None, None, "testgroup1",
+                        cached=True, cached_timeout=20, backend=self.backend,
+                        circuit_breaker=self.breaker)[1]
+        self.cache = self.backend._cache
+        self.backend._cache = _Unavailable()
+
+    def test_fallback(self):
+        """ Tests if results are resolved without the backend """
+        assert self.pm.user_in_group("testuser1", "testgroup1")
+        assert not self.pm.user_in_group("testuser1", "testgroup2")
+        assert [True, False] == self.pm.check_granted_many(
+            [("testuser1", "testgroup1"), ("testuser1", "testgroup2")])
+        assert self.breaker.is_open
+
+    def test_recovery(self):
+        """ Tests if the backend is used again after the reset timeout """
+        self.pm.user_in_group("testuser1", "testgroup1")
+        self.pm.user_in_group("testuser1", "testgroup1")
+        assert self.breaker.is_open
+        self.backend._cache = self.cache
+
+        # Still open, the backend is skipped
+        assert self.pm.user_in_group("testuser1", "testgroup1")
+        assert not self.backend.keys("fc:")
+
+        sleep(0.6)
+        assert self.pm.user_in_group("testuser1", "testgroup1")
+        assert not self.breaker.is_open
+        assert self.backend.keys("fc:")
+
+    def test_callback_errors(self):
+        """ Tests if errors of the callback are not taken for backend
+        failures
+        """
+        self.backend._cache = self.cache
+        calls = []
+
+        def groups_for_user(username):
+            calls.append(username)
+            raise ConnectionError("directory unavailable")
+
+        self.pm.groups_for_user(groups_for_user)
+
+        for cache_groups in (False, True):
+            self.pm.cache_groups = cache_groups
+            for check in (lambda: self.pm.user_in_group("testuser1",
+                                                        "testgroup1"),
+                          lambda: self.pm.check_granted_many(
+                              [("testuser1", "testgroup1")])):
+                del calls[:]
+                with self.assertRaises(ConnectionError):
+                    check()
+                assert ["testuser1"] == calls
+
+        assert not self.breaker.is_open
+        assert 0 == self.breaker._failures
+
+    def test_cancelled_trial(self):
+        """ Tests if a cancelled trial call does not keep the circuit open """
+        self.pm.user_in_group("testuser1", "testgroup1")
+        self.pm.user_in_group("testuser1", "testgroup1")
+        assert self.breaker.is_open
+
+        sleep(0.6)
+        self.backend._cache = _Cancelled()
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(self.pm.user_in_group_async("testuser1",
+                                                    "testgroup1"))
+
+        # The backend recovered, the next call is a trial again
+        self.backend._cache = self.cache
+        assert asyncio.run(self.pm.user_in_group_async("testuser1",
+                                                       "testgroup1"))
+        assert not self.breaker.is_open
+        assert self.backend.keys("fc:")
+
+    def test_disabled(self):
+        """ Tests if backend errors fall back to uncached lookups without a
+        circuit breaker, the backend is never skipped
+        """
+        self.pm.circuit_breaker = None
+
+        with mock.patch.object(self.pm, "_backend_failed",
+                               wraps=self.pm._backend_failed) as failed:
+            for _ in range(3):
+                assert self.pm.user_in_group("testuser1", "testgroup1")
+        assert ["testuser1"] * 3 == self.calls
+        assert 3 <= failed.call_count
+
+        self.backend._cache = self.cache
+        assert self.pm.user_in_group("testuser2", "testgroup1")
+        assert self.backend.keys("fc:")
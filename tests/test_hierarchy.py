@@ -0,0 +1,61 @@
+import unittest
+from flask_chown.hierarchy import GroupHierarchy
+
+
+class GroupHierarchyTest(unittest.TestCase):
+    """ Tests the group hierarchy """
+
+    def setUp(self):
+        """ Setup the testcase: staff > admins > root, staff > developers """
+        self.hierarchy = GroupHierarchy()
+        self.hierarchy.add("admins", "root")
+        self.hierarchy.add("staff", "admins")
+        self.hierarchy.add("staff", "developers")
+
+    def test_expand(self):
+        """ Checks if groups are expanded transitively """
+        expand = self.hierarchy.expand
+
+        assert {"root", "admins", "staff"} == expand(["root"])
+        assert {"developers", "staff"} == expand(["developers"])
+        assert {"staff"} == expand(["staff"])
+        assert {"other"} == expand(["other"])
+        assert frozenset() == GroupHierarchy().expand([])
+        assert {"root", "admins", "developers"} == \
+            self.hierarchy.descendants("staff")
+        assert 4 == len(self.hierarchy)
+
+    def test_add(self):
+        """ Checks if the closure is updated incrementally """
+        assert self.hierarchy.add("everyone", "company")
+        assert self.hierarchy.add("company", "staff")
+        assert {"staff", "admins", "root", "developers"} == \
+            self.hierarchy.descendants("company")
+
+        assert {"root", "admins", "staff", "company", "everyone"} == \
+            self.hierarchy.expand(["root"])
+        # Already included
+        assert not self.hierarchy.add("staff", "admins")
+
+    def test_remove(self):
+        """ Checks if removed inclusions are dropped from the closure """
+        # root is included by staff via admins and directly
+        self.hierarchy.add("staff", "root")
+
+        assert self.hierarchy.remove("admins", "root")
+        assert {"root", "staff"} == self.hierarchy.expand(["root"])
+        assert {"admins", "staff"} == self.hierarchy.expand(["admins"])
+
+        self.hierarchy.remove("staff", "admins")
+        assert {"admins"} == self.hierarchy.expand(["admins"])
+        assert {"root", "developers"} == self.hierarchy.descendants("staff")
+        assert not self.hierarchy.remove("staff", "admins")
+
+    def test_cycle(self):
+        """ Checks if cycles are rejected """
+        with self.assertRaises(ValueError):
+            self.hierarchy.add("root", "staff")
+        with self.assertRaises(ValueError):
+            self.hierarchy.add("staff", "staff")
+
+        assert {"root", "admins", "staff"} == self.hierarchy.expand(["root"])
@@ -0,0 +1,40 @@
+import subprocess
+import sys
+import unittest
+
+
+def loaded_modules(code):
+    """ :returns: set of the modules loaded after running `code` in a new
+                  interpreter
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-c", code + "\nimport sys\nprint(*sys.modules)"],
+        stderr=subprocess.STDOUT)
+    return set(output.decode().split())
+
+
+class ImportTest(unittest.TestCase):
+    """ Tests if optional modules are imported lazily """
+
+    def test_lazy_import(self):
+        """ Checks if importing the package loads the basic manager only """
+        modules = loaded_modules("import flask_chown")
+
+        assert "flask_chown.permission_manager" in modules
+        for module in ("flask_chown.permission_manager_redis",
+                       "flask_chown.permission_manager_snapshot",
+                       "flask_chown.backends", "redis", "flask_login"):
+            assert module not in modules
+
+    def test_import_on_access(self):
+        """ Checks if the managers are imported on first access """
+        modules = loaded_modules(
+            "from flask_chown import CachedPermissionManager")
+
+        assert "flask_chown.permission_manager_redis" in modules
+        assert "redis" not in modules
+
+        import flask_chown
+        assert "SnapshotPermissionManager" in dir(flask_chown)
+        with self.assertRaises(AttributeError):
+            flask_chown.MissingPermissionManager
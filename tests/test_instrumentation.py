@@ -0,0 +1,128 @@
+import unittest
+from flask import g
+from flask_chown import signals
+from flask_chown.backends import MemoryBackend
+from flask_chown.instrumentation import (OpenTelemetryInstrumentation,
+                                         PrometheusInstrumentation)
+from flask_chown.rule import Rule
+from .helper import mkapp, setuser
+from .test_cached_permission_manager import _Unavailable
+
+try:
+    import blinker
+except ImportError:
+    blinker = None
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import \
+        InMemorySpanExporter
+except ImportError:
+    TracerProvider = None
+
+
+@unittest.skipIf(blinker is None, "blinker missing")
+class InstrumentationTest(unittest.TestCase):
+    """ Tests the signals and the instrumentation based on them """
+
+    def setUp(self):
+        """ Setup the testcase """
+        def groups_for_user(username):
+            return ["testgroup1"] if username == "testuser1" else []
+
+        self.app, self.pm = mkapp(setuser, groups_for_user, "testuser1",
+                                  None, "testgroup1", cached=True,
+                                  backend=MemoryBackend(),
+                                  local_cache_size=10)
+
+    def check(self, user, group="testgroup1"):
+        with self.app.test_request_context("/"):
+            g.current_user = user
+            return self.pm.check_rule(Rule(group=group))
+
+    def record(self, signal):
+        """ :returns: list of the keyword arguments the signal is sent with """
+        sent = []
+
+        def receiver(sender, **kwargs):
+            assert sender is self.pm
+            sent.append(kwargs)
+
+        signal.connect(receiver, weak=False)
+        self.addCleanup(signal.disconnect, receiver)
+        return sent
+
+    def test_signals(self):
+        """ Checks if signals are sent on checks and cache lookups """
+        checked = self.record(signals.permission_checked)
+        resolved = self.record(signals.groups_resolved)
+        hits = self.record(signals.cache_hit)
+        misses = self.record(signals.cache_miss)
+
+        assert self.check("testuser1")
+        assert self.check("testuser1")
+        assert not self.check("testuser2")
+
+        assert [True, True, False] == [c["granted"] for c in checked]
+        assert all(c["duration"] >= 0 for c in checked)
+        assert [["testuser1"], ["testuser2"]] == [r["users"]
+                                                  for r in resolved]
+        assert ["local", "backend", "local", "backend"] == [
+            m["tier"] for m in misses]
+        assert ["local"] == [h["tier"] for h in hits]
+
+    def test_backend_failed(self):
+        """ Checks if backend failures are signaled """
+        failed = self.record(signals.backend_failed)
+        self.pm.backend._cache = _Unavailable()
+
+        assert self.check("testuser1")
+        assert failed and isinstance(failed[0]["error"], ConnectionError)
+
+    @unittest.skipIf(prometheus_client is None, "prometheus_client missing")
+    def test_prometheus(self):
+        """ Checks if metrics are recorded """
+        registry = prometheus_client.CollectorRegistry()
+        instrumentation = PrometheusInstrumentation(registry).connect(self.pm)
+        self.addCleanup(instrumentation.disconnect)
+
+        self.check("testuser1")
+        self.check("testuser1")
+        self.check("testuser2")
+
+        def value(name, **labels):
+            return registry.get_sample_value("flask_chown_" + name, labels)
+
+        assert 2 == value("checks_total", result="granted")
+        assert 1 == value("checks_total", result="denied")
+        assert 1 == value("cache_requests_total", tier="local", result="hit")
+        assert 2 == value("cache_requests_total", tier="backend",
+                          result="miss")
+        assert 2 == value("callback_duration_seconds_count")
+        assert 2 == value("backend_duration_seconds_count")
+
+        instrumentation.disconnect()
+        self.check("testuser1")
+        assert 2 == value("checks_total", result="granted")
+
+    @unittest.skipIf(TracerProvider is None, "opentelemetry-sdk missing")
+    def test_opentelemetry(self):
+        """ Checks if spans are recorded """
+        exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(exporter))
+        instrumentation = OpenTelemetryInstrumentation(provider).connect()
+        self.addCleanup(instrumentation.disconnect)
+
+        self.check("testuser1")
+
+        spans = exporter.get_finished_spans()
+        assert ["flask_chown.groups_for_user", "flask_chown.check"] == [
+            span.name for span in spans]
+        assert spans[1].attributes["flask_chown.granted"]
@@ -1,4 +1,7 @@
 import unittest
+from flask import Blueprint, Flask, g, request
+from flask_chown import PermissionManager, PermissionManagerException
+from flask_chown.rule import GroupRegistry, Rule
 from .helper import mkapp, setuser, setuser_stack
 
 
@@ -25,14 +28,16 @@ class PermissionManagerBaseTest(unittest.TestCase):
             self,
             current_user=None,
             owner=None,
-            group=None):
+            group=None,
+            require_all=False):
         """ Creates a client """
         app, _ = mkapp(self._setuser,
                        self._groups_for_user,
                        current_user,
                        owner,
                        group,
-                       self._mkapp_factory)
+                       self._mkapp_factory,
+                       require_all=require_all)
         return app.test_client().open("/").status_code
 
 
@@ -83,6 +88,29 @@ class PermissionManagerAccessTestCase(PermissionManagerBaseTest):
         assert 401 == self._get_request_status_code(current_user='testuser1',
                                                     owner='testuser2')
 
+    def test_multiple_owners_and_groups(self):
+        """ Checks if collections of owners and groups are evaluated """
+        assert 200 == self._get_request_status_code(
+            current_user="testuser2", owner=["testuser1", "testuser2"])
+        assert 401 == self._get_request_status_code(
+            current_user="testuser3", owner=["testuser1", "testuser2"])
+        assert 200 == self._get_request_status_code(
+            current_user="testuser3", group=["testgroup1", "testgroup3"])
+        assert 401 == self._get_request_status_code(
+            current_user="testuser2", group=["testgroup1", "testgroup3"])
+
+    def test_require_all_groups(self):
+        """ Checks if all groups are required when requested """
+        assert 200 == self._get_request_status_code(
+            current_user="testuser1", group=["testgroup1", "testgroup2"],
+            require_all=True)
+        assert 401 == self._get_request_status_code(
+            current_user="testuser2", group=["testgroup1", "testgroup2"],
+            require_all=True)
+        assert 200 == self._get_request_status_code(
+            current_user="testuser2", owner="testuser2",
+            group=["testgroup1", "testgroup2"], require_all=True)
+
 
 class PermissionManagerAccessCtxStackTestCase(PermissionManagerAccessTestCase):
 
@@ -113,3 +141,458 @@ class PermissionManagerFactoryCtxStackTest(
         """
         super().setUp()
         self._mkapp_factory = True
+
+
+class PermissionManagerMemoizeTest(PermissionManagerBaseTest):
+
+    def test_single_resolution_per_request(self):
+        """ Checks if several checks in one request resolve the user and the
+        groups only once
+        """
+        calls = []
+
+        def groups_for_user(username):
+            calls.append(username)
+            return ["testgroup1", "testgroup2"]
+
+        app, pm = mkapp(self._setuser, groups_for_user,
+                        "testuser1", None, "testgroup1")
+
+        @app.route("/list")
+        @setuser("testuser1")
+        def listing():
+            granted = [pm.check_granted(None, group)
+                       for group in ["testgroup1", "testgroup2", "testgroup3"]
+                       for _ in range(10)]
+            return str(sum(granted))
+
+        client = app.test_client()
+        assert b"20" == client.open("/list").data
+        assert ["testuser1"] == calls
+
+        # A new request resolves again
+        assert b"20" == client.open("/list").data
+        assert ["testuser1", "testuser1"] == calls
+
+    def test_user_changed(self):
+        """ Checks if a changed user is honored within a context """
+        app, pm = mkapp(self._setuser, self._groups_for_user,
+                        "testuser1", None, "testgroup1")
+
+        with app.test_request_context("/"):
+            g.current_user = "testuser1"
+            assert "testuser1" == pm.current_user
+            assert pm.check_granted(None, "testgroup1")
+            g.current_user = "testuser2"
+            assert "testuser2" == pm.current_user
+            assert not pm.check_granted(None, "testgroup1")
+
+        # Outside of requests, e.g. in jobs
+        with app.app_context():
+            for user, granted in (("testuser1", True), ("testuser2", False)):
+                g.current_user = user
+                assert granted == pm.check_granted(None, "testgroup1")
+
+    def test_shared_app_context(self):
+        """ Checks if requests sharing an application context are checked
+        independently
+        """
+        app, pm = mkapp(self._setuser, self._groups_for_user,
+                        "testuser1", None, "testgroup1")
+
+        @app.route("/as/<user>")
+        @pm.chown(group="testgroup1")
+        def as_user(user):
+            return "OK"
+
+        @app.url_value_preprocessor
+        def login(endpoint, values):
+            g.current_user = (values or {}).get("user")
+
+        client = app.test_client()
+        with app.app_context():
+            assert 200 == client.open("/as/testuser1").status_code
+            assert 401 == client.open("/as/testuser2").status_code
+
+    def test_no_user(self):
+        """ Checks if no user is resolved to `None` """
+        app, pm = mkapp(self._setuser, self._groups_for_user,
+                        None, None, "testgroup1")
+
+        with app.test_request_context("/"):
+            assert pm.current_user is None
+            assert not pm.check_granted(None, "testgroup1")
+
+
+class PermissionManagerRuleTest(PermissionManagerBaseTest):
+
+    def test_rule(self):
+        """ Checks if rules are compiled correctly """
+        rule = Rule(owner="testuser1", group="testgroup1")
+        assert frozenset(["testuser1"]) == rule.owners
+        assert frozenset(["testgroup1"]) == rule.groups
+
+        rule = Rule(owner=["testuser1", "testuser2"],
+                    group=("testgroup1", "testgroup2"))
+        assert frozenset(["testuser1", "testuser2"]) == rule.owners
+        assert frozenset(["testgroup1", "testgroup2"]) == rule.groups
+
+        rule = Rule(group="testgroup1")
+        assert frozenset() == rule.owners
+
+    def test_rule_matches(self):
+        """ Checks if group sets are matched against rules """
+        groups = frozenset(["testgroup1", "testgroup2"])
+        assert Rule(group=["testgroup1", "testgroup3"]).matches(groups)
+        assert not Rule(group="testgroup3").matches(groups)
+        assert Rule(group=["testgroup1", "testgroup2"],
+                    require_all=True).matches(groups)
+        assert not Rule(group=["testgroup1", "testgroup3"],
+                        require_all=True).matches(groups)
+
+    def test_adhoc_groups_not_registered(self):
+        """ Checks if only groups of decorated views are registered """
+        app, pm = mkapp(self._setuser, self._groups_for_user,
+                        "testuser1", None, "testgroup1")
+
+        with app.test_request_context("/"):
+            g.current_user = "testuser1"
+            assert pm.check_granted(None, "testgroup2")
+            assert pm.user_in_groups("testuser1", ["testgroup3",
+                                                   "testgroup2"])
+
+        assert {"testgroup1"} == set(pm.group_registry)
+
+    def test_group_registry(self):
+        """ Checks if groups of rules are registered """
+        registry = GroupRegistry()
+        registry.register(["testgroup1", "testgroup2"])
+        registry.register(["testgroup1"])
+        assert {"testgroup1", "testgroup2"} == set(registry)
+        assert "testgroup2" in registry
+        assert "unknown" not in registry
+        assert 2 == len(registry)
+
+    def test_groups_normalized(self):
+        """ Checks if groups are returned as frozenset """
+        _, pm = mkapp(self._setuser, self._groups_for_user,
+                      "testuser1", None, "testgroup1")
+
+        assert frozenset(["testgroup1", "testgroup2"]) == \
+            pm.get_groups("testuser1")
+        assert frozenset() == pm.get_groups("nobody")
+
+    def test_check_granted_many(self):
+        """ Checks if batches are resolved once per user """
+        calls = []
+
+        def groups_for_user(username):
+            calls.append(username)
+            return self._groups_for_user(username)
+
+        _, pm = mkapp(self._setuser, groups_for_user,
+                      "testuser1", None, "testgroup1")
+
+        pairs = [("testuser1", "testgroup1"), ("testuser2", "testgroup1"),
+                 ("testuser1", "testgroup3"), ("testuser2", "testgroup2")]
+        assert [True, False, False, True] == pm.check_granted_many(pairs)
+        assert ["testuser1", "testuser2"] == calls
+
+    def test_groups_for_users(self):
+        """ Checks if the bulk callback resolves all users at once """
+        calls = []
+
+        app, pm = mkapp(self._setuser, self._groups_for_user,
+                        "testuser1", None, "testgroup1")
+
+        @pm.groups_for_users
+        def groups_for_users(usernames):
+            calls.append(usernames)
+            return {user: self._groups_for_user(user) for user in usernames
+                    if user != "testuser2"}
+
+        pairs = [("testuser1", "testgroup1"), ("testuser2", "testgroup2")]
+        assert [True, False] == pm.check_granted_many(pairs)
+        assert [["testuser1", "testuser2"]] == calls
+
+        with app.test_request_context("/"):
+            pm.get_groups("testuser1")
+            assert {"testuser1": {"testgroup1", "testgroup2"},
+                    "testuser3": {"testgroup3"}} == pm.get_groups_many(
+                        ["testuser1", "testuser3", "testuser1"])
+            # Memoized users are not resolved again
+            assert ["testuser3"] == calls[-1]
+
+    def test_group_hierarchy(self):
+        """ Checks if groups are expanded by the groups including them """
+        app, pm = mkapp(self._setuser, self._groups_for_user,
+                        "testuser1", None, "testgroup1")
+        pm.include_group("testgroup1", "testgroup2")
+        pm.include_group("testgroup4", "testgroup1", "testgroup3")
+
+        with app.test_request_context("/"):
+            g.current_user = "testuser2"
+            assert {"testgroup1", "testgroup2", "testgroup4"} == \
+                pm.get_groups("testuser2")
+            assert pm.check_rule(Rule(group="testgroup1"))
+
+            # Memoized groups are dropped
+            pm.exclude_group("testgroup1", "testgroup2")
+            assert not pm.check_rule(Rule(group="testgroup1"))
+            assert not pm.check_rule(Rule(group="testgroup4"))
+            assert [True, False] == pm.check_granted_many(
+                [("testuser3", "testgroup4"), ("testuser3", "testgroup1")])
+
+    def test_check_rule(self):
+        """ Checks if compiled rules are evaluated correctly """
+        app, pm = mkapp(self._setuser, self._groups_for_user,
+                        "testuser1", None, "testgroup1")
+
+        with app.test_request_context("/"):
+            g.current_user = "testuser2"
+            assert pm.check_rule(Rule(owner="testuser2"))
+            assert pm.check_rule(Rule(group="testgroup2"))
+            assert not pm.check_rule(Rule(owner="testuser1",
+                                          group="testgroup1"))
+
+
+class PermissionManagerHookTest(PermissionManagerBaseTest):
+
+    def _get_client(self, manager):
+        """ Creates a client with views of a `PermissionManager` subclass """
+        app = Flask(__name__)
+        pm = manager(app)
+        pm.groups_for_user(self._groups_for_user)
+
+        @app.before_request
+        def login():
+            g.current_user = request.args.get("user")
+
+        @app.route("/single")
+        @pm.chown(group="testgroup1")
+        def single():
+            return "OK"
+
+        @app.route("/multiple")
+        @pm.chown(group=["testgroup1", "testgroup3"])
+        def multiple():
+            return "OK"
+
+        @app.route("/async")
+        @pm.chown(group="testgroup1")
+        async def async_single():
+            return "OK"
+
+        return app.test_client()
+
+    def test_user_in_group_override(self):
+        """ Checks if rules with a single group are checked by an overridden
+        `user_in_group`, for sync and async views
+        """
+        class SuspendingManager(PermissionManager):
+            def user_in_group(self, user, group):
+                if user == "testuser1":
+                    return False
+                return user == "testuser3" or super().user_in_group(user,
+                                                                    group)
+
+        client = self._get_client(SuspendingManager)
+        for path in ("/single", "/async"):
+            # Denied although member, granted although not
+            assert 401 == client.open(path + "?user=testuser1").status_code
+            assert 200 == client.open(path + "?user=testuser3").status_code
+            assert 401 == client.open(path + "?user=testuser2").status_code
+
+    def test_user_in_groups_override(self):
+        """ Checks if rules with multiple groups are checked by an overridden
+        `user_in_groups`
+        """
+        class DenyingManager(PermissionManager):
+            def user_in_groups(self, user, groups, require_all=False):
+                return False
+
+        client = self._get_client(DenyingManager)
+        assert 401 == client.open("/multiple?user=testuser1").status_code
+        assert 200 == client.open("/single?user=testuser1").status_code
+
+
+class PermissionManagerEnforceTest(PermissionManagerBaseTest):
+
+    def _get_app(self, config=None):
+        """ Creates an app enforcing rules in a `before_request` hook """
+        app = Flask(__name__)
+        app.config.update(config or {})
+
+        @app.before_request
+        def login():
+            g.current_user = request.args.get("user")
+
+        pm = PermissionManager()
+        pm.groups_for_user(self._groups_for_user)
+        pm.init_app(app, enforce=True)
+
+        @app.route("/")
+        def index():
+            return "OK"
+
+        @app.route("/protected")
+        @pm.protect(group="testgroup1")
+        def protected():
+            return "OK"
+
+        @app.route("/redirect")
+        @pm.protect(owner="testuser2", action=lambda: ("Moved", 302))
+        def redirect():
+            return "OK"
+
+        admin = Blueprint("admin", __name__)
+        pm.protect_blueprint(admin, group="testgroup2")
+
+        @admin.route("/")
+        def admin_index():
+            return "OK"
+
+        @admin.route("/public")
+        @pm.public
+        def admin_public():
+            return "OK"
+
+        app.register_blueprint(admin, url_prefix="/admin")
+        return app, pm
+
+    def _status_codes(self, app, user, *paths):
+        client = app.test_client()
+        return [client.get(path, query_string={"user": user} if user else {})
+                .status_code for path in paths]
+
+    def test_view_rules(self):
+        """ Checks if rules of views are enforced """
+        app, pm = self._get_app()
+
+        assert [200, 200, 302] == self._status_codes(
+            app, "testuser1", "/", "/protected", "/redirect")
+        assert [200, 401, 200] == self._status_codes(
+            app, "testuser2", "/", "/protected", "/redirect")
+        assert [200, 401] == self._status_codes(app, None, "/", "/protected")
+        assert "testgroup1" in pm.group_registry
+
+    def test_blueprint_rules(self):
+        """ Checks if blueprint rules are enforced """
+        app, _ = self._get_app()
+
+        assert [200, 200] == self._status_codes(
+            app, "testuser2", "/admin/", "/admin/public")
+        assert [401, 200] == self._status_codes(
+            app, "testuser3", "/admin/", "/admin/public")
+
+    def test_config_rules(self):
+        """ Checks if rules of the config take precedence """
+        app, _ = self._get_app({
+            "CHOWN_DEFAULT_RULE": {"group": "testgroup3"},
+            "CHOWN_RULES": {"protected": None,
+                            "admin": {"owner": "testuser3"},
+                            "static": None}})
+
+        assert [401, 200, 200, 401] == self._status_codes(
+            app, "testuser1", "/", "/protected", "/admin/public", "/admin/")
+        assert [200, 200] == self._status_codes(
+            app, "testuser3", "/", "/admin/")
+        assert 404 == self._status_codes(app, None, "/missing")[0]
+
+    def test_multiple_managers(self):
+        """ Checks if managers of the same app enforce their own rules """
+        app, pm = self._get_app()
+        other = PermissionManager()
+        other.groups_for_user(
+            lambda user: ["othergroup"] if user == "testuser3" else [])
+        other.init_app(app, enforce=True)
+
+        @app.route("/other")
+        @other.protect(group="othergroup")
+        def other_view():
+            return "OK"
+
+        assert [200, 401] == self._status_codes(app, "testuser1",
+                                                "/protected", "/other")
+        assert [401, 200] == self._status_codes(app, "testuser3",
+                                                "/protected", "/other")
+        assert {"protected", "redirect", "admin.admin_index"} == set(
+            pm.build_route_table(app))
+        assert {"other_view"} == set(other.build_route_table(app))
+
+    def test_route_table(self):
+        """ Checks if the table contains the protected endpoints only """
+        app, pm = self._get_app()
+        table = pm.build_route_table(app)
+
+        assert {"protected", "redirect", "admin.admin_index"} == set(table)
+        assert {"testgroup1"} == table["protected"][0].groups
+
+
+class PermissionManagerAsyncTest(PermissionManagerBaseTest):
+
+    def _get_async_client(self, groups_for_user, **chown_kwargs):
+        """ Creates a client with an async view """
+        app, pm = mkapp(self._setuser, groups_for_user,
+                        "testuser1", None, "testgroup1")
+
+        @app.before_request
+        def login():
+            g.current_user = "testuser1"
+
+        @app.route("/async")
+        @pm.chown(**chown_kwargs)
+        async def async_index():
+            return "OK"
+
+        return app.test_client()
+
+    def test_async_view(self):
+        """ Checks if coroutine views are protected """
+        client = self._get_async_client(self._groups_for_user,
+                                        group="testgroup1")
+        assert 200 == client.open("/async").status_code
+
+        client = self._get_async_client(self._groups_for_user,
+                                        group="testgroup3")
+        assert 401 == client.open("/async").status_code
+
+    def test_async_callback(self):
+        """ Checks if async callbacks work for sync and async views """
+        async def groups_for_user(username):
+            return self._groups_for_user(username)
+
+        client = self._get_async_client(groups_for_user,
+                                        group="testgroup2")
+        assert 200 == client.open("/async").status_code
+        assert 200 == client.open("/").status_code
+
+        client = self._get_async_client(groups_for_user,
+                                        group="testgroup3")
+        assert 401 == client.open("/async").status_code
+
+    def test_check_granted_async(self):
+        """ Checks if async callbacks are awaited by checks within async
+        views
+        """
+        async def groups_for_user(username):
+            return self._groups_for_user(username)
+
+        app, pm = mkapp(self._setuser, groups_for_user,
+                        "testuser1", None, "testgroup1")
+        results = []
+
+        @app.route("/check")
+        async def check():
+            g.current_user = "testuser1"
+            try:
+                pm.check_granted(None, "testgroup2")
+            except PermissionManagerException as e:
+                results.append(e)
+            results.append(await pm.check_granted_async(None, "testgroup2"))
+            results.append(await pm.check_granted_async(None, "testgroup3"))
+            return "OK"
+
+        assert 200 == app.test_client().open("/check").status_code
+        assert isinstance(results[0], PermissionManagerException)
+        assert [True, False] == results[1:]
@@ -0,0 +1,120 @@
+import unittest
+import os
+import shutil
+import tempfile
+from time import sleep
+from flask import Flask
+from flask_chown import SnapshotPermissionManager
+from flask_chown.permission_manager_snapshot import write_snapshot
+from .helper import setuser
+
+
+class SnapshotPermissionManagerTest(unittest.TestCase):
+    """ Tests the snapshot based permission manager """
+
+    def setUp(self):
+        """ Setup the testcase """
+        self._tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self._tmpdir, "groups.snapshot")
+        write_snapshot(self.path, {"testuser1": ["testgroup1", "testgroup2"],
+                                   "testuser2": ["testgroup2"],
+                                   "testuser3": []})
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_lookup(self):
+        """ Checks if groups are read from the snapshot """
+        pm = SnapshotPermissionManager(path=self.path)
+
+        assert 3 == pm.users
+        assert {"testgroup1", "testgroup2"} == pm.get_groups("testuser1")
+        assert {"testgroup2"} == pm.get_groups("testuser2")
+        assert frozenset() == pm.get_groups("testuser3")
+        assert frozenset() == pm.get_groups("testuser4")
+        assert [True, False] == pm.check_granted_many(
+            [("testuser1", "testgroup1"), ("testuser2", "testgroup1")])
+
+    def test_group_hierarchy(self):
+        """ Checks if snapshot groups are expanded """
+        pm = SnapshotPermissionManager(path=self.path)
+        assert not pm.user_in_group("testuser2", "testgroup3")
+
+        pm.include_group("testgroup3", "testgroup2")
+        assert pm.user_in_group("testuser2", "testgroup3")
+        assert {"testgroup1", "testgroup2", "testgroup3"} == pm.get_groups(
+            "testuser1")
+
+    def test_reload_during_lookup(self):
+        """ Checks if groups read from a replaced snapshot are not cached for
+        the new one
+        """
+        pm = SnapshotPermissionManager(path=self.path)
+        cache = pm._snapshot.cache
+        store = cache.set
+
+        def reloading_set(user, groups):
+            # The snapshot is replaced right before the result is cached
+            write_snapshot(self.path, {"testuser1": ["testgroup2"]})
+            pm.reload()
+            store(user, groups)
+
+        cache.set = reloading_set
+        assert {"testgroup1", "testgroup2"} == pm.get_groups("testuser1")
+        assert {"testgroup2"} == pm._resolve_groups("testuser1")
+
+    def test_many_users(self):
+        """ Checks if the binary search finds every user """
+        write_snapshot(self.path, (("user{}".format(i), ["g{}".format(i % 7)])
+                                   for i in range(1000)))
+        pm = SnapshotPermissionManager(path=self.path, cache_size=0)
+
+        for i in range(1000):
+            assert {"g{}".format(i % 7)} == pm.get_groups("user{}".format(i))
+        assert frozenset() == pm.get_groups("user")
+
+    def test_request(self):
+        """ Checks if views are protected """
+        app = Flask(__name__)
+        pm = SnapshotPermissionManager(app, path=self.path)
+
+        @app.route("/")
+        @setuser("testuser2")
+        @pm.chown(group="testgroup2")
+        def index():
+            return "Hello World"
+
+        @app.route("/denied")
+        @setuser("testuser2")
+        @pm.chown(group="testgroup1")
+        def denied():
+            return "Hello World"
+
+        client = app.test_client()
+        assert 200 == client.open("/").status_code
+        assert 401 == client.open("/denied").status_code
+
+    def test_reload(self):
+        """ Checks if a changed snapshot is reloaded """
+        pm = SnapshotPermissionManager(path=self.path, check_interval=0)
+        assert not pm.user_in_group("testuser3", "testgroup3")
+
+        sleep(0.01)
+        write_snapshot(self.path, {"testuser3": ["testgroup3"]})
+        assert pm.user_in_group("testuser3", "testgroup3")
+        assert 1 == pm.users
+
+    def test_invalid(self):
+        """ Checks if invalid snapshots are rejected, a loaded snapshot is
+        kept
+        """
+        pm = SnapshotPermissionManager(path=self.path, check_interval=0)
+
+        invalid = os.path.join(self._tmpdir, "invalid")
+        with open(invalid, "wb") as f:
+            f.write(b"invalid snapshot file")
+        os.replace(invalid, self.path)
+
+        assert pm.user_in_group("testuser1", "testgroup1")
+        with self.assertRaises(ValueError):
+            SnapshotPermissionManager(path=self.path)